@@ -0,0 +1,312 @@
+"""
+This script benchmarks the build and the queries on a synthetic dataset (see
+`lastfm_dataset.synthetic`), e.g. `python scripts/benchmark.py --scale 0.05`.
+
+Every `populate_*` stage of a bulk loaded build from synthetic raw inputs is timed once,
+then every `get_*` and `iter_*` function of `lastfm_dataset.get` `--repeat` times on the
+result. Results are written as json to `data/benchmarks/<commit>.json`, pass an earlier
+result with `--baseline` to print the change of every timing.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Callable, Dict, Optional
+
+from lastfm_dataset import get
+from lastfm_dataset.constants import DATA_DIR, ROOT_DIR
+from lastfm_dataset.create import base_data, track_and_tags_data
+from lastfm_dataset.create.base_data import (
+    BULK_LOAD_PRAGMAS,
+    create_all_tables,
+    create_database_file,
+    finish_bulk_load,
+    set_pragmas,
+)
+from lastfm_dataset.create.colistened_data import populate_colistened_table
+from lastfm_dataset.create.lastfm_corpus import scan_lastfm_corpus
+from lastfm_dataset.create.similars_data import populate_similars_table
+from lastfm_dataset.create.track_and_tags_data import (
+    get_all_song_names,
+    populate_tracks_table,
+)
+from lastfm_dataset.create.user_behavior_data import populate_users_table
+from lastfm_dataset.get import User, get_connection
+from lastfm_dataset.synthetic import (
+    redirect_inputs,
+    sample_dataset,
+    write_database,
+    write_raw_inputs,
+)
+
+log = logging.getLogger(__name__)
+
+TABLES = ["tracks", "users", "track_tags", "similar", "track_users", "colistened"]
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _timed(timings: Dict[str, float], name: str, call: Callable):
+    start = time.perf_counter()
+    result = call()
+    timings[name] = round(time.perf_counter() - start, 6)
+    log.info(f"{name} took {timings[name]:.3f}s.")
+    return result
+
+
+def prepare_raw_inputs(directory: str, scale: float, seed: int) -> str:
+    """Writes the synthetic raw inputs below `directory/raw` unless they exist already
+    for the same scale and seed, so repeated runs (e.g. on other commits) share them."""
+    raw = os.path.join(directory, "raw")
+    marker = os.path.join(raw, "synthetic.json")
+    settings = {"scale": scale, "seed": seed}
+    if os.path.isfile(marker):
+        with open(marker) as fj:
+            if json.load(fj) == settings:
+                log.info(f"Re-using the raw inputs in {raw}.")
+                return raw
+    shutil.rmtree(raw, ignore_errors=True)
+    log.info(f"Writing raw inputs for scale {scale} to {raw}.")
+    write_raw_inputs(raw, sample_dataset(scale, seed))
+    with open(marker, "w") as fj:
+        json.dump(settings, fj)
+    return raw
+
+
+def benchmark_build(raw: str) -> Dict[str, float]:
+    """Seconds per stage of a cold, bulk loaded build from the raw inputs in `raw`."""
+    timings = {}
+    with redirect_inputs(raw):
+        for path in [
+            base_data.PATH_TO_LASTFM_MANIFEST,
+            track_and_tags_data.PATH_TO_NAME2ID_MAPPING,
+            base_data.PATH_TO_RESULT,
+        ]:
+            if os.path.isfile(path):
+                os.remove(path)
+        with create_database_file() as con:
+            set_pragmas(con, BULK_LOAD_PRAGMAS)
+            create_all_tables(con, defer_keys=True)
+            song_names = set(get_all_song_names())
+            # the second scan reads the manifest written by the first
+            for name in ["scan_lastfm_corpus", "scan_lastfm_corpus_warm"]:
+                scan = _timed(
+                    timings,
+                    name,
+                    lambda: scan_lastfm_corpus(
+                        song_names=song_names,
+                        manifest_path=base_data.PATH_TO_LASTFM_MANIFEST,
+                    ),
+                )
+            _timed(
+                timings,
+                "populate_tracks_table",
+                lambda: populate_tracks_table(con, scan=scan),
+            )
+            _timed(timings, "populate_users_table", lambda: populate_users_table(con))
+            _timed(
+                timings,
+                "populate_similars_table",
+                lambda: populate_similars_table(con, scan=scan),
+            )
+            _timed(
+                timings,
+                "populate_colistened_table",
+                lambda: populate_colistened_table(con),
+            )
+            _timed(timings, "finish_bulk_load", lambda: finish_bulk_load(con))
+    return timings
+
+
+def _summary(seconds):
+    return {
+        "min": round(min(seconds), 6),
+        "median": round(statistics.median(seconds), 6),
+        "mean": round(statistics.mean(seconds), 6),
+    }
+
+
+def benchmark_queries(path: str, n: int, repeat: int, seed: int) -> Dict[str, Dict]:
+    """Seconds per call of every lookup of `lastfm_dataset.get` for `n` random ids."""
+    rng = random.Random(seed)
+    with get_connection(path) as con:
+        track_ids = [r["track_id"] for r in con.execute("SELECT track_id FROM tracks;")]
+        user_ids = [r["user_id"] for r in con.execute("SELECT user_id FROM users;")]
+        tags = [r["name"] for r in con.execute("SELECT name FROM tag_names;")]
+        middle_track, middle_user = len(track_ids) // 2, len(user_ids) // 2
+        track_ids = rng.sample(track_ids, min(n, len(track_ids)))
+        user_ids = rng.sample(user_ids, min(n, len(user_ids)))
+        tracks = get.get_tracks_by_ids(con, track_ids)
+        users = [User(_id) for _id in user_ids]
+        calls = {
+            "get_tracks_by_ids": lambda: get.get_tracks_by_ids(con, track_ids),
+            "get_tracks": lambda: get.get_tracks(con, offset=middle_track, limit=100),
+            "get_tags": lambda: get.get_tags(con, tracks),
+            "get_tracks_by_tag": lambda: get.get_tracks_by_tag(con, tags[0]),
+            "get_tracks_by_tags": lambda: get.get_tracks_by_tags(
+                con, tags[:3], match="all"
+            ),
+            "get_similars": lambda: get.get_similars(con, track_ids),
+            "get_colistened": lambda: get.get_colistened(con, track_ids),
+            "get_users": lambda: get.get_users(con, offset=middle_user, limit=100),
+            "get_users_by_ids": lambda: get.get_users_by_ids(con, user_ids),
+            "get_track_listeners": lambda: get.get_track_listeners(con, tracks),
+            "get_user_listening_history": lambda: get.get_user_listening_history(
+                con, users
+            ),
+            "iter_tracks": lambda: sum(1 for _ in get.iter_tracks(con)),
+            "iter_users": lambda: sum(1 for _ in get.iter_users(con)),
+            "iter_track_users": lambda: sum(1 for _ in get.iter_track_users(con)),
+        }
+        missing = [
+            name
+            for name in dir(get)
+            if name.startswith(("get_", "iter_"))
+            and name != "get_connection"
+            and name not in calls
+        ]
+        if missing:
+            log.warning(f"Not benchmarked: {missing}")
+
+        results = {}
+        for name, call in calls.items():
+            seconds = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                call()
+                seconds.append(time.perf_counter() - start)
+            results[name] = _summary(seconds)
+            log.info(f"{name} took {results[name]['median']:.4f}s (median).")
+    return results
+
+
+def count_rows(path: str) -> Dict[str, int]:
+    with get_connection(path) as con:
+        return {
+            table: con.execute(f"SELECT count(*) AS n FROM {table};").fetchone()["n"]
+            for table in TABLES
+        }
+
+
+def compare(result: Dict, baseline: Dict) -> Dict[str, float]:
+    """Ratio current / baseline of every timing both results have, slowest change first."""
+    ratios = {}
+    for name, seconds in result["build"].items():
+        if baseline["build"].get(name):
+            ratios[f"build.{name}"] = seconds / baseline["build"][name]
+    for name, summary in result["queries"].items():
+        if baseline["queries"].get(name, {}).get("median"):
+            ratios[f"queries.{name}"] = (
+                summary["median"] / baseline["queries"][name]["median"]
+            )
+    return {
+        name: round(ratio, 3)
+        for name, ratio in sorted(ratios.items(), key=lambda item: -item[1])
+    }
+
+
+def main(
+    scale: float,
+    seed: int,
+    n: int,
+    repeat: int,
+    out: Optional[str],
+    work_dir: Optional[str],
+    baseline: Optional[str],
+    skip_build: bool,
+):
+    directory = work_dir or tempfile.mkdtemp(prefix="benchmark-")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        if skip_build:
+            build = {}
+            path = os.path.join(directory, "dataset.db")
+            write_database(path, sample_dataset(scale, seed), overwrite=True)
+        else:
+            raw = prepare_raw_inputs(directory, scale, seed)
+            build = benchmark_build(raw)
+            path = os.path.join(raw, os.path.basename(base_data.PATH_TO_RESULT))
+        queries = benchmark_queries(path, n, repeat, seed)
+        rows = count_rows(path)
+    finally:
+        if work_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    commit = _git("rev-parse", "HEAD")
+    result = {
+        "commit": commit,
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "scale": scale,
+        "seed": seed,
+        "n": n,
+        "repeat": repeat,
+        "rows": rows,
+        "build": build,
+        "queries": queries,
+    }
+    if out is None:
+        out = os.path.join(
+            ROOT_DIR, DATA_DIR, "benchmarks", f"{commit or 'unknown'}.json"
+        )
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as fj:
+        json.dump(result, fj, indent=2)
+    log.info(f"Wrote results to {out}.")
+    if baseline is not None:
+        with open(baseline) as fj:
+            print(json.dumps(compare(result, json.load(fj)), indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--scale", type=float, default=0.01, help="1.0 is the real size"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n", type=int, default=1000, help="Ids per lookup")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query")
+    parser.add_argument("--out", default=None, help="Path of the json result")
+    parser.add_argument(
+        "--work-dir",
+        default=None,
+        help="Keeps the synthetic inputs here and re-uses them, default a temporary dir.",
+    )
+    parser.add_argument("--baseline", default=None, help="Earlier result to compare")
+    parser.add_argument(
+        "--skip-build",
+        action="store_true",
+        help="Only benchmark the queries, on a database written directly.",
+    )
+    args = parser.parse_args()
+    main(
+        args.scale,
+        args.seed,
+        args.n,
+        args.repeat,
+        args.out,
+        args.work_dir,
+        args.baseline,
+        args.skip_build,
+    )
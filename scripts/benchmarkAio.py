@@ -0,0 +1,77 @@
+"""
+This script measures the latency of `lastfm_dataset.aio` under many concurrent requests,
+e.g. `python scripts/benchmarkAio.py --concurrency 1000 --requests 20000`.
+Every request looks up a single random track with `get_tracks_by_ids` and `get_similars`.
+Latency percentiles are printed as json.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+
+import lastfm_dataset
+from lastfm_dataset import aio
+from lastfm_dataset.constants import PATH_TO_RESULT
+from lastfm_dataset.get import get_connection
+
+log = logging.getLogger(__name__)
+
+
+async def _run(track_ids, concurrency: int, requests: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def request():
+        async with semaphore:
+            track_id = random.choice(track_ids)
+            start = time.perf_counter()
+            await aio.get_tracks_by_ids([track_id])
+            await aio.get_similars([track_id])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[request() for _ in range(requests)])
+    return latencies, time.perf_counter() - start
+
+
+def main(path: str, concurrency: int, requests: int, workers: int, batch_delay: float):
+    with get_connection(path) as con:
+        track_ids = [r["track_id"] for r in con.execute("SELECT track_id FROM tracks;")]
+    lastfm_dataset.init(path)
+    aio.init(max_workers=workers, batch_delay=batch_delay)
+    try:
+        latencies, seconds = asyncio.run(_run(track_ids, concurrency, requests))
+    finally:
+        aio.close()
+        lastfm_dataset.init(None)
+
+    latencies.sort()
+    result = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "workers": workers,
+        "batch_delay": batch_delay,
+        "requests_per_second": round(requests / seconds, 1),
+        "latency_ms": {
+            f"p{p}": round(
+                1000 * latencies[min(len(latencies) - 1, len(latencies) * p // 100)], 3
+            )
+            for p in (50, 90, 99)
+        },
+    }
+    result["latency_ms"]["max"] = round(1000 * latencies[-1], 3)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default=PATH_TO_RESULT, help="Path to the dataset")
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=aio.DEFAULT_MAX_WORKERS)
+    parser.add_argument("--batch-delay", type=float, default=0.0, help="In seconds")
+    args = parser.parse_args()
+    main(args.db, args.concurrency, args.requests, args.workers, args.batch_delay)
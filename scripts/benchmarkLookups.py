@@ -0,0 +1,62 @@
+"""
+This script times the bulk lookups of `lastfm_dataset.get` for a large number of ids,
+e.g. `python scripts/benchmarkLookups.py --n 100000`. Results are printed as json.
+"""
+import argparse
+import json
+import logging
+import time
+
+from lastfm_dataset.constants import PATH_TO_RESULT
+from lastfm_dataset.get import (
+    User,
+    get_connection,
+    get_similars,
+    get_tags,
+    get_track_listeners,
+    get_tracks_by_ids,
+    get_user_listening_history,
+    get_users_by_ids,
+)
+
+log = logging.getLogger(__name__)
+
+
+def main(path: str, n: int):
+    with get_connection(path) as con:
+        track_ids = [
+            r["track_id"]
+            for r in con.execute("SELECT track_id FROM tracks LIMIT ?;", (n,))
+        ]
+        user_ids = [
+            r["user_id"]
+            for r in con.execute("SELECT user_id FROM users LIMIT ?;", (n,))
+        ]
+        tracks = get_tracks_by_ids(con, track_ids)
+        users = [User(_id) for _id in user_ids]
+        calls = {
+            "get_tracks_by_ids": lambda: get_tracks_by_ids(con, track_ids),
+            "get_tags": lambda: get_tags(con, tracks),
+            "get_similars": lambda: get_similars(con, track_ids),
+            "get_track_listeners": lambda: get_track_listeners(con, tracks),
+            "get_users_by_ids": lambda: get_users_by_ids(con, user_ids),
+            "get_user_listening_history": lambda: get_user_listening_history(
+                con, users
+            ),
+        }
+        result = {"n_tracks": len(track_ids), "n_users": len(user_ids), "seconds": {}}
+        for name, call in calls.items():
+            start = time.perf_counter()
+            call()
+            result["seconds"][name] = round(time.perf_counter() - start, 4)
+            log.info(f"{name}: {result['seconds'][name]}s")
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db", default=PATH_TO_RESULT, help="Path to the dataset")
+    parser.add_argument("--n", type=int, default=100_000, help="Number of ids")
+    args = parser.parse_args()
+    main(args.db, args.n)
@@ -0,0 +1,65 @@
+"""
+This script measures the throughput of `lastfm_dataset.sampler` over the exported
+interaction matrix (see `scripts/exportInteractionMatrix.py`),
+e.g. `python scripts/benchmarkSampler.py --batch-size 4096 --epochs 2`.
+Samples per second are printed as json.
+"""
+import argparse
+import json
+import logging
+import time
+
+from lastfm_dataset.constants import PATH_TO_INTERACTION_MATRIX
+from lastfm_dataset.matrix import load_interaction_matrix
+from lastfm_dataset.sampler import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_NUM_NEGATIVES,
+    DEFAULT_POPULARITY_ALPHA,
+    BatchSampler,
+)
+
+log = logging.getLogger(__name__)
+
+
+def main(args: argparse.Namespace):
+    matrix = load_interaction_matrix(args.matrix)
+    start = time.perf_counter()
+    sampler = BatchSampler(
+        matrix,
+        batch_size=args.batch_size,
+        num_negatives=args.num_negatives,
+        popularity_alpha=args.alpha,
+        exclude_positives=args.exclude_positives,
+    )
+    setup = time.perf_counter() - start
+
+    samples = 0
+    start = time.perf_counter()
+    for epoch in range(args.epochs):
+        for batch in sampler.iter_batches(epoch, prefetch_size=args.prefetch):
+            samples += len(batch.user_idx)
+    seconds = time.perf_counter() - start
+    result = {
+        "interactions": len(matrix.indices),
+        "batch_size": args.batch_size,
+        "num_negatives": args.num_negatives,
+        "popularity_alpha": args.alpha,
+        "exclude_positives": args.exclude_positives,
+        "prefetch": args.prefetch,
+        "setup_seconds": round(setup, 3),
+        "samples_per_second": round(samples / seconds, 1),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--matrix", default=PATH_TO_INTERACTION_MATRIX)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--num-negatives", type=int, default=DEFAULT_NUM_NEGATIVES)
+    parser.add_argument("--alpha", type=float, default=DEFAULT_POPULARITY_ALPHA)
+    parser.add_argument("--exclude-positives", action="store_true")
+    parser.add_argument("--prefetch", type=int, default=2)
+    parser.add_argument("--epochs", type=int, default=1)
+    main(parser.parse_args())
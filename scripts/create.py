@@ -1,23 +1,86 @@
 """ This scripts create the entire dataset from scratch. """
 
+import argparse
 import logging
+from typing import Optional
 
+from lastfm_dataset.constants import PATH_TO_RESULT
 from lastfm_dataset.create.base_data import (
     create_all_tables,
     create_database_file,
     populate_all_tables,
 )
+from lastfm_dataset.create.instrumentation import build_report, report_path
+from lastfm_dataset.create.pipeline import STAGES, run_pipeline
+from lastfm_dataset.create.shards import populate_all_tables_sharded
 
 log = logging.getLogger(__name__)
 
 
-def main():
+def main(
+    bulk_load: bool = False,
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    profile: bool = False,
+):
     log.info("Creating Tables.")
-    with create_database_file(overwrite_existing=True) as con:
-        create_all_tables(con)
-        populate_all_tables(con)
+    with build_report(
+        report_path(PATH_TO_RESULT),
+        profile,
+        database=PATH_TO_RESULT,
+        bulk_load=bulk_load,
+        parallel=parallel,
+    ), create_database_file(overwrite_existing=True, bulk_load=bulk_load) as con:
+        create_all_tables(con, defer_keys=bulk_load)
+        if parallel:
+            populate_all_tables_sharded(con, workers=workers)
+        else:
+            populate_all_tables(con, workers=workers)
 
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
-    main()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--bulk-load",
+        action="store_true",
+        help="Load with tuned pragmas and deferred keys, build keys and indexes at the end.",
+    )
+    parser.add_argument(
+        "--parallel",
+        action="store_true",
+        help="Load the users and similars in parallel processes into shards and merge them.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes, default all CPUs.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Build stage by stage and skip the stages completed by an earlier run.",
+    )
+    parser.add_argument(
+        "--force",
+        nargs="+",
+        default=[],
+        choices=[stage.name for stage in STAGES],
+        help="With --resume, rebuild these stages (and the ones depending on them).",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Dump a cProfile of every stage to data/build_profiles.",
+    )
+    args = parser.parse_args()
+    if args.resume:
+        run_pipeline(force=args.force, workers=args.workers, profile=args.profile)
+    else:
+        main(
+            bulk_load=args.bulk_load,
+            parallel=args.parallel,
+            workers=args.workers,
+            profile=args.profile,
+        )
@@ -1,7 +1,7 @@
 """
-This script create a dictionary where track names map to track ids from the MSD dataset.
-The process is very IO bound because we have to open 1m json files to check for the track name.
-Threading to the rescue, but still takes a couple of minutes.
+This script creates the mapping from the song ids of the Echo Nest taste profiles to the
+track ids of the MSD from `unique_tracks.txt`. It is written as a compact, memory mappable
+`.npy` file, see `lastfm_dataset.create.id_mapping`.
 """
 import json
 import logging
@@ -10,6 +10,7 @@ from lastfm_dataset.constants import (
     PATH_TO_SONG_ID2TRACK_ID_MAPPING,
     PATH_TO_SONG_ID2TRACK_ID_SUMMARY,
 )
+from lastfm_dataset.create.id_mapping import save_id_mapping
 from lastfm_dataset.create.user_behavior_data import get_song_id2track_id_mapping
 
 log = logging.getLogger(__name__)
@@ -18,8 +19,7 @@ log = logging.getLogger(__name__)
 def main():
     result, summary = get_song_id2track_id_mapping()
 
-    with open(PATH_TO_SONG_ID2TRACK_ID_MAPPING, "w") as fj:
-        json.dump(result, fj)
+    save_id_mapping(result, PATH_TO_SONG_ID2TRACK_ID_MAPPING)
     with open(PATH_TO_SONG_ID2TRACK_ID_SUMMARY, "w") as fj:
         json.dump(summary, fj)
 
@@ -0,0 +1,40 @@
+"""
+This script writes a synthetic dataset, e.g. `python scripts/createSyntheticData.py --scale 0.1`.
+The result database goes to `<out>/dataset.db` and the raw inputs of a build to `<out>/raw`,
+see `lastfm_dataset.synthetic`.
+"""
+import argparse
+import logging
+import os
+
+from lastfm_dataset.constants import DATA_DIR, ROOT_DIR
+from lastfm_dataset.synthetic import sample_dataset, write_database, write_raw_inputs
+
+log = logging.getLogger(__name__)
+
+
+def main(out: str, scale: float, seed: int, raw_inputs: bool):
+    dataset = sample_dataset(scale, seed)
+    log.info(
+        f"Sampled {len(dataset.track_ids)} tracks, {len(dataset.user_ids)} users and "
+        f"{len(dataset.track_users[0])} track-user pairs."
+    )
+    os.makedirs(out, exist_ok=True)
+    write_database(os.path.join(out, "dataset.db"), dataset, overwrite=True)
+    if raw_inputs:
+        write_raw_inputs(os.path.join(out, "raw"), dataset)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--out", default=os.path.join(ROOT_DIR, DATA_DIR, "synthetic"))
+    parser.add_argument(
+        "--scale", type=float, default=0.01, help="1.0 is the real size"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-raw-inputs", action="store_true", help="Only write the database."
+    )
+    args = parser.parse_args()
+    main(args.out, args.scale, args.seed, not args.no_raw_inputs)
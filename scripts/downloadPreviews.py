@@ -0,0 +1,40 @@
+"""
+This script downloads the 30sec Spotify preview of every track into `data/previews`,
+see `lastfm_dataset.previews`. An interrupted run continues where it stopped when started again.
+"""
+import argparse
+import json
+import logging
+
+from lastfm_dataset.constants import PATH_TO_PREVIEWS
+from lastfm_dataset.get import get_connection
+from lastfm_dataset.previews import (
+    DEFAULT_WORKERS,
+    download_previews,
+    iter_preview_urls,
+)
+
+log = logging.getLogger(__name__)
+
+
+def main(directory: str, workers: int, retry_failed: bool):
+    with get_connection() as con:
+        urls = list(iter_preview_urls(con))
+    counts = download_previews(
+        urls, directory, workers=workers, retry_failed=retry_failed
+    )
+    print(json.dumps(counts, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dir", default=PATH_TO_PREVIEWS, help="Target directory")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Retry tracks that failed permanently (e.g. HTTP 404) in an earlier run.",
+    )
+    args = parser.parse_args()
+    main(args.dir, args.workers, args.retry_failed)
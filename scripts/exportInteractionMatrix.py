@@ -0,0 +1,28 @@
+"""
+This script exports the user x track playcount matrix of the dataset as memory mappable
+`.npy` files (CSR arrays plus the sorted user and track ids), see `lastfm_dataset.matrix`.
+"""
+import logging
+import time
+
+from lastfm_dataset.constants import PATH_TO_INTERACTION_MATRIX
+from lastfm_dataset.get import get_connection
+from lastfm_dataset.matrix import build_interaction_matrix, save_interaction_matrix
+
+log = logging.getLogger(__name__)
+
+
+def main():
+    start = time.perf_counter()
+    with get_connection() as con:
+        matrix = build_interaction_matrix(con)
+    save_interaction_matrix(matrix, PATH_TO_INTERACTION_MATRIX)
+    log.info(
+        f"Exported {matrix.shape[0]} users x {matrix.shape[1]} tracks with {len(matrix.data)}"
+        f" interactions to {PATH_TO_INTERACTION_MATRIX} in {time.perf_counter() - start:.1f}s."
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
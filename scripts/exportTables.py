@@ -0,0 +1,58 @@
+"""
+This script exports the tables of the dataset in a columnar format for Spark and pandas,
+Parquet if pyarrow is installed and compressed `.npz` row groups otherwise,
+see `lastfm_dataset.export`.
+"""
+import argparse
+import json
+import logging
+import time
+
+from lastfm_dataset.constants import PATH_TO_EXPORT
+from lastfm_dataset.export import (
+    DEFAULT_ROW_GROUP_SIZE,
+    FORMATS,
+    TABLES,
+    export_tables,
+)
+from lastfm_dataset.get import get_connection
+
+log = logging.getLogger(__name__)
+
+
+def main(args: argparse.Namespace):
+    start = time.perf_counter()
+    with get_connection(args.db) as con:
+        manifest = export_tables(
+            con,
+            args.out,
+            tables=args.tables,
+            row_group_size=args.row_group_size,
+            file_format=args.format,
+            user_partitions=args.user_partitions,
+        )
+    log.info(f"Exported to {args.out} in {time.perf_counter() - start:.1f}s.")
+    print(
+        json.dumps(
+            {name: t["rows"] for name, t in manifest["tables"].items()}, indent=2
+        )
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--db", default=None, help="Database, data/dataset.db by default"
+    )
+    parser.add_argument("--out", default=PATH_TO_EXPORT, help="Target directory")
+    parser.add_argument("--tables", nargs="+", choices=list(TABLES), default=None)
+    parser.add_argument("--row-group-size", type=int, default=DEFAULT_ROW_GROUP_SIZE)
+    parser.add_argument("--format", choices=FORMATS, default=None)
+    parser.add_argument(
+        "--user-partitions",
+        type=int,
+        default=1,
+        help="Split track_users into this many partitions by user hash.",
+    )
+    main(parser.parse_args())
@@ -1,7 +1,7 @@
 """
 This script create a dictionary where track names map to track ids from the MSD dataset.
 The process is very IO bound because we have to open 1m json files to check for the track name.
-Threading to the rescue, but still takes a couple of minutes.
+The files are parsed once in a process pool, so it scales with the number of cores.
 """
 import json
 import logging
@@ -0,0 +1,38 @@
+"""
+This script brings an existing dataset to the current schema: the wide tags table is
+converted to the sparse `track_tags` layout, the secondary indexes used by
+`lastfm_dataset.get` are added and the `colistened` table is computed if it is missing. Databases created with the current `create.py` are up to date.
+"""
+import logging
+import sqlite3
+
+from lastfm_dataset import row_factory
+from lastfm_dataset.constants import PATH_TO_RESULT
+from lastfm_dataset.create.base_data import (
+    convert_tags_to_sparse,
+    create_all_indexes,
+    create_colistened_table,
+)
+from lastfm_dataset.create.colistened_data import populate_colistened_table
+
+log = logging.getLogger(__name__)
+
+
+def main():
+    con = sqlite3.connect(PATH_TO_RESULT, isolation_level=None)
+    con.row_factory = row_factory
+    try:
+        log.info(f"Upgrading {PATH_TO_RESULT}.")
+        convert_tags_to_sparse(con)
+        create_all_indexes(con)
+        create_colistened_table(con)
+        if con.execute("SELECT 1 FROM colistened LIMIT 1;").fetchone() is None:
+            populate_colistened_table(con)
+        con.execute("ANALYZE;")
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -2,18 +2,56 @@ import functools
 import pathlib
 import sqlite3
 from functools import wraps
-from typing import Union
+from typing import Dict, Optional, Union
+
+from lastfm_dataset import tracing
+from lastfm_dataset.pool import DEFAULT_CACHE_SIZE, DEFAULT_MMAP_SIZE, ConnectionPool
 
 DB_PATH: Union[None, str, pathlib.Path] = None
+_POOL: Optional[ConnectionPool] = None
+# `mmap_size` and `cache_size` of the last `init` with a path
+_POOL_OPTIONS: Dict[str, int] = {}
 
 
-def init(path: Union[str, pathlib.Path]):
+def init(
+    path: Union[None, str, pathlib.Path],
+    mmap_size: int = DEFAULT_MMAP_SIZE,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    trace: Optional[bool] = None,
+):
     """
     Tells the package where the db file is located so that the `get` module can
     create connection as needing the user to pass it everytime.
+
+    Connections are read-only, opened once per thread and re-used, see `ConnectionPool`.
+    Pass `None` to close them and go back to passing connections explicitly.
+
+    :param path: Location of the database
+    :param mmap_size: Bytes of the database file memory mapped per connection
+    :param cache_size: Page cache per connection in KiB
+    :param trace: Enable (or with False disable) query tracing, see `lastfm_dataset.tracing`.
+        None leaves it as it is, e.g. enabled by the environment.
     """
-    global DB_PATH
+    global DB_PATH, _POOL, _POOL_OPTIONS
+    if trace and not tracing.enabled():
+        tracing.enable()
+    elif trace is False:
+        tracing.disable()
+    if _POOL is not None:
+        _POOL.close()
+        _POOL = None
     DB_PATH = path
+    if path is not None:
+        _POOL_OPTIONS = {"mmap_size": mmap_size, "cache_size": cache_size}
+        _POOL = ConnectionPool(path, row_factory, **_POOL_OPTIONS)
+
+
+def _get_pool() -> ConnectionPool:
+    # `DB_PATH` may also have been assigned directly instead of through `init`, keep
+    # the settings of the last `init`, tracing is left as it is
+    if _POOL is None or _POOL.path != DB_PATH:
+        init(DB_PATH, **_POOL_OPTIONS)
+    return _POOL
 
 
 def row_factory(cur, row):
@@ -30,14 +68,16 @@ def maybe_wrap_connection(func):
         """A wrapper function"""
         global DB_PATH
         if DB_PATH is not None:
-            with sqlite3.connect(DB_PATH) as con:
-                con.row_factory = row_factory
-                if "con" in kwargs:
-                    kwargs.pop("con")
-                if len(args) > 0 and isinstance(args[0], sqlite3.Connection):
-                    args = args[1:]
-                return func(con, *args, **kwargs)
+            con = _get_pool().connection()
+            if "con" in kwargs:
+                kwargs.pop("con")
+            if len(args) > 0 and isinstance(args[0], sqlite3.Connection):
+                args = args[1:]
+            return tracing.trace_call(func, con, *args, **kwargs)
         else:
-            return func(*args, **kwargs)
+            return tracing.trace_call(func, *args, **kwargs)
 
     return wrapper
+
+
+tracing.enable_from_env()
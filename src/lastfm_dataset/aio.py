@@ -0,0 +1,248 @@
+""" Implements asyncio versions of the `lastfm_dataset.get` functions.
+
+The queries run on a bounded thread pool. Every thread uses its own read-only connection
+from the pool of `lastfm_dataset.init`, which has to be called first. Two things keep
+the number of SQL round trips low under many concurrent requests:
+
+- identical requests in flight at the same time share one query,
+- lookups by id that arrive within `batch_delay` seconds are merged into one lookup
+  of all their ids, and every caller gets the part of the result it asked for.
+
+Usage::
+
+    lastfm_dataset.init("data/dataset.db")
+    tracks = await lastfm_dataset.aio.get_tracks_by_ids(["TRAAAAA128F93437B1"])
+"""
+import asyncio
+import copy
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import lastfm_dataset
+from lastfm_dataset import get
+from lastfm_dataset.get import Track, User
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_BATCH_SIZE = 5000
+
+
+class _Lookup(NamedTuple):
+    """How to split the result of a lookup by id, like `cached_lookup` in `lastfm_dataset.cache`."""
+
+    result_key: Optional[Callable[[Any], str]] = None
+    default_factory: Optional[Callable] = None
+
+
+_LOOKUPS = {
+    "get_tracks_by_ids": _Lookup(result_key=lambda track: track.track_id),
+    "get_tags": _Lookup(),
+    "get_similars": _Lookup(),
+    "get_colistened": _Lookup(),
+    "get_users_by_ids": _Lookup(result_key=lambda user: user.user_id),
+    "get_track_listeners": _Lookup(default_factory=list),
+    "get_user_listening_history": _Lookup(default_factory=list),
+}
+
+
+def _entity_id(item: Any) -> str:
+    # Track and User tuples have their id first
+    return item if isinstance(item, str) else item[0]
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _copy(result: Any) -> Any:
+    """A copy of a shared result that callers can modify."""
+    if isinstance(result, list):
+        return list(result)
+    if isinstance(result, dict):
+        result = copy.copy(result)
+        result.update((k, list(v)) for k, v in result.items() if isinstance(v, list))
+    return result
+
+
+def _split(lookup: _Lookup, by_id: Dict[str, Any], ids: List[str]) -> Any:
+    """The part of a merged lookup for `ids`, shaped like a lookup of just `ids`.
+    `by_id` is the merged result keyed by id."""
+    ids = list(dict.fromkeys(ids))
+    if lookup.result_key is not None:
+        return [by_id[_id] for _id in ids if _id in by_id]
+    split = (
+        {} if lookup.default_factory is None else defaultdict(lookup.default_factory)
+    )
+    split.update((_id, by_id[_id]) for _id in ids if _id in by_id)
+    return split
+
+
+class AsyncReader:
+    """Runs `lastfm_dataset.get` functions on a thread pool with request coalescing and
+    batching of lookups by id. Use one reader per event loop."""
+
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        batch_delay: float = 0.0,
+        max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+    ):
+        """
+        :param max_workers: Number of threads, and so of database connections
+        :param batch_delay: Seconds a lookup by id waits for others to share its query.
+            With 0 only lookups issued in the same iteration of the event loop are merged.
+        :param max_batch_size: Number of ids at which a batch is sent without waiting
+        """
+        self.batch_delay = batch_delay
+        self.max_batch_size = max_batch_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="lastfm_dataset.aio"
+        )
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._batches: Dict[str, List[Tuple[List[Any], asyncio.Future]]] = {}
+        self._batch_sizes: Dict[str, int] = {}
+
+    async def call(self, name: str, *args, **kwargs) -> Any:
+        """Awaits `lastfm_dataset.get.<name>(*args, **kwargs)`. Requests equal to one that
+        is in flight wait for its result instead of querying again."""
+        if lastfm_dataset.DB_PATH is None:
+            raise RuntimeError(
+                "Call `lastfm_dataset.init` before using the aio module."
+            )
+        key = (name, _freeze(args), _freeze(sorted(kwargs.items())))
+        future = self._in_flight.get(key)
+        if future is None:
+            if name in _LOOKUPS and len(kwargs) == 0 and len(args) == 1:
+                future = asyncio.ensure_future(self._batched(name, list(args[0])))
+            else:
+                loop = asyncio.get_running_loop()
+                func = getattr(get, name)
+                future = loop.run_in_executor(
+                    self._executor, lambda: func(*args, **kwargs)
+                )
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return _copy(await asyncio.shield(future))
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    async def _batched(self, name: str, items: List[Any]) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        batch = self._batches.get(name)
+        if batch is None:
+            batch = self._batches[name] = []
+            self._batch_sizes[name] = 0
+            asyncio.get_running_loop().call_later(
+                self.batch_delay, self._flush, name, batch
+            )
+        batch.append((items, future))
+        self._batch_sizes[name] += len(items)
+        if self._batch_sizes[name] >= self.max_batch_size:
+            self._flush(name, batch)
+        return await future
+
+    def _flush(self, name: str, batch: List[Tuple[List[Any], asyncio.Future]]):
+        if self._batches.get(name) is not batch:  # already sent because it was full
+            return
+        del self._batches[name]
+        items = list({_entity_id(i): i for items, _ in batch for i in items}.values())
+        func = getattr(get, name)
+        loop = asyncio.get_running_loop()
+        query = loop.run_in_executor(self._executor, func, items)
+
+        def _resolve(done: asyncio.Future):
+            lookup = _LOOKUPS[name]
+            if done.exception() is None:
+                by_id = done.result()
+                if lookup.result_key is not None:
+                    by_id = {lookup.result_key(value): value for value in by_id}
+            for batch_items, future in batch:
+                if future.done():  # cancelled
+                    continue
+                if done.exception() is not None:
+                    future.set_exception(done.exception())
+                else:
+                    ids = [_entity_id(i) for i in batch_items]
+                    future.set_result(_split(lookup, by_id, ids))
+
+        query.add_done_callback(_resolve)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+_READER: Optional[AsyncReader] = None
+
+
+def init(
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    batch_delay: float = 0.0,
+    max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+):
+    """Configures the reader used by the module functions (replacing any previous one),
+    see `AsyncReader`. Optional, the defaults are used otherwise."""
+    global _READER
+    close()
+    _READER = AsyncReader(max_workers, batch_delay, max_batch_size)
+
+
+def close():
+    """Shuts the threads of the module functions down."""
+    global _READER
+    if _READER is not None:
+        _READER.close()
+        _READER = None
+
+
+def _reader() -> AsyncReader:
+    if _READER is None:
+        init()
+    return _READER
+
+
+async def get_tracks_by_ids(ids: List[str]) -> List[Track]:
+    return await _reader().call("get_tracks_by_ids", ids)
+
+
+async def get_tracks(offset: int = 0, limit: int = 100) -> List[Track]:
+    return await _reader().call("get_tracks", offset=offset, limit=limit)
+
+
+async def get_tags(tracks: List[Track]) -> Dict[str, List[str]]:
+    return await _reader().call("get_tags", tracks)
+
+
+async def get_tracks_by_tag(tag: str) -> List[Track]:
+    return await _reader().call("get_tracks_by_tag", tag)
+
+
+async def get_tracks_by_tags(tags: List[str], match: str = "any") -> List[Track]:
+    return await _reader().call("get_tracks_by_tags", tags, match=match)
+
+
+async def get_similars(tracks: List[Track]) -> Dict[str, List[str]]:
+    return await _reader().call("get_similars", tracks)
+
+
+async def get_colistened(tracks: List[Track]) -> Dict[str, List[str]]:
+    return await _reader().call("get_colistened", tracks)
+
+
+async def get_users(offset: int = 0, limit: int = 100) -> List[User]:
+    return await _reader().call("get_users", offset=offset, limit=limit)
+
+
+async def get_users_by_ids(ids: List[str]) -> List[User]:
+    return await _reader().call("get_users_by_ids", ids)
+
+
+async def get_track_listeners(tracks: List[Track]) -> Dict[str, List[str]]:
+    return await _reader().call("get_track_listeners", tracks)
+
+
+async def get_user_listening_history(users: List[User]) -> Dict[str, List[str]]:
+    return await _reader().call("get_user_listening_history", users)
@@ -0,0 +1,205 @@
+""" Implements an opt-in, process-local LRU cache for the per-entity lookups of `lastfm_dataset.get`.
+
+Enable it with `lastfm_dataset.cache.enable(max_entries=..., max_bytes=...)`. Results are cached
+per track or user id, so a batch call is answered from the cache for known ids and only the
+remaining ids go to SQLite. The cache of a database file is dropped as soon as the file's
+identity (device, inode) or its size or mtime change.
+"""
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+# Marks ids the database has no result for, so repeated lookups of them are hits as well.
+_ABSENT = object()
+
+
+def _sizeof(value: Any) -> int:
+    """Rough size of a cached value: the container plus its direct elements."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+class LRUCache:
+    """A thread-safe LRU cache bounded by number of entries and (approximate) bytes."""
+
+    def __init__(
+        self, max_entries: Optional[int] = 100_000, max_bytes: Optional[int] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._identities: Dict[str, Tuple] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_identity(self, path: str, identity: Tuple):
+        if self._identities.get(path, identity) != identity:
+            for key in [key for key in self._entries if key[0] == path]:
+                self._bytes -= self._entries.pop(key)[1]
+        self._identities[path] = identity
+
+    def get_many(
+        self, database: Tuple[str, Tuple], namespace: str, ids: List[str]
+    ) -> Tuple[Dict[str, Any], List[str]]:
+        """Returns the cached values and the ids that are not cached."""
+        path, identity = database
+        found, missing = {}, []
+        with self._lock:
+            self._check_identity(path, identity)
+            for _id in dict.fromkeys(ids):
+                key = (path, namespace, _id)
+                entry = self._entries.get(key)
+                if entry is None:
+                    missing.append(_id)
+                else:
+                    self._entries.move_to_end(key)
+                    found[_id] = entry[0]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(
+        self, database: Tuple[str, Tuple], namespace: str, values: Dict[str, Any]
+    ):
+        path, identity = database
+        with self._lock:
+            self._check_identity(path, identity)
+            for _id, value in values.items():
+                key = (path, namespace, _id)
+                size = _sizeof(value)
+                if key in self._entries:
+                    self._bytes -= self._entries.pop(key)[1]
+                self._entries[key] = (value, size)
+                self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._identities.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_CACHE: Optional[LRUCache] = None
+
+
+def enable(max_entries: Optional[int] = 100_000, max_bytes: Optional[int] = None):
+    """Turns on caching for the lookups in `lastfm_dataset.get` (replacing any previous cache).
+
+    :param max_entries: Maximum number of cached ids over all functions, `None` for no limit
+    :param max_bytes: Maximum approximate size of the cached values, `None` for no limit
+    """
+    global _CACHE
+    _CACHE = LRUCache(max_entries, max_bytes)
+
+
+def disable():
+    global _CACHE
+    _CACHE = None
+
+
+def stats() -> Dict[str, int]:
+    """Hit/miss counters and size of the cache. Empty if the cache is disabled."""
+    return {} if _CACHE is None else _CACHE.stats()
+
+
+def _database_identity(con: sqlite3.Connection) -> Optional[Tuple[str, Tuple]]:
+    cursor = con.cursor()
+    cursor.row_factory = None
+    path = next(
+        row[2] for row in cursor.execute("PRAGMA database_list;") if row[1] == "main"
+    )
+    if not path:  # in-memory or temporary database
+        return None
+    stat = os.stat(path)
+    return path, (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def _entity_id(item: Any) -> str:
+    # Track and User tuples have their id first
+    return item if isinstance(item, str) else item[0]
+
+
+def _copy(value: Any) -> Any:
+    # callers must not be able to modify cached lists
+    return list(value) if isinstance(value, list) else value
+
+
+def cached_lookup(
+    result_key: Optional[Callable[[Any], str]] = None,
+    default_factory: Optional[Callable] = None,
+):
+    """Caches a lookup `func(con, items)` per item id while the cache is enabled.
+
+    :param result_key: For lookups returning a list, gives the id of a result element.
+        Lookups without it return a dict keyed by id.
+    :param default_factory: Return a `defaultdict` with this factory, like the lookup does.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(con: sqlite3.Connection, *args, **kwargs):
+            cache = _CACHE
+            if cache is None or len(args) + len(kwargs) != 1:
+                return func(con, *args, **kwargs)
+            database = _database_identity(con)
+            if database is None:
+                return func(con, *args, **kwargs)
+            # a plain lookup `func(con, items)` or `func(con, ids=items)`
+            items = args[0] if len(args) == 1 else next(iter(kwargs.values()))
+            # read twice below, a generator would be empty the second time
+            items = list(items)
+
+            ids = [_entity_id(item) for item in items]
+            found, missing = cache.get_many(database, func.__name__, ids)
+            if len(missing) > 0:
+                missing_ids = set(missing)
+                fetched = func(con, [i for i in items if _entity_id(i) in missing_ids])
+                if result_key is not None:
+                    fetched = {result_key(value): value for value in fetched}
+                new = {_id: fetched.get(_id, _ABSENT) for _id in missing}
+                cache.put_many(database, func.__name__, new)
+                found.update(new)
+
+            present = [
+                (_id, _copy(found[_id]))
+                for _id in dict.fromkeys(ids)
+                if found[_id] is not _ABSENT
+            ]
+            if result_key is not None:
+                return [value for _, value in present]
+            result = {} if default_factory is None else defaultdict(default_factory)
+            result.update(present)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -9,9 +9,10 @@ PATH_TO_PROCESSED_DB = os.path.join(ROOT_DIR, DATA_DIR, "lastfm_dataset_2020.db"
 PATH_TO_TRAIN_TRIPLETS = os.path.join(ROOT_DIR, DATA_DIR, "train_triplets.txt")
 PATH_TO_NAME2ID_MAPPING = os.path.join(ROOT_DIR, DATA_DIR, "name2track_id_mapping.json")
 PATH_TO_NAME2ID_SUMMARY = os.path.join(ROOT_DIR, DATA_DIR, "name2track_id_summary.json")
+PATH_TO_LASTFM_MANIFEST = os.path.join(ROOT_DIR, DATA_DIR, "lastfm_manifest.db")
 PATH_TO_UNIQUE_TRACKS = os.path.join(ROOT_DIR, DATA_DIR, "unique_tracks.txt")
 PATH_TO_SONG_ID2TRACK_ID_MAPPING = os.path.join(
-    ROOT_DIR, DATA_DIR, "song_id2track_id_mapping.json"
+    ROOT_DIR, DATA_DIR, "song_id2track_id_mapping.npy"
 )
 PATH_TO_SONG_ID2TRACK_ID_SUMMARY = os.path.join(
     ROOT_DIR, DATA_DIR, "song_id2track_id_summary.json"
@@ -19,6 +20,9 @@ PATH_TO_SONG_ID2TRACK_ID_SUMMARY = os.path.join(
 PATH_TO_USER_TRACK_PAIR_COUNT = os.path.join(
     ROOT_DIR, DATA_DIR, "user_track_pair_count.json"
 )
+PATH_TO_INTERACTION_MATRIX = os.path.join(ROOT_DIR, DATA_DIR, "interaction_matrix")
+PATH_TO_EXPORT = os.path.join(ROOT_DIR, DATA_DIR, "export")
+PATH_TO_PREVIEWS = os.path.join(ROOT_DIR, DATA_DIR, "previews")
 
 TOTAL_TRACKS = 48056
 TOTAL_USERS = 954382
@@ -1,55 +1,193 @@
 """ Implements table creations. """
+import logging
 import os
 import sqlite3
 from contextlib import contextmanager
-from typing import List, Optional
+from typing import Dict, List, Optional, Union
 
 from lastfm_dataset import row_factory
-from lastfm_dataset.constants import PATH_TO_RESULT
+from lastfm_dataset.constants import PATH_TO_LASTFM_MANIFEST, PATH_TO_RESULT
+from lastfm_dataset.create.colistened_data import populate_colistened_table
+from lastfm_dataset.create.instrumentation import step
+from lastfm_dataset.create.lastfm_corpus import scan_lastfm_corpus
 from lastfm_dataset.create.similars_data import populate_similars_table
 from lastfm_dataset.create.track_and_tags_data import (
+    get_all_song_names,
     get_all_tags,
     populate_tracks_table,
 )
 from lastfm_dataset.create.user_behavior_data import populate_users_table
+from lastfm_dataset.create.utils import quote_identifier, transaction
+
+log = logging.getLogger(__name__)
+
+
+# Pragmas used while bulk loading. Durability is traded for speed since a failed
+# build is simply re-run.
+BULK_LOAD_PRAGMAS = {
+    "page_size": 16384,
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -512_000,  # in KiB, i.e. ~500MB
+    "temp_store": "MEMORY",
+}
+DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
 
 
 @contextmanager
-def create_database_file(overwrite_existing: bool = False):
-    if os.path.isfile(PATH_TO_RESULT) and not overwrite_existing:
-        raise FileExistsError(PATH_TO_RESULT)
-    con = sqlite3.connect(PATH_TO_RESULT, isolation_level=None)
+def create_database_file(
+    overwrite_existing: bool = False,
+    bulk_load: bool = False,
+    path: Optional[str] = None,
+):
+    """
+    Opens the result database for a build.
+
+    :param overwrite_existing: Drop all tables of an existing database
+    :param bulk_load: Tune the connection for bulk inserts. Create the tables with
+        `create_all_tables(con, defer_keys=True)`; keys, indexes and statistics are
+        built with `finish_bulk_load` when the block exits without error.
+    :param path: Location of the database, defaults to `PATH_TO_RESULT`
+    """
+    if path is None:
+        path = PATH_TO_RESULT
+    if os.path.isfile(path) and not overwrite_existing:
+        raise FileExistsError(path)
+    con = sqlite3.connect(path, isolation_level=None)
     if overwrite_existing:
         drop_all_tables(con)
     con.row_factory = row_factory
+    if bulk_load:
+        set_pragmas(con, BULK_LOAD_PRAGMAS)
 
     try:
         yield con
+        if bulk_load:
+            with step("indexes"):
+                finish_bulk_load(con)
     finally:
         con.close()
 
 
-def create_all_tables(con: sqlite3.Connection):
+def set_pragmas(con: sqlite3.Connection, pragmas: Dict[str, Union[str, int]]):
+    for name, value in pragmas.items():
+        con.execute(f"PRAGMA {name} = {value};").fetchall()
+
+
+def create_all_tables(con: sqlite3.Connection, defer_keys: bool = False):
+    """
+    :param con: Database connection
+    :param defer_keys: Create `similar` and `track_users` without their keys and skip the
+        secondary indexes so that inserts do not maintain B-trees.
+        Requires `finish_bulk_load` afterwards.
+    """
     tags = get_all_tags()
     create_track_table(con)
     create_users_table(con)
-    create_similar_table(con)
+    create_similar_table(con, with_keys=not defer_keys)
     create_tags_table(con, tags)
-    create_track_user_table(con)
+    create_track_user_table(con, with_keys=not defer_keys)
+    create_colistened_table(con)
+    if not defer_keys:
+        create_all_indexes(con)
+
+
+def create_all_indexes(con: sqlite3.Connection):
+    """Secondary indexes required by the queries in `lastfm_dataset.get`, so that none
+    of the lookups has to scan a full table. Safe to run on an existing database."""
+    sql = """
+        CREATE INDEX IF NOT EXISTS track_tags_tag_id ON track_tags (tag_id, track_id);
+        CREATE INDEX IF NOT EXISTS similar_track_id_a
+            ON similar (track_id_a, track_id_b, score);
+        CREATE INDEX IF NOT EXISTS track_users_user_id
+            ON track_users (user_id, track_id, playcount);
+    """
+    con.executescript(sql)
+
+
+def finish_bulk_load(con: sqlite3.Connection):
+    """
+    Turns a bulk loaded database into one with exactly the schema of a normal build:
+    tables created with deferred keys are copied into their final definition in one
+    pass sorted by primary key, the secondary indexes are built, then statistics are
+    gathered and the file is compacted.
+    """
+    deferred = [
+        ("similar", create_similar_table, "track_id_a, track_id_b", "OR IGNORE"),
+        ("track_users", create_track_user_table, "track_id, user_id", ""),
+    ]
+    for table, create_table, primary_key, conflict in deferred:
+        if not _has_primary_key(con, table):
+            log.info(f"Building primary key of {table}.")
+            with transaction(con), step(f"primary_key_{table}"):
+                con.execute(f"ALTER TABLE {table} RENAME TO {table}_bulk_load;")
+                create_table(con)
+                # rowid breaks ties so that, as with keys, the first inserted duplicate wins
+                con.execute(
+                    f"""
+                    INSERT {conflict} INTO {table}
+                    SELECT * FROM {table}_bulk_load ORDER BY {primary_key}, rowid;
+                """
+                )
+                con.execute(f"DROP TABLE {table}_bulk_load;")
+    log.info("Building secondary indexes.")
+    with step("secondary_indexes"):
+        create_all_indexes(con)
+    log.info("Analyzing and vacuuming the database.")
+    with step("analyze"):
+        con.execute("ANALYZE;")
+    set_pragmas(con, DEFAULT_PRAGMAS)
+    with step("vacuum"):
+        con.execute("VACUUM;")
+
+
+def _object_type(con: sqlite3.Connection, name: str) -> Optional[str]:
+    sql = "SELECT type FROM sqlite_master WHERE name = ?;"
+    cursor = con.cursor()
+    cursor.row_factory = None
+    row = cursor.execute(sql, (name,)).fetchone()
+    return None if row is None else row[0]
+
+
+def _has_primary_key(con: sqlite3.Connection, table: str) -> bool:
+    sql = "SELECT 1 FROM pragma_index_list(?) WHERE origin = 'pk';"
+    return con.execute(sql, (table,)).fetchone() is not None
 
 
 def drop_all_tables(con: sqlite3.Connection):
+    con.execute("""DROP TABLE IF EXISTS build_checkpoints;""")
+    con.execute("""DROP TABLE IF EXISTS colistened;""")
     con.execute("""DROP TABLE IF EXISTS track_users;""")
     con.execute("""DROP TABLE IF EXISTS similar;""")
-    con.execute("""DROP TABLE IF EXISTS tags;""")
+    # `tags` is a table in databases built before the sparse tag layout
+    if _object_type(con, "tags") == "table":
+        con.execute("""DROP TABLE IF EXISTS tags;""")
+    con.execute("""DROP VIEW IF EXISTS tags;""")
+    con.execute("""DROP TABLE IF EXISTS track_tags;""")
+    con.execute("""DROP TABLE IF EXISTS tag_names;""")
     con.execute("""DROP TABLE IF EXISTS users;""")
     con.execute("""DROP TABLE IF EXISTS tracks;""")
 
 
-def populate_all_tables(con: sqlite3.Connection, limit: Optional[int] = None):
-    populate_tracks_table(con, limit)
-    populate_users_table(con)
-    populate_similars_table(con)
+def populate_all_tables(
+    con: sqlite3.Connection, limit: Optional[int] = None, workers: Optional[int] = None
+):
+    # the LastFM json files are parsed once and shared by the tracks and similars stage
+    # and only files that changed since the last build are re-parsed (see the manifest)
+    with step("scan"):
+        scan = scan_lastfm_corpus(
+            song_names=set(get_all_song_names()),
+            workers=workers,
+            manifest_path=PATH_TO_LASTFM_MANIFEST,
+        )
+    with step("tracks"):
+        populate_tracks_table(con, limit, scan=scan)
+    with step("users"):
+        populate_users_table(con)
+    with step("similars"):
+        populate_similars_table(con, scan=scan)
+    with step("colistened"):
+        populate_colistened_table(con)
 
 
 def create_track_table(con: sqlite3.Connection):
@@ -76,18 +214,70 @@ def create_users_table(con: sqlite3.Connection):
 
 
 def create_tags_table(con: sqlite3.Connection, tags: List[str]):
-    tags_sql = ", ".join(f"'{tag_name}' INTEGER NOT NULL" for tag_name in tags)
-    sql = f"""
-        CREATE TABLE IF NOT EXISTS tags (
-            track_id INTEGER,
-            {tags_sql},
-            FOREIGN KEY (track_id) REFERENCES tracks (track_id)
+    """
+    Tags are stored sparse: `tag_names` holds the tag vocabulary (`tag_id` is the position
+    of the tag in `tags`) and `track_tags` one row per tag a track has.
+    The `tags` view keeps the wide layout with one 0/1 column per tag.
+    """
+    sql_tag_names = """
+        CREATE TABLE IF NOT EXISTS tag_names (
+            tag_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
         );
     """
-    con.execute(sql)
+    sql_track_tags = """
+        CREATE TABLE IF NOT EXISTS track_tags (
+            track_id TEXT NOT NULL, tag_id INTEGER NOT NULL,
+            PRIMARY KEY (track_id, tag_id),
+            FOREIGN KEY (track_id) REFERENCES tracks (track_id),
+            FOREIGN KEY (tag_id) REFERENCES tag_names (tag_id)
+        ) WITHOUT ROWID;
+    """
+    tags_sql = ",\n".join(
+        f"count(CASE WHEN track_tags.tag_id = {tag_id} THEN 1 END) AS {quote_identifier(tag_name)}"
+        for tag_id, tag_name in enumerate(tags)
+    )
+    sql_tags_view = f"""
+        CREATE VIEW IF NOT EXISTS tags AS
+        SELECT tracks.track_id AS track_id,
+            {tags_sql}
+        FROM tracks LEFT JOIN track_tags ON track_tags.track_id = tracks.track_id
+        GROUP BY tracks.track_id;
+    """
+    con.execute(sql_tag_names)
+    con.execute(sql_track_tags)
+    con.executemany(
+        "INSERT OR IGNORE INTO tag_names(tag_id, name) VALUES (?, ?);",
+        list(enumerate(tags)),
+    )
+    con.execute(sql_tags_view)
 
 
-def create_similar_table(con: sqlite3.Connection):
+def convert_tags_to_sparse(con: sqlite3.Connection):
+    """Converts the wide `tags` table of a database built with an older version into
+    the sparse layout of `create_tags_table`. Does nothing if it is already sparse."""
+    if _object_type(con, "tags") != "table":
+        return
+    cursor = con.cursor()
+    cursor.row_factory = None
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(tags);")]
+    tags = [column for column in columns if column != "track_id"]
+    log.info(f"Converting {len(tags)} tag columns to the sparse layout.")
+    with transaction(con):
+        con.execute("ALTER TABLE tags RENAME TO tags_wide;")
+        create_tags_table(con, tags)
+        for tag_id, tag in enumerate(tags):
+            con.execute(
+                f"""
+                INSERT OR IGNORE INTO track_tags(track_id, tag_id)
+                SELECT track_id, ? FROM tags_wide WHERE {quote_identifier(tag)} = 1;
+            """,
+                (tag_id,),
+            )
+        con.execute("DROP TABLE tags_wide;")
+
+
+def create_similar_table(con: sqlite3.Connection, with_keys: bool = True):
     sql = """
         CREATE TABLE IF NOT EXISTS similar (
             track_id_a INTEGER, track_id_b INTEGER, score REAL,
@@ -96,10 +286,31 @@ def create_similar_table(con: sqlite3.Connection):
             FOREIGN KEY (track_id_b) REFERENCES tracks (track_id)
         );
     """
+    if not with_keys:
+        sql = """
+            CREATE TABLE IF NOT EXISTS similar (
+                track_id_a INTEGER, track_id_b INTEGER, score REAL
+            );
+        """
+    con.execute(sql)
+
+
+def create_colistened_table(con: sqlite3.Connection):
+    """Top co-listened tracks of every track, `rank` 0 is the most similar.
+    See `populate_colistened_table`."""
+    sql = """
+        CREATE TABLE IF NOT EXISTS colistened (
+            track_id_a TEXT NOT NULL, rank INTEGER NOT NULL,
+            track_id_b TEXT NOT NULL, score REAL NOT NULL,
+            PRIMARY KEY (track_id_a, rank),
+            FOREIGN KEY (track_id_a) REFERENCES tracks (track_id),
+            FOREIGN KEY (track_id_b) REFERENCES tracks (track_id)
+        ) WITHOUT ROWID;
+    """
     con.execute(sql)
 
 
-def create_track_user_table(con: sqlite3.Connection):
+def create_track_user_table(con: sqlite3.Connection, with_keys: bool = True):
     sql = """
         CREATE TABLE IF NOT EXISTS track_users (
             track_id INTEGER, user_id INTEGER, playcount INTEGER,
@@ -108,4 +319,10 @@ def create_track_user_table(con: sqlite3.Connection):
             FOREIGN KEY (user_id) REFERENCES users (user_id)
         );
     """
+    if not with_keys:
+        sql = """
+            CREATE TABLE IF NOT EXISTS track_users (
+                track_id INTEGER, user_id INTEGER, playcount INTEGER
+            );
+        """
     con.execute(sql)
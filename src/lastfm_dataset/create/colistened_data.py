@@ -0,0 +1,167 @@
+""" Implements the co-listening similarity of tracks computed from `track_users`.
+
+Two tracks are similar if they share listeners: with `L(t)` the set of users of track `t`,
+cosine is `|L(a) & L(b)| / sqrt(|L(a)| * |L(b)|)` and jaccard `|L(a) & L(b)| / |L(a) | L(b)|`.
+The shared listener counts of a block of tracks against all tracks are one sparse product
+of the user x track matrix with itself, computed with NumPy by expanding every listener of
+the block into the tracks of that listener and counting the distinct (track, track) pairs.
+"""
+import logging
+import sqlite3
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from lastfm_dataset.create.instrumentation import current_step, step
+from lastfm_dataset.create.utils import transaction
+from lastfm_dataset.matrix import InteractionMatrix, build_interaction_matrix
+
+log = logging.getLogger(__name__)
+
+TOP_K = 50
+BLOCK_SIZE = 1024
+# Upper bound of expanded (track, track) pairs per block, a few hundred MB of arrays.
+MAX_PAIRS = 1 << 24
+METRICS = ("cosine", "jaccard")
+
+
+def _ranges(indptr: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions of all entries of the CSR `rows` and the index in `rows` they belong to."""
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    ends = np.cumsum(counts)
+    total = ends[-1] if len(ends) else 0
+    positions = np.repeat(starts - ends + counts, counts) + np.arange(total)
+    owners = np.repeat(np.arange(len(rows)), counts)
+    return positions, owners
+
+
+def _transpose(matrix: InteractionMatrix) -> Tuple[np.ndarray, np.ndarray]:
+    """Track x user CSR structure (`indptr`, `indices`) of the user x track matrix."""
+    num_users, num_tracks = matrix.shape
+    users = np.repeat(np.arange(num_users, dtype=np.int32), np.diff(matrix.indptr))
+    order = np.argsort(matrix.indices, kind="stable")
+    indptr = np.zeros(num_tracks + 1, dtype=np.int64)
+    np.cumsum(np.bincount(matrix.indices, minlength=num_tracks), out=indptr[1:])
+    return indptr, users[order]
+
+
+def _blocks(
+    pairs_indptr: np.ndarray, max_pairs: int, block_size: int
+) -> Iterator[Tuple[int, int]]:
+    """Consecutive (start, end) track ranges of at most `max_pairs` pairs and at most
+    `block_size` tracks. `pairs_indptr[t]` is the number of pairs of the tracks before `t`,
+    a track with more than `max_pairs` pairs gets a block of its own."""
+    num_tracks = len(pairs_indptr) - 1
+    start = 0
+    while start < num_tracks:
+        end = (
+            np.searchsorted(pairs_indptr, pairs_indptr[start] + max_pairs, "right") - 1
+        )
+        end = min(max(int(end), start + 1), start + block_size, num_tracks)
+        yield start, end
+        start = end
+
+
+def iter_colistened(
+    matrix: InteractionMatrix,
+    k: int = TOP_K,
+    metric: str = "cosine",
+    block_size: int = BLOCK_SIZE,
+    max_pairs: int = MAX_PAIRS,
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Computes the `k` most co-listened tracks of every track, a block of tracks at a time.
+    Memory per block is one entry per (listener of the block, track of that listener) pair,
+    blocks are cut so that their number of pairs stays within `max_pairs`.
+
+    :param matrix: User x track matrix, see `build_interaction_matrix`
+    :param k: Number of neighbours per track
+    :param metric: "cosine" or "jaccard" over the sets of listeners
+    :param block_size: Maximum number of tracks scored at once
+    :param max_pairs: Maximum number of pairs expanded at once, exceeded only by a single
+        track whose listeners alone have more
+    :return: Per block the track indices, their neighbour indices of shape
+        (len(block), k) ordered by descending score and the scores. Tracks with fewer
+        than `k` co-listened tracks are padded with -1 and 0.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"metric must be one of {METRICS}, got {metric}")
+    num_tracks = matrix.shape[1]
+    listeners_indptr, listeners = _transpose(matrix)
+    num_listeners = np.diff(listeners_indptr).astype(np.float64)
+    # every listener of a track expands into all tracks of that listener
+    pairs = np.zeros(len(listeners) + 1, dtype=np.int64)
+    np.cumsum(np.diff(matrix.indptr)[listeners], out=pairs[1:])
+
+    for start, end in _blocks(pairs[listeners_indptr], max_pairs, block_size):
+        block = np.arange(start, end)
+        positions, owners = _ranges(listeners_indptr, block)
+        positions, user_owners = _ranges(matrix.indptr, listeners[positions])
+        # (track of the block, co-listened track) pairs, one per shared listener
+        cells = owners[user_owners] * num_tracks + matrix.indices[positions]
+        cells, shared = np.unique(cells, return_counts=True)
+        rows, columns = np.divmod(cells, num_tracks)
+        keep = columns != block[rows]  # a track is not its own neighbour
+        rows, columns, shared = rows[keep], columns[keep], shared[keep]
+
+        if metric == "cosine":
+            denominator = np.sqrt(num_listeners[block[rows]] * num_listeners[columns])
+        else:
+            denominator = num_listeners[block[rows]] + num_listeners[columns] - shared
+        scores = shared / denominator
+
+        # per track descending score, ties keep the track_id order of `np.unique`
+        order = np.argsort(rows + (1.0 - scores) / 2, kind="stable")
+        rows, columns, scores = rows[order], columns[order], scores[order]
+        ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        top = ranks < k
+
+        neighbours = np.full((len(block), k), -1, dtype=np.int64)
+        top_scores = np.zeros((len(block), k), dtype=np.float32)
+        neighbours[rows[top], ranks[top]] = columns[top]
+        top_scores[rows[top], ranks[top]] = scores[top]
+        yield block, neighbours, top_scores
+
+
+def populate_colistened_table(
+    con: sqlite3.Connection,
+    k: int = TOP_K,
+    metric: str = "cosine",
+    block_size: int = BLOCK_SIZE,
+    matrix: Optional[InteractionMatrix] = None,
+    max_pairs: int = MAX_PAIRS,
+):
+    """(Re-)computes the `colistened` table from `track_users`, see `iter_colistened`.
+
+    :param con: Database connection
+    :param matrix: User x track matrix of the database, built from `con` if not given
+    """
+    sql_insert_colistened = """
+        INSERT INTO colistened(track_id_a, rank, track_id_b, score) VALUES (?,?,?,?);
+    """
+    if matrix is None:
+        log.info("Loading track_users.")
+        with step("load"):
+            matrix = build_interaction_matrix(con)
+    track_ids = matrix.track_ids.astype(str)
+    with transaction(con):
+        con.execute("DELETE FROM colistened;")
+    with tqdm(total=len(track_ids)) as pbar:
+        for block, neighbours, scores in iter_colistened(
+            matrix, k, metric, block_size, max_pairs
+        ):
+            rows, ranks = np.nonzero(neighbours >= 0)
+            data = zip(
+                track_ids[block[rows]].tolist(),
+                ranks.tolist(),
+                track_ids[neighbours[rows, ranks]].tolist(),
+                scores[rows, ranks].tolist(),
+            )
+            with transaction(con), step("insert") as s:
+                con.executemany(sql_insert_colistened, data)
+                s.rows_out += len(rows)
+            current_step().rows_out += len(rows)
+            pbar.update(len(block))
+    current_step().rows_in += len(matrix.indices)
@@ -0,0 +1,144 @@
+""" Implements a compact, memory mappable mapping between fixed width ids.
+
+It replaces the json dict from the ~1M song ids of `unique_tracks.txt` to their track
+ids: the pairs are one structured `.npy` array of 44 bytes per pair, so opening it is a
+memory map and costs nothing until it is read.
+
+The entries are sorted by a 64-bit hash of the key. A lookup hashes a batch of keys,
+binary searches the hashes and compares the keys it lands on, all vectorized. Comparing
+the hashes instead of the 18 byte ids is what makes the binary search fast.
+"""
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+ID_DTYPE = "S18"
+ENTRY_DTYPE = np.dtype([("hash", "<u8"), ("key", ID_DTYPE), ("value", ID_DTYPE)])
+
+Ids = Union[Sequence[str], Sequence[bytes], np.ndarray]
+
+
+def _as_ids(ids: Ids) -> Tuple[np.ndarray, np.ndarray]:
+    """`ids` as fixed width bytes and a mask of the ids that are not longer than that."""
+    ids = np.asarray(ids)
+    if ids.dtype.kind == "U":
+        ids = np.char.encode(ids, "ascii")
+    if ids.dtype.kind != "S":
+        ids = ids.astype(ID_DTYPE)
+    if ids.dtype.itemsize <= np.dtype(ID_DTYPE).itemsize:
+        return ids.astype(ID_DTYPE), np.ones(len(ids), dtype=bool)
+    valid = np.char.str_len(ids) <= np.dtype(ID_DTYPE).itemsize
+    return ids.astype(ID_DTYPE), valid
+
+
+def hash_ids(ids: np.ndarray) -> np.ndarray:
+    """64-bit hash of every id of the `ID_DTYPE` array `ids`, the same on every platform."""
+    words = np.zeros((len(ids), 3), dtype="<u8")
+    words.view(np.uint8)[:, : ids.dtype.itemsize] = ids.view(np.uint8).reshape(
+        len(ids), ids.dtype.itemsize
+    )
+    with np.errstate(over="ignore"):
+        h = words[:, 0] * np.uint64(0x9E3779B97F4A7C15)
+        h ^= words[:, 1] * np.uint64(0xC2B2AE3D27D4EB4F)
+        h ^= words[:, 2] * np.uint64(0x165667B19E3779F9)
+        # splitmix64 finalizer
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+    return h
+
+
+class IdMapping:
+    """Maps ids of at most 18 bytes to ids of at most 18 bytes, see the module docstring."""
+
+    def __init__(self, entries: np.ndarray):
+        self.entries = entries
+        self.hashes = entries["hash"]
+        self.keys = entries["key"]
+        self.values = entries["value"]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        values, found = self.lookup([key])
+        return values[0].decode() if found[0] else default
+
+    def lookup(self, keys: Ids) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Values of `keys` as `ID_DTYPE` array and a mask of the keys that were found,
+        the value of a missing key is empty.
+        """
+        keys, valid = _as_ids(keys)
+        values = np.zeros(len(keys), dtype=ID_DTYPE)
+        if len(keys) == 0 or len(self) == 0:
+            return values, np.zeros(len(keys), dtype=bool)
+        hashes = hash_ids(keys)
+        # searching sorted hashes walks the table in order, which is kinder to the cache
+        order = np.argsort(hashes)
+        index = np.empty(len(keys), dtype=np.int64)
+        index[order] = np.searchsorted(self.hashes, hashes[order])
+        index = np.minimum(index, len(self) - 1)
+        same_hash = self.hashes[index] == hashes
+        found = same_hash & (self.keys[index] == keys) & valid
+        # a different key with the same hash comes first, try the rest of the run
+        for i in np.flatnonzero(same_hash & ~found & valid).tolist():
+            j = index[i] + 1
+            while j < len(self) and self.hashes[j] == hashes[i]:
+                if self.keys[j] == keys[i]:
+                    index[i], found[i] = j, True
+                    break
+                j += 1
+        values[found] = self.values[index[found]]
+        return values, found
+
+    def with_values(self, values: Ids) -> "IdMapping":
+        """A copy with only the pairs whose value is in `values`."""
+        values, _ = _as_ids(values)
+        return IdMapping(self.entries[np.isin(self.values, values)])
+
+
+def build_id_mapping(keys: Ids, values: Ids) -> Tuple[IdMapping, np.ndarray]:
+    """
+    Builds the mapping from `keys[i]` to `values[i]`. A key listed more than once maps to
+    the value of its first occurrence.
+
+    :return: The mapping and the positions of the later occurrences of duplicated keys
+    """
+    keys, valid_keys = _as_ids(keys)
+    values, valid_values = _as_ids(values)
+    if len(keys) != len(values):
+        raise ValueError("keys and values must have the same length.")
+    if not (np.all(valid_keys) and np.all(valid_values)):
+        raise ValueError(f"Ids must be at most {np.dtype(ID_DTYPE).itemsize} bytes.")
+    hashes = hash_ids(keys)
+    # by hash, then by key, then by position, so duplicates follow their first occurrence
+    order = np.lexsort((np.arange(len(keys)), keys, hashes))
+    duplicated = np.zeros(len(keys), dtype=bool)
+    duplicated[1:] = keys[order[1:]] == keys[order[:-1]]
+    keep = order[~duplicated]
+    entries = np.empty(len(keep), dtype=ENTRY_DTYPE)
+    entries["hash"] = hashes[keep]
+    entries["key"] = keys[keep]
+    entries["value"] = values[keep]
+    return IdMapping(entries), np.sort(order[duplicated])
+
+
+def save_id_mapping(mapping: IdMapping, path: str):
+    """Writes the mapping as one `.npy` file."""
+    with open(path, "wb") as fh:
+        np.save(fh, mapping.entries)
+
+
+def load_id_mapping(path: str, mmap_mode: Optional[str] = "r") -> IdMapping:
+    """Loads a mapping written by `save_id_mapping`. With the default `mmap_mode` it is
+    memory mapped read-only instead of read into memory."""
+    entries = np.load(path, mmap_mode=mmap_mode)
+    if entries.dtype != ENTRY_DTYPE:
+        raise ValueError(f"{path} is not an id mapping.")
+    return IdMapping(entries)
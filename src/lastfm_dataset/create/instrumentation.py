@@ -0,0 +1,207 @@
+""" Implements the instrumentation of the build.
+
+The build marks its steps with `step`::
+
+    with step("insert") as s:
+        con.executemany(sql, rows)
+        s.rows_out += len(rows)
+
+Steps nest: a step entered while another one is active is recorded as its sub-step, and a
+sub-step entered again under the same name (e.g. once per batch) adds up. Inside
+`build_report` the steps are collected and written as json when the block exits, outside
+of it they are measured and discarded.
+
+Per step the report has wall and CPU time (of this process and of its terminated child
+processes, e.g. the workers of a process pool), rows in and out, rows per second, bytes
+read by this process (Linux only) and the peak RSS at the end of the step. `self_wall` is
+the time not spent in any sub-step, e.g. parsing between two inserts.
+"""
+import cProfile
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+# written next to the database, which may be the LastFM data dir: the corpus scan only
+# reads the TR*.json track files, see `lastfm_corpus.LASTFM_FILE_PATTERN`
+REPORT_NAME = "build_report.json"
+PROFILES_DIR = "build_profiles"
+
+
+class Step:
+    """Measurements of one step, see `step`. Code of the step adds its row counts."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.cpu_children = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.bytes_read: Optional[int] = None
+        self.peak_rss_kib: Optional[int] = None
+        self.peak_rss_children_kib: Optional[int] = None
+        self.steps: Dict[str, "Step"] = {}
+
+    def to_dict(self) -> Dict:
+        rows = self.rows_out or self.rows_in
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "wall": round(self.wall, 6),
+            "self_wall": round(self.wall - sum(s.wall for s in self.steps.values()), 6),
+            "cpu": round(self.cpu, 6),
+            "cpu_children": round(self.cpu_children, 6),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_sec": round(rows / self.wall, 1) if self.wall > 0 else None,
+            "bytes_read": self.bytes_read,
+            "peak_rss_kib": self.peak_rss_kib,
+            "peak_rss_children_kib": self.peak_rss_children_kib,
+            "steps": [s.to_dict() for s in self.steps.values()],
+        }
+
+
+class BuildReport:
+    """The top-level steps of a build, see `build_report`."""
+
+    def __init__(self, profile_dir: Optional[str] = None, **info):
+        self.profile_dir = profile_dir
+        self.info = info
+        self.steps: Dict[str, Step] = {}
+
+    def to_dict(self) -> Dict:
+        return {**self.info, "steps": [s.to_dict() for s in self.steps.values()]}
+
+
+_REPORT: Optional[BuildReport] = None
+_LOCAL = threading.local()
+
+
+def _stack():
+    return _LOCAL.__dict__.setdefault("stack", [])
+
+
+def _bytes_read() -> Optional[int]:
+    # rchar counts every byte read by the process, also those served by the page cache
+    try:
+        with open("/proc/self/io") as fh:
+            for line in fh:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _cpu() -> Tuple[float, float]:
+    """CPU seconds of this process and of its terminated child processes."""
+    if resource is None:
+        return time.process_time(), 0.0
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time(), children.ru_utime + children.ru_stime
+
+
+def _peak_rss_kib() -> Tuple[Optional[int], Optional[int]]:
+    if resource is None:
+        return None, None
+    # ru_maxrss is in bytes on macOS and in KiB elsewhere
+    unit = 1024 if sys.platform == "darwin" else 1
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // unit,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // unit,
+    )
+
+
+def current_step() -> Step:
+    """The innermost active step of this thread, a discarded one if there is none."""
+    stack = _stack()
+    return stack[-1] if stack else Step("")
+
+
+@contextmanager
+def step(name: str) -> Iterator[Step]:
+    """Measures the block as step `name`, see the module docstring."""
+    stack = _stack()
+    if stack:
+        parent = stack[-1].steps
+    elif _REPORT is not None:
+        parent = _REPORT.steps
+    else:
+        parent = {}
+    record = parent.setdefault(name, Step(name))
+    profiler = None
+    if not stack and _REPORT is not None and _REPORT.profile_dir is not None:
+        profiler = cProfile.Profile()
+
+    stack.append(record)
+    start_wall, (start_cpu, start_cpu_children) = time.perf_counter(), _cpu()
+    start_read = _bytes_read()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(_REPORT.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(_REPORT.profile_dir, f"{name}.prof"))
+        stack.pop()
+        end_cpu, end_cpu_children = _cpu()
+        end_read = _bytes_read()
+        record.calls += 1
+        record.wall += time.perf_counter() - start_wall
+        record.cpu += end_cpu - start_cpu
+        record.cpu_children += end_cpu_children - start_cpu_children
+        if start_read is not None and end_read is not None:
+            record.bytes_read = (record.bytes_read or 0) + end_read - start_read
+        record.peak_rss_kib, record.peak_rss_children_kib = _peak_rss_kib()
+
+
+def report_path(database_path: str) -> str:
+    """Where the report of a build of `database_path` is written."""
+    return os.path.join(os.path.dirname(os.path.abspath(database_path)), REPORT_NAME)
+
+
+@contextmanager
+def build_report(path: str, profile: bool = False, **info) -> Iterator[BuildReport]:
+    """
+    Collects the steps of the block and writes them as json to `path` when it exits,
+    also if it fails.
+
+    :param path: Location of the report, see `report_path`
+    :param profile: Dump a cProfile of every top-level step to `build_profiles/<step>.prof`
+        next to the report
+    :param info: Added to the report as is
+    """
+    global _REPORT
+    profile_dir = os.path.join(os.path.dirname(path), PROFILES_DIR) if profile else None
+    report = _REPORT = BuildReport(
+        profile_dir,
+        started=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        **info,
+    )
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        yield report
+        status = "completed"
+    finally:
+        _REPORT = None
+        report.info.update(status=status, wall=round(time.perf_counter() - start, 6))
+        with open(path, "w") as fj:
+            json.dump(report.to_dict(), fj, indent=2)
+        log.info(f"Wrote the build report to {path}.")
@@ -0,0 +1,302 @@
+""" Implements a single, process-parallel pass over the raw LastFM json files.
+
+Both the name -> track_id mapping and the similars table are derived from the same
+~1M json files. `scan_lastfm_corpus` parses every file exactly once in a process pool
+(json parsing is CPU bound and would be serialized by the GIL with threads) and reduces
+the results in sorted path order, so the outcome does not depend on the number of workers.
+
+Optionally, a manifest (a small sqlite file keyed by path, size and mtime) stores the
+extracted fields of every file, so that rebuilds only re-parse new or changed files.
+"""
+import glob
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from tqdm import tqdm
+
+from lastfm_dataset.constants import DATA_DIR, ROOT_DIR
+from lastfm_dataset.create.instrumentation import current_step, step
+from lastfm_dataset.create.utils import chunks, transaction
+
+log = logging.getLogger(__name__)
+
+LastFmFile = namedtuple(
+    "LastFmFile", ["file_track_id", "title", "track_id", "similars"]
+)
+LastFmCorpusScan = namedtuple(
+    "LastFmCorpusScan", ["name2track_id", "summary", "similars"]
+)
+
+# Set once per worker process by `_init_worker` so the filters are not pickled per chunk.
+_SONG_NAMES: Set[str] = set()
+_TRACK_IDS: Set[str] = set()
+_KEEP_ALL_SIMILARS = False
+
+# LastFM files are named after their track id, which keeps the mappings, summaries and
+# reports the build writes to the data dir out of the scan
+LASTFM_FILE_PATTERN = "TR*.json"
+
+
+def find_lastfm_json_files(root: Optional[str] = None) -> List[str]:
+    """All LastFM json files below `root` (defaults to the data dir) in sorted order."""
+    if root is None:
+        root = os.path.join(ROOT_DIR, DATA_DIR)
+    pattern = os.path.join(root, "**", LASTFM_FILE_PATTERN)
+    return sorted(glob.glob(pattern, recursive=True))
+
+
+def _file_track_id(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _keep_similars(
+    file_track_id: str, title: str, song_names: Set[str], track_ids: Set[str]
+) -> bool:
+    return title in song_names or file_track_id in track_ids
+
+
+def read_lastfm_file(
+    path: str,
+    song_names: Set[str],
+    track_ids: Set[str],
+    keep_all_similars: bool = False,
+) -> LastFmFile:
+    """Parses a single LastFM json file. Similars are only kept for files that can end up
+    in the tracks table, i.e. the title is a known song name or the track_id is known,
+    unless `keep_all_similars` is set."""
+    file_track_id = _file_track_id(path)
+    with open(path, "r") as fh:
+        data = json.load(fh)
+    similars = None
+    if keep_all_similars or _keep_similars(
+        file_track_id, data["title"], song_names, track_ids
+    ):
+        similars = [(sim[0], sim[1]) for sim in data["similars"]]
+    return LastFmFile(file_track_id, data["title"], data["track_id"], similars)
+
+
+def _init_worker(song_names: Set[str], track_ids: Set[str], keep_all_similars: bool):
+    global _SONG_NAMES, _TRACK_IDS, _KEEP_ALL_SIMILARS
+    _SONG_NAMES = song_names
+    _TRACK_IDS = track_ids
+    _KEEP_ALL_SIMILARS = keep_all_similars
+
+
+def _read_lastfm_files(paths: List[str]) -> List[LastFmFile]:
+    return [
+        read_lastfm_file(path, _SONG_NAMES, _TRACK_IDS, _KEEP_ALL_SIMILARS)
+        for path in paths
+    ]
+
+
+def iter_lastfm_files(
+    paths: List[str],
+    song_names: Optional[Set[str]] = None,
+    track_ids: Optional[Set[str]] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 1000,
+    keep_all_similars: bool = False,
+) -> Iterator[LastFmFile]:
+    """Parses `paths` in a process pool and yields the results in the order of `paths`.
+
+    :param paths: json files to parse
+    :param song_names: Keep similars of files with one of these titles
+    :param track_ids: Keep similars of files with one of these track ids
+    :param workers: Number of processes. Defaults to the number of cores, 1 parses inline.
+    :param chunk_size: Number of files sent to a worker at once
+    :param keep_all_similars: Keep the similars of every file, ignoring the filters
+    """
+    song_names = song_names or set()
+    track_ids = track_ids or set()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for path in paths:
+            yield read_lastfm_file(path, song_names, track_ids, keep_all_similars)
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(song_names, track_ids, keep_all_similars),
+    ) as executor:
+        # `map` returns results in submission order, which keeps the scan deterministic.
+        for files in executor.map(_read_lastfm_files, chunks(paths, chunk_size)):
+            yield from files
+
+
+@contextmanager
+def open_manifest(path: str):
+    """Opens (and creates if necessary) the scan manifest at `path`."""
+    con = sqlite3.connect(path, isolation_level=None)
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            file_track_id TEXT NOT NULL,
+            title TEXT NOT NULL,
+            track_id TEXT NOT NULL,
+            similars BLOB NOT NULL
+        );
+    """
+    )
+    try:
+        yield con
+    finally:
+        con.close()
+
+
+def _encode_similars(similars: List[Tuple[str, float]]) -> bytes:
+    return zlib.compress(json.dumps(similars, separators=(",", ":")).encode())
+
+
+def _decode_similars(blob: bytes) -> List[Tuple[str, float]]:
+    return [(sim[0], sim[1]) for sim in json.loads(zlib.decompress(blob))]
+
+
+def update_manifest(
+    con: sqlite3.Connection,
+    paths: List[str],
+    workers: Optional[int] = None,
+    chunk_size: int = 1000,
+) -> int:
+    """Brings the manifest in sync with `paths`: files that are new or whose size or mtime
+    changed are re-parsed, files that no longer exist are removed.
+
+    :return: The number of re-parsed files
+    """
+    sql_upsert = """
+        INSERT OR REPLACE INTO files(path, size, mtime_ns, file_track_id, title, track_id, similars)
+        VALUES (?, ?, ?, ?, ?, ?, ?);
+    """
+    known = {
+        row[0]: (row[1], row[2])
+        for row in con.execute("SELECT path, size, mtime_ns FROM files;")
+    }
+    stats = {}
+    for path in paths:
+        stat = os.stat(path)
+        stats[path] = (stat.st_size, stat.st_mtime_ns)
+    changed = [path for path in paths if known.get(path) != stats[path]]
+    removed = [(path,) for path in known if path not in stats]
+    log.info(
+        f"Manifest knows {len(known)} files, re-parsing {len(changed)} new or changed"
+        f" and dropping {len(removed)} removed files."
+    )
+
+    def _row(path: str, file: LastFmFile) -> Tuple:
+        return (
+            path,
+            *stats[path],
+            file.file_track_id,
+            file.title,
+            file.track_id,
+            _encode_similars(file.similars),
+        )
+
+    files = iter_lastfm_files(
+        changed, workers=workers, chunk_size=chunk_size, keep_all_similars=True
+    )
+    with transaction(con):
+        con.executemany("DELETE FROM files WHERE path = ?;", removed)
+        rows = []
+        for path, file in zip(changed, tqdm(files, total=len(changed))):
+            rows.append(_row(path, file))
+            if len(rows) >= 1000:
+                con.executemany(sql_upsert, rows)
+                rows = []
+        con.executemany(sql_upsert, rows)
+    return len(changed)
+
+
+def iter_manifest(
+    con: sqlite3.Connection,
+    song_names: Optional[Set[str]] = None,
+    track_ids: Optional[Set[str]] = None,
+) -> Iterator[LastFmFile]:
+    """Yields the files stored in the manifest in path order, applying the same
+    similars filter as `read_lastfm_file`."""
+    song_names = song_names or set()
+    track_ids = track_ids or set()
+    rows = con.execute(
+        "SELECT file_track_id, title, track_id, similars FROM files ORDER BY path;"
+    )
+    for file_track_id, title, track_id, blob in rows:
+        similars = None
+        if _keep_similars(file_track_id, title, song_names, track_ids):
+            similars = _decode_similars(blob)
+        yield LastFmFile(file_track_id, title, track_id, similars)
+
+
+def reduce_lastfm_files(
+    files: Iterable[LastFmFile], song_names: Set[str]
+) -> LastFmCorpusScan:
+    """Builds the name -> track_id mapping and the similars from parsed files.
+    For duplicated titles the first file (in path order) wins."""
+    name2track_id: Dict[str, str] = {}
+    summary = {"not_found": [], "duplicate": []}
+    similars: Dict[str, List[Tuple[str, float]]] = {}
+    for file in files:
+        if file.title in song_names:
+            if file.title in name2track_id:
+                summary["duplicate"].append(file.title)
+            else:
+                name2track_id[file.title] = file.track_id
+        else:
+            summary["not_found"].append(file.title)
+        if file.similars is not None:
+            similars[file.file_track_id] = file.similars
+    return LastFmCorpusScan(name2track_id, summary, similars)
+
+
+def scan_lastfm_corpus(
+    song_names: Optional[Set[str]] = None,
+    track_ids: Optional[Set[str]] = None,
+    paths: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 1000,
+    manifest_path: Optional[str] = None,
+) -> LastFmCorpusScan:
+    """Walks the LastFM json files once and returns everything later stages need:
+    the name -> track_id mapping (with a summary of missing and duplicated titles)
+    and the similars of all tracks that can end up in the tracks table.
+
+    If `manifest_path` is given, only files that are not yet in the manifest or changed
+    since are parsed, everything else is read from the manifest.
+    """
+    song_names = song_names or set()
+    if paths is None:
+        log.info("Collecting all LastFM json file paths. Takes some seconds...")
+        with step("list_files"):
+            paths = find_lastfm_json_files()
+    current_step().rows_in += len(paths)
+    if manifest_path is not None:
+        with open_manifest(manifest_path) as con:
+            with step("parse") as s:
+                s.rows_in += update_manifest(con, paths, workers, chunk_size)
+            with step("reduce"):
+                scan = reduce_lastfm_files(
+                    iter_manifest(con, song_names, track_ids), song_names
+                )
+    else:
+        log.info(
+            f"Scanning {len(paths)} LastFM json files with {workers or os.cpu_count()} workers."
+        )
+        # parsing and reducing are interleaved
+        with step("parse") as s:
+            files = iter_lastfm_files(paths, song_names, track_ids, workers, chunk_size)
+            scan = reduce_lastfm_files(tqdm(files, total=len(paths)), song_names)
+            s.rows_in += len(paths)
+    current_step().rows_out += len(scan.name2track_id)
+    log.info(
+        f"Collected track ids for {len(scan.name2track_id)} of the original {len(song_names)} songs."
+    )
+    return scan
@@ -0,0 +1,269 @@
+""" Implements the build as a resumable pipeline of stages.
+
+Every stage records a checkpoint in the `build_checkpoints` table of the result database
+when it completes, together with a fingerprint of its inputs (size and mtime of the input
+files, its parameters and the checkpoints of the stages it depends on). A rerun skips every
+stage whose checkpoint matches, so after a crash the build resumes at the first incomplete
+stage. A stage whose inputs changed, or that is forced, is rebuilt, and with it every stage
+depending on it.
+
+Tables are loaded with deferred keys (see `create_all_tables`), the `indexes` stage builds
+them with `finish_bulk_load`.
+
+Every run writes a report of the stages it ran next to the database, see
+`lastfm_dataset.create.instrumentation`.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from lastfm_dataset import row_factory
+from lastfm_dataset.constants import (
+    PATH_TO_LASTFM_MANIFEST,
+    PATH_TO_NAME2ID_SUMMARY,
+    PATH_TO_RESULT,
+    PATH_TO_SONG_ID2TRACK_ID_SUMMARY,
+)
+from lastfm_dataset.create import track_and_tags_data, user_behavior_data
+from lastfm_dataset.create.base_data import (
+    create_all_tables,
+    create_similar_table,
+    create_track_user_table,
+    finish_bulk_load,
+    set_pragmas,
+)
+from lastfm_dataset.create.colistened_data import populate_colistened_table
+from lastfm_dataset.create.id_mapping import save_id_mapping
+from lastfm_dataset.create.instrumentation import build_report, report_path, step
+from lastfm_dataset.create.lastfm_corpus import (
+    find_lastfm_json_files,
+    scan_lastfm_corpus,
+)
+from lastfm_dataset.create.similars_data import populate_similars_table
+from lastfm_dataset.create.track_and_tags_data import (
+    get_all_song_names,
+    populate_tracks_table,
+)
+from lastfm_dataset.create.user_behavior_data import (
+    get_song_id2track_id_mapping,
+    populate_users_table,
+)
+from lastfm_dataset.create.utils import transaction
+
+log = logging.getLogger(__name__)
+
+# Crash safe but still fast: a crash loses at most the transaction in progress.
+PIPELINE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -512_000,  # in KiB, i.e. ~500MB
+    "temp_store": "MEMORY",
+}
+
+
+class Stage(NamedTuple):
+    name: str
+    depends_on: List[str]
+    # input files whose size and mtime are part of the fingerprint
+    inputs: Callable[[], List[str]]
+    # empties what a previous, possibly interrupted, run of the stage wrote
+    reset: Callable[[sqlite3.Connection], None]
+    run: Callable[[sqlite3.Connection, Dict], None]
+
+
+def _write_json(path: str, data):
+    with open(path, "w") as fj:
+        json.dump(data, fj)
+
+
+def _run_mappings(con: sqlite3.Connection, params: Dict):
+    with step("scan"):
+        scan = scan_lastfm_corpus(
+            song_names=set(get_all_song_names()),
+            workers=params.get("workers"),
+            manifest_path=PATH_TO_LASTFM_MANIFEST,
+        )
+    _write_json(track_and_tags_data.PATH_TO_NAME2ID_MAPPING, scan.name2track_id)
+    _write_json(PATH_TO_NAME2ID_SUMMARY, scan.summary)
+    with step("unique_tracks"):
+        mapping, summary = get_song_id2track_id_mapping()
+    save_id_mapping(mapping, user_behavior_data.PATH_TO_SONG_ID2TRACK_ID_MAPPING)
+    _write_json(PATH_TO_SONG_ID2TRACK_ID_SUMMARY, summary)
+
+
+def _reset_tracks(con: sqlite3.Connection):
+    with transaction(con):
+        con.execute("DELETE FROM track_tags;")
+        con.execute("DELETE FROM tracks;")
+
+
+def _reset_users(con: sqlite3.Connection):
+    with transaction(con):
+        con.execute("DROP TABLE IF EXISTS track_users;")
+        create_track_user_table(con, with_keys=False)
+        con.execute("DELETE FROM users;")
+
+
+def _reset_similars(con: sqlite3.Connection):
+    with transaction(con):
+        con.execute("DROP TABLE IF EXISTS similar;")
+        create_similar_table(con, with_keys=False)
+
+
+def _reset_nothing(con: sqlite3.Connection):
+    pass
+
+
+STAGES = [
+    Stage(
+        name="mappings",
+        depends_on=[],
+        inputs=lambda: [
+            track_and_tags_data.PATH_TO_PROCESSED_DB,
+            user_behavior_data.PATH_TO_UNIQUE_TRACKS,
+            *find_lastfm_json_files(),
+        ],
+        reset=_reset_nothing,
+        run=_run_mappings,
+    ),
+    Stage(
+        name="tracks",
+        depends_on=["mappings"],
+        inputs=lambda: [track_and_tags_data.PATH_TO_PROCESSED_DB],
+        reset=_reset_tracks,
+        run=lambda con, params: populate_tracks_table(con, params.get("limit")),
+    ),
+    Stage(
+        name="users",
+        depends_on=["mappings", "tracks"],
+        inputs=lambda: [user_behavior_data.PATH_TO_TRAIN_TRIPLETS],
+        reset=_reset_users,
+        run=lambda con, params: populate_users_table(con),
+    ),
+    Stage(
+        name="similars",
+        depends_on=["mappings", "tracks"],
+        inputs=lambda: [],
+        reset=_reset_similars,
+        run=lambda con, params: populate_similars_table(
+            con, workers=params.get("workers")
+        ),
+    ),
+    Stage(
+        name="colistened",
+        depends_on=["users"],
+        inputs=lambda: [],
+        reset=_reset_nothing,  # the stage replaces all rows itself
+        run=lambda con, params: populate_colistened_table(con),
+    ),
+    Stage(
+        name="indexes",
+        depends_on=["tracks", "users", "similars", "colistened"],
+        inputs=lambda: [],
+        reset=_reset_nothing,
+        run=lambda con, params: finish_bulk_load(con),
+    ),
+]
+
+
+def fingerprint(paths: Iterable[str], extra=None) -> str:
+    """Hash of the path, size and mtime of every file in `paths` and of `extra`."""
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode())
+        except FileNotFoundError:
+            digest.update(f"{path}\tmissing\n".encode())
+    digest.update(json.dumps(extra, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def create_checkpoint_table(con: sqlite3.Connection):
+    sql = """
+        CREATE TABLE IF NOT EXISTS build_checkpoints (
+            stage TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            seq INTEGER NOT NULL
+        );
+    """
+    con.execute(sql)
+
+
+def get_checkpoints(con: sqlite3.Connection) -> Dict[str, Dict]:
+    """The completed stages with their fingerprint and completion order."""
+    rows = con.execute("SELECT stage, fingerprint, seq FROM build_checkpoints;")
+    return {row["stage"]: row for row in rows}
+
+
+def _stage_fingerprint(stage: Stage, checkpoints: Dict[str, Dict], params: Dict) -> str:
+    # a dependency that completed again (e.g. was forced) changes its `seq`
+    dependencies = {
+        name: [checkpoints[name]["fingerprint"], checkpoints[name]["seq"]]
+        for name in stage.depends_on
+    }
+    return fingerprint(stage.inputs(), {"params": params, "depends_on": dependencies})
+
+
+def run_pipeline(
+    path: Optional[str] = None,
+    force: Iterable[str] = (),
+    limit: Optional[int] = None,
+    workers: Optional[int] = None,
+    profile: bool = False,
+) -> List[str]:
+    """
+    Builds the result database stage by stage, skipping completed stages, see the module
+    docstring. Creates the database if it does not exist.
+
+    :param path: Location of the database, defaults to `PATH_TO_RESULT`
+    :param force: Names of stages to rebuild even if they are complete
+    :param limit: Only consider the first `limit` songs of the processed database
+    :param workers: Number of processes used to scan the LastFM files
+    :param profile: Dump a cProfile of every stage that runs next to the database
+    :return: Names of the stages that ran
+    """
+    path = path or PATH_TO_RESULT
+    names = [stage.name for stage in STAGES]
+    unknown = set(force) - set(names)
+    if unknown:
+        raise ValueError(f"Unknown stages {sorted(unknown)}, stages are {names}.")
+    # only parameters that change the result are part of the fingerprints
+    params = {"limit": limit}
+
+    con = sqlite3.connect(path, isolation_level=None)
+    con.row_factory = row_factory
+    ran = []
+    skipped = []
+    try:
+        with build_report(report_path(path), profile, database=path, skipped=skipped):
+            set_pragmas(con, PIPELINE_PRAGMAS)
+            create_all_tables(con, defer_keys=True)
+            create_checkpoint_table(con)
+            for stage in STAGES:
+                checkpoints = get_checkpoints(con)
+                expected = _stage_fingerprint(stage, checkpoints, params)
+                done = checkpoints.get(stage.name)
+                if stage.name not in force and done and done["fingerprint"] == expected:
+                    log.info(f"Stage {stage.name} is complete, skipping.")
+                    skipped.append(stage.name)
+                    continue
+                log.info(f"Running stage {stage.name}.")
+                con.execute(
+                    "DELETE FROM build_checkpoints WHERE stage = ?;", (stage.name,)
+                )
+                with step(stage.name):
+                    stage.reset(con)
+                    stage.run(con, {"limit": limit, "workers": workers})
+                seq = 1 + max([c["seq"] for c in checkpoints.values()], default=0)
+                con.execute(
+                    "INSERT INTO build_checkpoints VALUES (?, ?, ?);",
+                    (stage.name, expected, seq),
+                )
+                ran.append(stage.name)
+    finally:
+        con.close()
+    return ran
@@ -0,0 +1,204 @@
+""" Implements a parallel build that loads the users and similars stages in worker processes.
+
+After the tracks stage, which every other stage depends on, the train triplets are cut
+into contiguous byte ranges. Every range is loaded into its own shard database by a worker
+process, and one more worker loads the similars. Each shard attaches the result database
+read-only to look up the tracks. The shards are then merged in order with
+`ATTACH` + `INSERT ... SELECT ... ORDER BY rowid`, so rows are inserted in the same order
+as in the serial build and the result has the same content.
+
+The shards split the page cache of `BULK_LOAD_PRAGMAS` between them and keep temporary
+tables on disk, so the workers together use at most as much cache as the result database
+(~500MB) and the build about twice that, independent of the number of workers.
+"""
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+from lastfm_dataset import row_factory
+from lastfm_dataset.constants import PATH_TO_LASTFM_MANIFEST
+from lastfm_dataset.create import user_behavior_data
+from lastfm_dataset.create.base_data import (
+    BULK_LOAD_PRAGMAS,
+    create_similar_table,
+    create_track_user_table,
+    create_users_table,
+    set_pragmas,
+)
+from lastfm_dataset.create.colistened_data import populate_colistened_table
+from lastfm_dataset.create.instrumentation import step
+from lastfm_dataset.create.lastfm_corpus import LastFmCorpusScan, scan_lastfm_corpus
+from lastfm_dataset.create.similars_data import populate_similars_table
+from lastfm_dataset.create.track_and_tags_data import (
+    get_all_song_names,
+    populate_tracks_table,
+)
+from lastfm_dataset.create.user_behavior_data import (
+    populate_users_table,
+    save_user_track_pair_count,
+)
+from lastfm_dataset.create.utils import byte_ranges, transaction
+
+log = logging.getLogger(__name__)
+
+# Tables of a shard and how their rows are merged, duplicates are handled like in the
+# serial stages: the first user and similar row wins, duplicated track_users fail.
+MERGES = {
+    "users": "INSERT OR IGNORE INTO main.users SELECT * FROM shard.users ORDER BY rowid;",
+    "track_users": "INSERT INTO main.track_users SELECT * FROM shard.track_users ORDER BY rowid;",
+    "similar": "INSERT OR IGNORE INTO main.similar SELECT * FROM shard.similar ORDER BY rowid;",
+}
+
+
+def _database_path(con: sqlite3.Connection) -> str:
+    cursor = con.cursor()
+    cursor.row_factory = None
+    return next(
+        row[2] for row in cursor.execute("PRAGMA database_list;") if row[1] == "main"
+    )
+
+
+def shard_pragmas(workers: int) -> Dict[str, Union[str, int]]:
+    """`BULK_LOAD_PRAGMAS` for one of `workers` concurrent shards, see the module docstring."""
+    return {
+        **BULK_LOAD_PRAGMAS,
+        "cache_size": int(BULK_LOAD_PRAGMAS["cache_size"] / max(workers, 1)),
+        "temp_store": "DEFAULT",
+    }
+
+
+def _open_shard(
+    path: str, database_path: str, pragmas: Dict[str, Union[str, int]]
+) -> sqlite3.Connection:
+    """A new shard database with the result database attached as `dataset`, so that
+    unqualified reads of `tracks` are served from it."""
+    # uri=True so that the read-only uri of the result database is understood by ATTACH
+    con = sqlite3.connect(path, uri=True, isolation_level=None)
+    con.row_factory = row_factory
+    set_pragmas(con, pragmas)
+    uri = f"{pathlib.Path(database_path).resolve().as_uri()}?mode=ro"
+    con.execute("ATTACH DATABASE ? AS dataset;", (uri,))
+    return con
+
+
+def _build_users_shard(
+    path: str,
+    database_path: str,
+    pragmas: Dict[str, Union[str, int]],
+    byte_range: Tuple[int, int],
+    batch_size: int,
+) -> str:
+    con = _open_shard(path, database_path, pragmas)
+    try:
+        create_users_table(con)
+        create_track_user_table(con, with_keys=False)
+        populate_users_table(con, batch_size, byte_range=byte_range, save_summary=False)
+    finally:
+        con.close()
+    return path
+
+
+def _build_similars_shard(
+    path: str,
+    database_path: str,
+    pragmas: Dict[str, Union[str, int]],
+    scan: LastFmCorpusScan,
+) -> str:
+    con = _open_shard(path, database_path, pragmas)
+    try:
+        create_similar_table(con)
+        populate_similars_table(con, scan=scan)
+    finally:
+        con.close()
+    return path
+
+
+def merge_shards(con: sqlite3.Connection, paths: List[str]):
+    """Appends the rows of the shard databases at `paths`, in this order, to the tables of
+    `con`. Every shard is merged in one transaction."""
+    for path in paths:
+        log.info(f"Merging {path}.")
+        con.execute("ATTACH DATABASE ? AS shard;", (path,))
+        try:
+            tables = {
+                row["name"]
+                for row in con.execute("SELECT name FROM shard.sqlite_master;")
+            }
+            with transaction(con):
+                for table, sql in MERGES.items():
+                    if table in tables:
+                        con.execute(sql)
+        finally:
+            con.execute("DETACH DATABASE shard;")
+
+
+def populate_all_tables_sharded(
+    con: sqlite3.Connection,
+    limit: Optional[int] = None,
+    workers: Optional[int] = None,
+    shards: Optional[int] = None,
+    batch_size: int = 100_000,
+):
+    """
+    Same result as `populate_all_tables`, with the users and similars stages run in
+    parallel worker processes, see the module docstring.
+
+    :param con: Connection to the result database (a file, the workers attach it)
+    :param limit: Only consider the first `limit` songs of the processed database
+    :param workers: Number of processes, defaults to the number of CPUs. The shards
+        share the page cache of one bulk loaded database, see `shard_pragmas`.
+    :param shards: Number of slices of the train triplets, defaults to `workers`
+    :param batch_size: Number of track-user pairs per transaction in the shards
+    """
+    workers = workers or os.cpu_count()
+    shards = shards or workers
+    database_path = _database_path(con)
+    with step("scan"):
+        scan = scan_lastfm_corpus(
+            song_names=set(get_all_song_names()),
+            workers=workers,
+            manifest_path=PATH_TO_LASTFM_MANIFEST,
+        )
+    with step("tracks"):
+        populate_tracks_table(con, limit, scan=scan)
+
+    pragmas = shard_pragmas(workers)
+    shard_dir = tempfile.mkdtemp(prefix="shards-", dir=os.path.dirname(database_path))
+    try:
+        ranges = byte_ranges(user_behavior_data.PATH_TO_TRAIN_TRIPLETS, shards)
+        # the CPU time of the workers is reported as `cpu_children` of this step
+        with step("shards"), ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _build_users_shard,
+                    os.path.join(shard_dir, f"users-{i}.db"),
+                    database_path,
+                    pragmas,
+                    byte_range,
+                    batch_size,
+                )
+                for i, byte_range in enumerate(ranges)
+            ]
+            futures.append(
+                executor.submit(
+                    _build_similars_shard,
+                    os.path.join(shard_dir, "similars.db"),
+                    database_path,
+                    pragmas,
+                    scan,
+                )
+            )
+            paths = [future.result() for future in futures]
+        with step("merge"):
+            merge_shards(con, paths)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    with step("summary"):
+        save_user_track_pair_count(con)
+    with step("colistened"):
+        populate_colistened_table(con)
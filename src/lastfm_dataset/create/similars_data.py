@@ -1,21 +1,31 @@
 """ Implements access and utility for the raw LastFM data, specifically the similarity tags. """
-import glob
-import json
 import logging
-import os
 import sqlite3
-from typing import List, Set, Tuple
+from typing import List, Optional, Set, Tuple
 
 from tqdm import tqdm
 
-from lastfm_dataset.constants import DATA_DIR, ROOT_DIR
+from lastfm_dataset.constants import PATH_TO_LASTFM_MANIFEST
+from lastfm_dataset.create.instrumentation import current_step, step
+from lastfm_dataset.create.lastfm_corpus import LastFmCorpusScan, scan_lastfm_corpus
+from lastfm_dataset.create.utils import chunks, transaction
 
 log = logging.getLogger(__name__)
 
 
-def populate_similars_table(con: sqlite3.Connection):
+def populate_similars_table(
+    con: sqlite3.Connection,
+    scan: Optional[LastFmCorpusScan] = None,
+    workers: Optional[int] = None,
+):
     """For all tracks in the tracks table, create records with (track_a, track_b)
-    in case they are listed as similar by last fm"""
+    in case they are listed as similar by last fm
+
+    :param con: Database connection
+    :param scan: Result of `scan_lastfm_corpus` shared with the mapping stage.
+        If not given the LastFM json files are scanned here.
+    :param workers: Number of processes used when scanning
+    """
     sql_get_all_track_ids = """
         SELECT track_id FROM tracks;
     """
@@ -32,19 +42,27 @@ def populate_similars_table(con: sqlite3.Connection):
     def _bulk_create_similar(
         connection: sqlite3.Connection, _data: List[Tuple[str, str, float]]
     ):
-        cursor = connection.cursor()
-        cursor.executemany(sql_insert_similar, _data)
-        connection.commit()
+        with transaction(connection), step("insert") as s:
+            connection.executemany(sql_insert_similar, _data)
+            s.rows_out += len(_data)
 
     all_track_ids = _get_all_track_ids(con)
-    all_tracks_json = list(
-        glob.glob(os.path.join(ROOT_DIR, DATA_DIR, "**", "*.json"), recursive=True)
-    )
-    for path in tqdm(all_tracks_json):
-        file_name = os.path.basename(path)
-        track_id = os.path.splitext(file_name)[0]
-        if track_id in all_track_ids:
-            with open(path, "r") as fh:
-                similars = json.load(fh)["similars"]
-            data = [(track_id, sim[0], sim[1]) for sim in similars]
+    if scan is None:
+        with step("scan"):
+            scan = scan_lastfm_corpus(
+                track_ids=all_track_ids,
+                workers=workers,
+                manifest_path=PATH_TO_LASTFM_MANIFEST,
+            )
+    track_ids = [_id for _id in scan.similars if _id in all_track_ids]
+    with tqdm(total=len(track_ids)) as pbar:
+        for batch in chunks(track_ids, 1000):
+            data = [
+                (track_id, sim[0], sim[1])
+                for track_id in batch
+                for sim in scan.similars[track_id]
+            ]
             _bulk_create_similar(con, data)
+            current_step().rows_in += len(batch)
+            current_step().rows_out += len(data)
+            pbar.update(len(batch))
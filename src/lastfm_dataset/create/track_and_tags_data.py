@@ -1,32 +1,26 @@
 """ Implements access and utility for the existing, processed lastfm data with the Spotify Previews """
-import glob
 import json
 import logging
 import os
 import sqlite3
-import threading
 from contextlib import contextmanager
 from typing import Dict, List, Optional, Tuple
 
 from tqdm import tqdm
 
+from lastfm_dataset import row_factory
 from lastfm_dataset.constants import (
-    DATA_DIR,
+    PATH_TO_LASTFM_MANIFEST,
     PATH_TO_NAME2ID_MAPPING,
     PATH_TO_PROCESSED_DB,
-    ROOT_DIR,
 )
-from lastfm_dataset.create.utils import nsplit, row_factory
+from lastfm_dataset.create.instrumentation import current_step, step
+from lastfm_dataset.create.lastfm_corpus import LastFmCorpusScan, scan_lastfm_corpus
+from lastfm_dataset.create.utils import quote_identifier, transaction
 
 log = logging.getLogger(__name__)
 
 
-def _decorate_with_limit(sql: str, limit: int) -> str:
-    sql = sql.strip()[:-1]
-    sql += f" LIMIT {limit};"
-    return sql
-
-
 @contextmanager
 def processed_lastfm_database():
     con = sqlite3.connect(PATH_TO_PROCESSED_DB, isolation_level=None)
@@ -50,62 +44,55 @@ def get_all_tags() -> List[str]:
     return result
 
 
-def populate_tracks_table(con: sqlite3.Connection, limit: Optional[int] = None):
+def populate_tracks_table(
+    con: sqlite3.Connection,
+    limit: Optional[int] = None,
+    scan: Optional[LastFmCorpusScan] = None,
+):
+    """
+    Creates a track with its tags for every song of the processed database that
+    could be matched to a MSD track id.
+
+    :param con: Database connection
+    :param limit: Only consider the first `limit` songs of the processed database
+    :param scan: Result of `scan_lastfm_corpus`. If given and there is no stored mapping,
+        the name -> track_id mapping is taken from it instead of re-scanning the json files.
+    """
     all_tags = get_all_tags()
-    sql_fetch = """
-        SELECT * FROM metadata;
+    metadata_columns = [
+        "id_dataset",
+        "name",
+        "artist",
+        "id_spotify",
+        "url_spotify_preview",
+        "url_lastfm",
+    ]
+    # One streamed join instead of a tags lookup per metadata row. The LEFT JOIN keeps
+    # metadata as the outer loop so rows come in the same order as before.
+    sql_fetch = f"""
+        SELECT {", ".join(f"m.{col}" for col in metadata_columns)}, t.id_dataset,
+            {", ".join(f"t.{quote_identifier(tag)}" for tag in all_tags)}
+        FROM (SELECT * FROM metadata{"" if limit is None else f" LIMIT {int(limit)}"}) AS m
+        LEFT JOIN tags AS t ON t.id_dataset = m.id_dataset;
     """
-    if limit is not None:
-        sql_fetch = _decorate_with_limit(sql_fetch, limit)
 
     sql_insert_track = """
         INSERT INTO tracks(track_id, spotify_id, spotify_preview_url, lastfm_url, artist, name)
         VALUES (?, ?, ?, ?, ?, ?);
     """
 
-    sql_insert_tags = f"""
-        INSERT INTO tags('track_id', {", ".join([f"'{tag}'" for tag in all_tags])})
-        VALUES ({",".join(['?'] * (len(all_tags) + 1))});
+    sql_insert_tags = """
+        INSERT INTO track_tags(track_id, tag_id)
+        VALUES (?, ?);
     """
 
-    sql_get_tags = """
-        SELECT * FROM tags WHERE id_dataset = '{}';
-    """
-
-    def _bulk_create_track(
-        connection: sqlite3.Connection, tracks: List[Dict], name2track_ids: Dict
-    ):
-        cur = connection.cursor()
-        all_data = []
-        for _track in tracks:
-            all_data.append(
-                (
-                    name2track_ids[_track["name"]],
-                    _track["id_spotify"],
-                    _track["url_spotify_preview"],
-                    _track["url_lastfm"],
-                    _track["artist"],
-                    _track["name"],
-                ),
-            )
-        cur.executemany(sql_insert_track, all_data)
-        connection.commit()
-
-    def _bulk_create_tags(
-        connection: sqlite3.Connection, tags_data: List[Dict], foreign_keys: List[str]
+    def _bulk_create(
+        connection: sqlite3.Connection, tracks: List[Tuple], tags: List[Tuple]
     ):
-        cur = connection.cursor()
-        all_data = []
-        for _tags, key in zip(tags_data, foreign_keys):
-            all_data.append(tuple([key] + [_tags[name] for name in all_tags]))
-        cur.executemany(sql_insert_tags, all_data)
-        connection.commit()
-
-    def _get_tags(connection: sqlite3.Connection, d_id: str) -> Dict:
-        result = connection.execute(sql_get_tags.format(d_id)).fetchone()
-        if len(result) == 0:
-            raise RuntimeError(f"Could not find tags for dataset_id {d_id}")
-        return result
+        with transaction(connection), step("insert") as s:
+            connection.executemany(sql_insert_track, tracks)
+            connection.executemany(sql_insert_tags, tags)
+            s.rows_out += len(tracks) + len(tags)
 
     def _maybe_create_mapping() -> Dict:
         if os.path.isfile(PATH_TO_NAME2ID_MAPPING):
@@ -115,6 +102,8 @@ def populate_tracks_table(con: sqlite3.Connection, limit: Optional[int] = None):
             with open(PATH_TO_NAME2ID_MAPPING, "r") as fh:
                 return json.load(fh)
         else:
+            if scan is not None:
+                return scan.name2track_id
             log.info(
                 f"Could not find existing mapping under {PATH_TO_NAME2ID_MAPPING}. Re-creating, takes some minutes."
             )
@@ -122,7 +111,12 @@ def populate_tracks_table(con: sqlite3.Connection, limit: Optional[int] = None):
             return new_map
 
     mapping = _maybe_create_mapping()
+    tag_ids = {
+        row["name"]: row["tag_id"]
+        for row in con.execute("SELECT tag_id, name FROM tag_names;")
+    }
     with processed_lastfm_database() as con_processed:
+        total_rows = 0
         total_tracks_created = 0
         created_tracks_names = set()
         total_tracks_existing = con_processed.execute(
@@ -131,84 +125,61 @@ def populate_tracks_table(con: sqlite3.Connection, limit: Optional[int] = None):
         if limit is not None:
             total_tracks_existing = min(total_tracks_existing, limit)
 
-        log.info("Creating tracks and tags table. Takes up to an hour.")
+        log.info("Creating tracks and tags table.")
         tracks_aggregate = []
         tags_aggregate = []
-        keys_aggregate = []
+        cursor = con_processed.cursor()
+        cursor.row_factory = (
+            None  # plain tuples, tag names may clash with metadata columns
+        )
         with tqdm(total=total_tracks_existing) as pbar:
-            for row in con_processed.execute(sql_fetch):
-                if row["name"] in mapping and row["name"] not in created_tracks_names:
-                    tracks_aggregate.append(row)
-                    tags = _get_tags(con_processed, row["id_dataset"])
-                    tags_aggregate.append(tags)
-                    keys_aggregate.append(mapping[row["name"]])
+            for row in cursor.execute(sql_fetch):
+                total_rows += 1
+                d_id, name, artist, id_spotify, url_preview, url_lastfm = row[:6]
+                if name in mapping and name not in created_tracks_names:
+                    if row[6] is None:
+                        raise RuntimeError(f"Could not find tags for dataset_id {d_id}")
+                    track_id = mapping[name]
+                    tracks_aggregate.append(
+                        (track_id, id_spotify, url_preview, url_lastfm, artist, name)
+                    )
+                    tags_aggregate.extend(
+                        (track_id, tag_ids[tag])
+                        for tag, value in zip(all_tags, row[7:])
+                        if value == 1
+                    )
                     total_tracks_created += 1
-                    created_tracks_names.add(row["name"])
+                    created_tracks_names.add(name)
                 pbar.update(1)
-                if len(tracks_aggregate) >= 100:
-                    _bulk_create_track(con, tracks_aggregate, mapping)
-                    _bulk_create_tags(con, tags_aggregate, keys_aggregate)
+                if len(tracks_aggregate) >= 10_000:
+                    _bulk_create(con, tracks_aggregate, tags_aggregate)
                     tracks_aggregate = []
                     tags_aggregate = []
-                    keys_aggregate = []
         # process remainder
         if len(tracks_aggregate) > 0:
-            _bulk_create_track(con, tracks_aggregate, mapping)
-            _bulk_create_tags(con, tags_aggregate, keys_aggregate)
+            _bulk_create(con, tracks_aggregate, tags_aggregate)
 
+    current_step().rows_in += total_rows
+    current_step().rows_out += total_tracks_created
     log.info(f"Created {total_tracks_created} tracks with according tags 🙌🏼.")
 
 
-def get_track_name2track_id_mapping() -> Tuple[Dict, Dict]:
-    def _get_all_song_names() -> List[str]:
-        with processed_lastfm_database() as con_processed:
-            names = con_processed.execute(
-                """
-                SELECT name FROM metadata;
+def get_all_song_names() -> List[str]:
+    with processed_lastfm_database() as con_processed:
+        names = con_processed.execute(
             """
-            ).fetchall()
-            return [item["name"] for item in names]
-
-    def _check_files(paths: List[str], result_dict: Dict, summary: Dict):
-        for file_path in tqdm(paths):
-            with open(file_path, "r") as fh:
-                data = json.load(fh)
-                song_name = data["title"]
-                if song_name in all_song_names:
-                    if song_name in result_dict:
-                        summary["duplicate"].append(song_name)
-                    else:
-                        result_dict[song_name] = data["track_id"]
-                else:
-                    summary["not_found"].append(song_name)
-
-    all_song_names = set(_get_all_song_names())
-    result = {}
-    summary = {"not_found": [], "duplicate": []}
-    log.info(
-        "Collecting all file path for matching track ids with existing songs. Take some seconds..."
-    )
-    all_tracks_json = list(
-        glob.glob(os.path.join(ROOT_DIR, DATA_DIR, "**", "*.json"), recursive=True)
-    )
-    jobs = []
-    split_sizes = []
-    for split in nsplit(all_tracks_json, 10):
-        split_sizes.append(str(len(split)))
-        jobs.append(
-            threading.Thread(target=_check_files, args=[split, result, summary])
-        )
-    log.info(
-        f'Created 10 jobs which process splits of the following size {", ".join(split_sizes)}'
-    )
-
-    for job in jobs:
-        job.start()
+            SELECT name FROM metadata;
+        """
+        ).fetchall()
+        return [item["name"] for item in names]
 
-    for job in jobs:
-        job.join()
 
-    log.info(
-        f"Collected track ids for {len(result)} of the original {len(all_song_names)} songs."
+def get_track_name2track_id_mapping(workers: Optional[int] = None) -> Tuple[Dict, Dict]:
+    """Matches the song names of the processed database with the titles of the LastFM json
+    files. The files are parsed in a process pool, see `scan_lastfm_corpus`."""
+    scan = scan_lastfm_corpus(
+        song_names=set(get_all_song_names()),
+        workers=workers,
+        manifest_path=PATH_TO_LASTFM_MANIFEST,
     )
-    return result, summary
+    return scan.name2track_id, scan.summary
@@ -3,9 +3,11 @@ import json
 import logging
 import os
 import sqlite3
-from collections import defaultdict
-from typing import Dict, Set, Tuple
+import time
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 from tqdm import tqdm
 
 from lastfm_dataset.constants import (
@@ -14,20 +16,94 @@ from lastfm_dataset.constants import (
     PATH_TO_UNIQUE_TRACKS,
     PATH_TO_USER_TRACK_PAIR_COUNT,
 )
+from lastfm_dataset.create.id_mapping import (
+    ID_DTYPE,
+    IdMapping,
+    build_id_mapping,
+    load_id_mapping,
+)
+from lastfm_dataset.create.instrumentation import current_step, step
+from lastfm_dataset.create.utils import transaction
 
 log = logging.getLogger(__name__)
 
 
-def populate_users_table(con: sqlite3.Connection):
+def iter_triplets(
+    path: str = PATH_TO_TRAIN_TRIPLETS, start: int = 0, end: Optional[int] = None
+) -> Iterator[Tuple[str, str, int]]:
+    """Lazily yields (user_id, song_id, play_count) from the Echo Nest train triplets.
+    Reads the file line by line so memory does not depend on the file size.
+
+    With `start` and `end` only the lines that begin in the byte range [start, end) are
+    read, so ranges that cover the file (see `byte_ranges`) yield every line exactly once.
+    """
+    with open(path, "rb") as fh:
+        if start > 0:
+            fh.seek(start - 1)
+            fh.readline()  # continue at the first line beginning at or after `start`
+        position = fh.tell()
+        for line in fh:
+            if end is not None and position >= end:
+                break
+            position += len(line)
+            user_id, song_id, play_count = line.decode().rstrip("\n").split("\t")
+            yield user_id, song_id, int(play_count)
+
+
+def iter_triplet_chunks(
+    path: str = PATH_TO_TRAIN_TRIPLETS,
+    start: int = 0,
+    end: Optional[int] = None,
+    block_size: int = 1 << 22,
+) -> Iterator[Tuple[List[bytes], List[bytes], List[bytes]]]:
+    """
+    Like `iter_triplets`, but yields the user ids, song ids and play counts of the lines
+    in blocks of about `block_size` bytes as undecoded bytes, e.g. for a vectorized
+    `IdMapping.lookup` of the song ids. A block is split into its fields with one call
+    instead of line by line, most lines are dropped, so only decode what is kept.
+    """
+    with open(path, "rb") as fh:
+        if start > 0:
+            fh.seek(start - 1)
+            fh.readline()  # continue at the first line beginning at or after `start`
+        position = fh.tell()
+        while end is None or position < end:
+            size = block_size if end is None else min(block_size, end - position)
+            block = fh.read(size)
+            if len(block) == 0:
+                return
+            if not block.endswith(b"\n"):
+                block += fh.readline()  # the line began in the range, so finish it
+            position += len(block)
+            fields = block.rstrip(b"\n").replace(b"\n", b"\t").split(b"\t")
+            if len(fields) % 3 != 0:
+                raise ValueError(
+                    f"Malformed triplets in {path} before byte {position}."
+                )
+            yield fields[0::3], fields[1::3], fields[2::3]
+
+
+def populate_users_table(
+    con: sqlite3.Connection,
+    batch_size: int = 100_000,
+    byte_range: Optional[Tuple[int, int]] = None,
+    save_summary: bool = True,
+):
     """
     Only adds users if they are associated with a song that exists in the tracks table.
     Also populates track_users table
 
+    The triplets are streamed and written with `executemany` in transactions of
+    `batch_size` track-user pairs, so memory stays flat regardless of the input size.
+
     :param con: Database connection
+    :param batch_size: Number of track-user pairs buffered per transaction
+    :param byte_range: Only load the triplets of this (start, end) byte range of the file
+    :param save_summary: Write the number of pairs per user, see `save_user_track_pair_count`
     :return:
     """
     sql_insert_user = """
-        INSERT INTO users(user_id)
+        INSERT OR IGNORE INTO users(user_id)
         VALUES (?);
     """
 
@@ -40,13 +116,12 @@ def populate_users_table(con: sqlite3.Connection):
         SELECT track_id FROM tracks;
     """
 
-    def _maybe_create_mapping() -> Dict:
+    def _maybe_create_mapping() -> IdMapping:
         if os.path.isfile(PATH_TO_SONG_ID2TRACK_ID_MAPPING):
             log.info(
                 f"Found existing mapping under {PATH_TO_SONG_ID2TRACK_ID_MAPPING}. Re-using."
             )
-            with open(PATH_TO_SONG_ID2TRACK_ID_MAPPING, "r") as fh:
-                return json.load(fh)
+            return load_id_mapping(PATH_TO_SONG_ID2TRACK_ID_MAPPING)
         else:
             log.info(
                 f"Could not find existing mapping under {PATH_TO_SONG_ID2TRACK_ID_MAPPING}."
@@ -55,66 +130,115 @@ def populate_users_table(con: sqlite3.Connection):
             new_map, _ = get_song_id2track_id_mapping()
             return new_map
 
-    def _get_all_track_ids(connection: sqlite3.Connection) -> Set[str]:
+    def _get_all_track_ids(connection: sqlite3.Connection) -> List[str]:
         result = connection.execute(sql_get_all_track_ids).fetchall()
-        return set([r["track_id"] for r in result])
-
-    def _create_user(connection: sqlite3.Connection, _user_id: str) -> str:
-        cur = connection.cursor()
-        cur.execute(sql_insert_user, (_user_id,))
-        connection.commit()
-        return cur.lastrowid
-
-    def _create_track_user_pair(
-        connection: sqlite3.Connection, _track_id: str, _user_id: str, _play_count: int
-    ) -> str:
-        cur = connection.cursor()
-        cur.execute(sql_insert_track_user, (_track_id, _user_id, _play_count))
-        connection.commit()
-        return cur.lastrowid
-
-    def _save_summary(summary: Dict):
-        with open(PATH_TO_USER_TRACK_PAIR_COUNT, "w") as fj:
-            json.dump(summary, fj)
-
-    song_id2track_id_mapping = _maybe_create_mapping()
-    all_track_ids = _get_all_track_ids(con)
-    added_users = set()
-    user_songs_pair_count = defaultdict(int)
+        return [r["track_id"] for r in result]
+
+    def _bulk_create(
+        connection: sqlite3.Connection, _pairs: List[Tuple[str, str, int]]
+    ):
+        with transaction(connection), step("insert") as s:
+            # users are inserted in order of first appearance, duplicates are ignored.
+            connection.executemany(sql_insert_user, ((p[1],) for p in _pairs))
+            connection.executemany(sql_insert_track_user, _pairs)
+            s.rows_out += len(_pairs)
+
+    with step("mapping"):
+        # only songs of the tracks table are of interest, so every song found is a match
+        song_id2track_id_mapping = _maybe_create_mapping().with_values(
+            _get_all_track_ids(con)
+        )
 
     log.info(
-        "Checking all user song pairs for matches to the existing tracks and creating according records."
+        "Streaming all user song pairs, checking for matches to the existing tracks and creating according records."
     )
-    with open(PATH_TO_TRAIN_TRIPLETS, "r") as fh:
-        lines = fh.readlines()
-        for line in tqdm(lines, total=len(lines)):
-            user_id, song_id, play_count = line.split("\t")
-            if song_id in song_id2track_id_mapping:
-                track_id = song_id2track_id_mapping[song_id]
-                if track_id in all_track_ids:
-                    if user_id not in added_users:
-                        added_users.add(user_id)
-                        _create_user(con, user_id)
-                    _create_track_user_pair(con, track_id, user_id, play_count)
-                    user_songs_pair_count[user_id] += 1
-
-    _save_summary(user_songs_pair_count)
+    total_lines = 0
+    total_pairs = 0
+    pairs = []
+    start = time.perf_counter()
+    chunks = iter_triplet_chunks(PATH_TO_TRAIN_TRIPLETS, *(byte_range or (0, None)))
+    progress = tqdm(unit=" lines")
+    for user_ids, song_ids, play_counts in chunks:
+        total_lines += len(user_ids)
+        progress.update(len(user_ids))
+        track_ids, found = song_id2track_id_mapping.lookup(song_ids)
+        for i, track_id in zip(
+            np.flatnonzero(found).tolist(), track_ids[found].astype(str).tolist()
+        ):
+            pairs.append((track_id, user_ids[i].decode(), int(play_counts[i])))
+            if len(pairs) >= batch_size:
+                _bulk_create(con, pairs)
+                total_pairs += len(pairs)
+                pairs = []
+    progress.close()
+    if len(pairs) > 0:
+        _bulk_create(con, pairs)
+        total_pairs += len(pairs)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    current_step().rows_in += total_lines
+    current_step().rows_out += total_pairs
+    if save_summary:
+        with step("summary"):
+            save_user_track_pair_count(con)
+    total_users = con.execute("SELECT count(*) AS n FROM users;").fetchone()["n"]
     log.info(
-        f"Found {len(added_users)} unique users with at least one track associated in the tracks table."
+        f"Read {total_lines} triplets and created {total_pairs} track-user pairs in {elapsed:.1f}s "
+        f"({total_lines / elapsed:.0f} lines/sec, {total_pairs / elapsed:.0f} rows/sec)."
+    )
+    log.info(
+        f"Found {total_users} unique users with at least one track associated in the tracks table."
     )
 
 
-def get_song_id2track_id_mapping() -> Tuple[Dict, Dict]:
-    result = dict()
-    meta = {"duplicated_song_ids": []}
-    with open(PATH_TO_UNIQUE_TRACKS, "r") as fh:
-        lines = fh.readlines()
-        for line in tqdm(lines, total=len(lines)):
-            track_id, song_id, artist, track_name = line.split("<SEP>")
-            if song_id in result:
-                meta["duplicated_song_ids"].append([track_id, artist, track_name])
-            else:
-                result[song_id] = track_id
-                meta[track_id] = [artist, track_name]
+def save_user_track_pair_count(con: sqlite3.Connection):
+    """Writes the number of track-user pairs per user to `PATH_TO_USER_TRACK_PAIR_COUNT`."""
+    sql_count_pairs_per_user = """
+        SELECT user_id, count(*) AS pair_count FROM track_users GROUP BY user_id;
+    """
+    # streamed so the summary never has to be held in memory
+    with open(PATH_TO_USER_TRACK_PAIR_COUNT, "w") as fj:
+        fj.write("{")
+        for i, row in enumerate(con.execute(sql_count_pairs_per_user)):
+            prefix = ", " if i > 0 else ""
+            fj.write(f"{prefix}{json.dumps(row['user_id'])}: {row['pair_count']}")
+        fj.write("}")
+
+
+def get_song_id2track_id_mapping(
+    chunk_size: int = 100_000,
+) -> Tuple[IdMapping, Dict]:
+    """
+    Maps the song ids of `unique_tracks.txt` to their track ids. The file is streamed in
+    chunks of `chunk_size` lines that are packed into fixed width arrays right away.
+    A song id listed more than once maps to its first track, the summary lists the others
+    as [track_id, artist, track_name].
+    """
+    song_ids = []
+    track_ids = []
+    with open(PATH_TO_UNIQUE_TRACKS, "rb") as fh:
+        lines = tqdm(fh, unit=" lines")
+        while True:
+            chunk = [line.split(b"<SEP>", 2)[:2] for line in islice(lines, chunk_size)]
+            if len(chunk) == 0:
+                break
+            track_id_chunk, song_id_chunk = zip(*chunk)
+            track_ids.append(np.array(track_id_chunk))
+            song_ids.append(np.array(song_id_chunk))
+    result, duplicated = build_id_mapping(
+        np.concatenate(song_ids or [np.empty(0, dtype=ID_DTYPE)]),
+        np.concatenate(track_ids or [np.empty(0, dtype=ID_DTYPE)]),
+    )
+    summary = {"songs": len(result), "duplicated_song_ids": []}
+    if len(duplicated) > 0:
+        # rare, so their lines are read again rather than keeping every artist and name
+        positions = set(duplicated.tolist())
+        with open(PATH_TO_UNIQUE_TRACKS, "r") as fh:
+            for i, line in enumerate(fh):
+                if i in positions:
+                    track_id, _, artist, track_name = line.split("<SEP>")
+                    summary["duplicated_song_ids"].append(
+                        [track_id, artist, track_name]
+                    )
     log.info(f"Created mapping for {len(result)} songs.")
-    return result, meta
+    return result, summary
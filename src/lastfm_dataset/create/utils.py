@@ -1,4 +1,9 @@
+import os
 import sqlite3
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from lastfm_dataset.create.instrumentation import step
 
 
 def chunks(lst, n):
@@ -11,3 +16,33 @@ def nsplit(lst, n):
     """Divides list into n chunks"""
     k, m = divmod(len(lst), n)
     return (lst[i * k + min(i, m) : (i + 1) * k + min(i + 1, m)] for i in range(n))
+
+
+def byte_ranges(path: str, n: int) -> List[Tuple[int, int]]:
+    """Divides the file at `path` into `n` contiguous (start, end) byte ranges of equal size."""
+    size = os.path.getsize(path)
+    bounds = [size * i // n for i in range(n + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def quote_identifier(identifier: str) -> str:
+    """Quotes a table or column name, e.g. a tag name, for use in SQL."""
+    escaped = identifier.replace('"', '""')
+    return f'"{escaped}"'
+
+
+@contextmanager
+def transaction(con: sqlite3.Connection):
+    """Runs everything inside the block in one explicit transaction.
+    Works for connections in autocommit mode (`isolation_level=None`) as well."""
+    if con.in_transaction:
+        con.commit()
+    con.execute("BEGIN;")
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    else:
+        with step("commit"):
+            con.commit()
@@ -0,0 +1,333 @@
+""" Implements a streaming columnar export of the dataset tables for Spark and pandas jobs.
+
+Every table is read once in key order and written in row groups of `row_group_size`
+rows, so memory is one row group plus the id dictionaries (below), whatever the size of
+the table. The layout is one directory per table next to a `manifest.json`::
+
+    <directory>/tracks/part-00000.parquet
+    <directory>/track_users/user_bucket=00/part-00000.parquet
+    <directory>/manifest.json
+
+With pyarrow installed a table is one Parquet file with one row group per chunk,
+otherwise every row group is a compressed `.npz` file with one array per column.
+
+Id columns are dictionary encoded: `tracks` and `users` are written sorted by id and the
+other tables reference their rows by position as int32 `track_idx` / `user_idx`, the same
+dense indices as `lastfm_dataset.matrix`. `tags` references `tag_names` by `tag_id`.
+
+`track_users` is read in user order and can be split into `user_partitions` hive-style
+partitions by `crc32(user_id) % user_partitions` (Spark's `crc32`), so that all rows of a
+user land in the same partition. Every partition buffers up to one row group.
+"""
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lastfm_dataset import maybe_wrap_connection
+from lastfm_dataset.matrix import index_ids
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # falls back to npz
+    pyarrow = None
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_ROW_GROUP_SIZE = 100_000
+FORMATS = ["parquet", "npz"]
+TRACK_ID_DTYPE = "S18"
+USER_ID_DTYPE = "S40"
+
+# Column kinds: "text" is stored as is, "track" and "user" hold an id that is encoded as
+# its position in the `tracks` / `users` export, anything else is a numpy dtype.
+Column = Tuple[str, str]
+
+
+class Table(NamedTuple):
+    sql: str
+    columns: List[Column]
+
+
+TABLES: Dict[str, Table] = {
+    "tracks": Table(
+        """
+        SELECT track_id, name, artist, spotify_preview_url, lastfm_url, spotify_id
+        FROM tracks ORDER BY track_id;
+        """,
+        [
+            ("track_id", "text"),
+            ("name", "text"),
+            ("artist", "text"),
+            ("spotify_preview_url", "text"),
+            ("lastfm_url", "text"),
+            ("spotify_id", "text"),
+        ],
+    ),
+    "users": Table(
+        "SELECT user_id FROM users ORDER BY user_id;",
+        [("user_id", "text")],
+    ),
+    "tag_names": Table(
+        "SELECT tag_id, name FROM tag_names ORDER BY tag_id;",
+        [("tag_id", "int32"), ("name", "text")],
+    ),
+    "tags": Table(
+        "SELECT track_id, tag_id FROM track_tags ORDER BY track_id, tag_id;",
+        [("track_idx", "track"), ("tag_id", "int32")],
+    ),
+    "similar": Table(
+        """
+        SELECT track_id_a, track_id_b, score FROM similar
+        ORDER BY track_id_a, track_id_b;
+        """,
+        [("track_idx_a", "track"), ("track_idx_b", "track"), ("score", "float64")],
+    ),
+    "track_users": Table(
+        """
+        SELECT user_id, track_id, playcount FROM track_users
+        ORDER BY user_id, track_id;
+        """,
+        [("user_idx", "user"), ("track_idx", "track"), ("playcount", "int32")],
+    ),
+}
+
+
+def default_format() -> str:
+    """Parquet if pyarrow is installed, npz otherwise."""
+    return "npz" if pyarrow is None else "parquet"
+
+
+def _dtype(kind: str) -> str:
+    if kind == "text":
+        return "str"
+    if kind in ("track", "user"):
+        return "int32"
+    return kind
+
+
+def user_bucket(user_id: str, partitions: int) -> int:
+    """The `track_users` partition of `user_id`."""
+    return zlib.crc32(user_id.encode()) % partitions
+
+
+class Dictionaries(NamedTuple):
+    """Sorted track and user ids, position `i` is the code of id `i`."""
+
+    track_ids: np.ndarray
+    user_ids: np.ndarray
+
+    def encode(self, kind: str, ids: Sequence[str]) -> np.ndarray:
+        """Codes of `ids`. Raises KeyError for unknown ids."""
+        sorted_ids = self.track_ids if kind == "track" else self.user_ids
+        return index_ids(sorted_ids, ids).astype(np.int32)
+
+
+def load_dictionaries(con: sqlite3.Connection) -> Dictionaries:
+    cursor = con.cursor()
+    cursor.row_factory = None
+    track_ids = cursor.execute("SELECT track_id FROM tracks ORDER BY track_id;")
+    track_ids = np.array([row[0] for row in track_ids], dtype=TRACK_ID_DTYPE)
+    user_ids = cursor.execute("SELECT user_id FROM users ORDER BY user_id;")
+    user_ids = np.array([row[0] for row in user_ids], dtype=USER_ID_DTYPE)
+    return Dictionaries(track_ids, user_ids)
+
+
+def _to_columns(
+    table: Table, rows: List[tuple], dictionaries: Dictionaries
+) -> Dict[str, np.ndarray]:
+    columns = {}
+    values = list(zip(*rows)) if rows else [()] * len(table.columns)
+    for (name, kind), column in zip(table.columns, values):
+        if kind in ("track", "user"):
+            columns[name] = dictionaries.encode(kind, column)
+        else:
+            columns[name] = np.array(column, dtype=_dtype(kind))
+    return columns
+
+
+class _NpzWriter:
+    """Writes every row group as its own compressed `part-<n>.npz`."""
+
+    def __init__(self, directory: str, table: Table):
+        self.directory = directory
+        self.files: List[str] = []
+
+    def write(self, columns: Dict[str, np.ndarray]):
+        path = os.path.join(self.directory, f"part-{len(self.files):05d}.npz")
+        np.savez_compressed(path, **columns)
+        self.files.append(path)
+
+    def close(self):
+        pass
+
+
+class _ParquetWriter:
+    """Writes every row group into one `part-00000.parquet`."""
+
+    def __init__(self, directory: str, table: Table):
+        types = {
+            "str": pyarrow.string(),
+            "int32": pyarrow.int32(),
+            "float64": pyarrow.float64(),
+        }
+        self.schema = pyarrow.schema(
+            [(name, types[_dtype(kind)]) for name, kind in table.columns]
+        )
+        self.files = [os.path.join(directory, "part-00000.parquet")]
+        self.writer = pyarrow.parquet.ParquetWriter(self.files[0], self.schema)
+
+    def write(self, columns: Dict[str, np.ndarray]):
+        arrays = [
+            pyarrow.array(
+                column.tolist() if column.dtype.kind == "U" else column, field.type
+            )
+            for field, column in zip(self.schema, columns.values())
+        ]
+        batch = pyarrow.Table.from_arrays(arrays, schema=self.schema)
+        self.writer.write_table(batch, row_group_size=max(batch.num_rows, 1))
+
+    def close(self):
+        self.writer.close()
+
+
+_WRITERS = {"npz": _NpzWriter, "parquet": _ParquetWriter}
+
+
+def _export_table(
+    con: sqlite3.Connection,
+    name: str,
+    directory: str,
+    dictionaries: Dictionaries,
+    row_group_size: int,
+    file_format: str,
+    partitions: int,
+) -> Dict:
+    table = TABLES[name]
+    writers = {}
+    buffers: Dict[int, List[tuple]] = {}
+
+    def flush(bucket: int):
+        if bucket not in writers:
+            path = os.path.join(directory, name)
+            if partitions > 1:
+                path = os.path.join(path, f"user_bucket={bucket:02d}")
+            os.makedirs(path, exist_ok=True)
+            writers[bucket] = _WRITERS[file_format](path, table)
+        writers[bucket].write(_to_columns(table, buffers.pop(bucket), dictionaries))
+
+    cursor = con.cursor()
+    cursor.row_factory = None
+    cursor.execute(table.sql)
+    rows_total = 0
+    while True:
+        rows = cursor.fetchmany(row_group_size)
+        if len(rows) == 0:
+            break
+        rows_total += len(rows)
+        if partitions == 1:
+            buffers[0] = rows
+            flush(0)
+            continue
+        for row in rows:
+            bucket = user_bucket(row[0], partitions)
+            buffer = buffers.setdefault(bucket, [])
+            buffer.append(row)
+            if len(buffer) >= row_group_size:
+                flush(bucket)
+    for bucket in sorted(buffers):
+        flush(bucket)
+    if not writers:  # an empty table still gets a file with its columns
+        buffers[0] = []
+        flush(0)
+
+    files = []
+    for bucket in sorted(writers):
+        writers[bucket].close()
+        files += [os.path.relpath(f, directory) for f in writers[bucket].files]
+    log.info(f"Exported {rows_total} rows of {name} to {len(files)} file(s).")
+    return {
+        "rows": rows_total,
+        "columns": {column: _dtype(kind) for column, kind in table.columns},
+        "partitions": partitions,
+        "files": files,
+    }
+
+
+@maybe_wrap_connection
+def export_tables(
+    con: sqlite3.Connection,
+    directory: str,
+    tables: Optional[Sequence[str]] = None,
+    row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    file_format: Optional[str] = None,
+    user_partitions: int = 1,
+) -> Dict:
+    """
+    Exports `tables` to `directory`, see the module docstring, and returns the manifest
+    that is also written to `<directory>/manifest.json`.
+
+    :param tables: Names in `TABLES`, all by default
+    :param row_group_size: Rows per row group (and per `.npz` file)
+    :param file_format: One of `FORMATS`, see `default_format`
+    :param user_partitions: Number of `track_users` partitions by user hash
+    """
+    tables = list(TABLES) if tables is None else list(tables)
+    unknown = set(tables) - set(TABLES)
+    if unknown:
+        raise ValueError(
+            f"Unknown tables {sorted(unknown)}, choose from {list(TABLES)}."
+        )
+    file_format = default_format() if file_format is None else file_format
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown format {file_format}, choose from {FORMATS}.")
+    if file_format == "parquet" and pyarrow is None:
+        raise ImportError("Writing parquet requires pyarrow.")
+    if row_group_size < 1 or user_partitions < 1:
+        raise ValueError("row_group_size and user_partitions must be positive.")
+
+    dictionaries = load_dictionaries(con)
+    manifest = {
+        "format": file_format,
+        "row_group_size": row_group_size,
+        "tables": {},
+    }
+    for name in tables:
+        partitions = user_partitions if name == "track_users" else 1
+        manifest["tables"][name] = _export_table(
+            con,
+            name,
+            directory,
+            dictionaries,
+            row_group_size,
+            file_format,
+            partitions,
+        )
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as fj:
+        json.dump(manifest, fj, indent=2)
+    return manifest
+
+
+def iter_row_groups(directory: str, table: str) -> Iterator[Dict[str, np.ndarray]]:
+    """Reads back the row groups of `table` exported to `directory`, as numpy columns."""
+    with open(os.path.join(directory, MANIFEST_NAME)) as fj:
+        manifest = json.load(fj)
+    for file in manifest["tables"][table]["files"]:
+        path = os.path.join(directory, file)
+        if manifest["format"] == "npz":
+            with np.load(path, allow_pickle=False) as npz:
+                yield {name: npz[name] for name in npz.files}
+            continue
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for i in range(parquet_file.num_row_groups):
+            row_group = parquet_file.read_row_group(i)
+            yield {
+                name: row_group.column(name).to_numpy(zero_copy_only=False)
+                for name in row_group.column_names
+            }
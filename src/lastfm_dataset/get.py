@@ -1,9 +1,10 @@
 import sqlite3
 from collections import defaultdict, namedtuple
 from contextlib import contextmanager
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterator, List, Optional, Sequence, Union
 
-from lastfm_dataset import DB_PATH, maybe_wrap_connection, row_factory
+from lastfm_dataset import DB_PATH, maybe_wrap_connection, row_factory, tracing
+from lastfm_dataset.cache import cached_lookup
 from lastfm_dataset.constants import PATH_TO_RESULT
 
 
@@ -12,7 +13,9 @@ def get_connection(path: Optional[str] = None):
     if path is None:
         path = PATH_TO_RESULT
 
-    con = sqlite3.connect(path, isolation_level=None)
+    con = sqlite3.connect(
+        path, isolation_level=None, factory=tracing.connection_factory()
+    )
     con.row_factory = row_factory
 
     try:
@@ -26,95 +29,219 @@ Track = namedtuple(
     ["track_id", "artist", "name", "spotify_preview_url", "lastfm_url", "spotify_id"],
 )
 User = namedtuple("User", ["user_id"])
+TrackUser = namedtuple("TrackUser", ["track_id", "user_id", "playcount"])
 
 
-def _to_sql_string(vals: List[str]) -> str:
-    ids = [f"'{_id}'" for _id in vals]
-    return ", ".join(ids)
+# Number of ids bound per statement. Stays below SQLITE_MAX_VARIABLE_NUMBER,
+# which is 999 for SQLite versions before 3.32.
+CHUNK_SIZE = 500
+
+
+def _select_in(
+    con: sqlite3.Connection, sql_template: str, ids: Sequence[str]
+) -> Iterator[Dict]:
+    """Runs `sql_template`, which contains one `{ids}` placeholder inside an IN clause,
+    for chunks of at most `CHUNK_SIZE` ids with bound parameters.
+    The last chunk is padded with a repeated id so that every chunk runs the same
+    statement and sqlite3 re-uses the prepared statement from its cache."""
+    ids = list(dict.fromkeys(ids))  # duplicates would return rows twice across chunks
+    if len(ids) == 0:
+        return
+    size = min(CHUNK_SIZE, len(ids))
+    sql_query = sql_template.format(ids=", ".join(["?"] * size))
+    for i in range(0, len(ids), size):
+        chunk = ids[i : i + size]
+        chunk += [chunk[-1]] * (size - len(chunk))
+        yield from con.execute(sql_query, chunk)
 
 
 @maybe_wrap_connection
+@cached_lookup(result_key=lambda track: track.track_id)
 def get_tracks_by_ids(con: sqlite3.Connection, ids: List[str]) -> List[Track]:
-    sql_query = f"""
-        SELECT * FROM tracks WHERE track_id IN ({_to_sql_string(ids)});
+    sql_query = """
+        SELECT * FROM tracks WHERE track_id IN ({ids});
     """
-    rows = con.execute(sql_query).fetchall()
+    rows = _select_in(con, sql_query, ids)
     return [Track(**row) for row in rows]
 
 
+def _iter_by_key(
+    con: sqlite3.Connection, table: str, key: List[str], fetch_size: int
+) -> Iterator[Dict]:
+    """Streams `table` ordered by its primary key `key` with keyset pagination: every
+    page continues after the last key of the previous one, so each page is an index
+    seek and the whole table is read in one linear pass."""
+    if fetch_size < 1:
+        raise ValueError(f"fetch_size must be at least 1, got {fetch_size}")
+    columns = ", ".join(key)
+    placeholders = ", ".join(["?"] * len(key))
+    sql_query = f"""
+        SELECT * FROM {table} WHERE ({columns}) > ({placeholders})
+        ORDER BY {columns} LIMIT ?;
+    """
+    last_key = [""] * len(key)  # sorts before every id
+    while True:
+        rows = con.execute(sql_query, (*last_key, fetch_size)).fetchall()
+        yield from rows
+        if len(rows) < fetch_size:
+            return
+        last_key = [rows[-1][column] for column in key]
+
+
+@maybe_wrap_connection
+def iter_tracks(con: sqlite3.Connection, fetch_size: int = 1000) -> Iterator[Track]:
+    """Streams all tracks ordered by track_id, `fetch_size` rows at a time."""
+    for row in _iter_by_key(con, "tracks", ["track_id"], fetch_size):
+        yield Track(**row)
+
+
 @maybe_wrap_connection
 def get_tracks(
     con: sqlite3.Connection, offset: int = 0, limit: int = 100
 ) -> List[Track]:
-    """Get tracks with pagination"""
-    sql_query = f"""
-        SELECT * FROM tracks LIMIT {limit} OFFSET {offset};
+    """Get tracks with pagination, ordered by track_id like `iter_tracks`.
+    Prefer `iter_tracks` to walk all tracks, every page here re-reads its offset."""
+    sql_query = """
+        SELECT * FROM tracks ORDER BY track_id LIMIT ? OFFSET ?;
     """
-    rows = con.execute(sql_query).fetchall()
+    rows = con.execute(sql_query, (limit, offset)).fetchall()
     return [Track(**row) for row in rows]
 
 
 @maybe_wrap_connection
+@cached_lookup()
 def get_tags(con: sqlite3.Connection, tracks: List[Track]) -> Dict[str, List[str]]:
     """Keys are track_ids and values the corresponding tags"""
+    sql_query = """
+        SELECT tracks.track_id, tag_names.name FROM tracks
+        LEFT JOIN track_tags ON track_tags.track_id = tracks.track_id
+        LEFT JOIN tag_names ON tag_names.tag_id = track_tags.tag_id
+        WHERE tracks.track_id IN ({ids});
+    """
+    rows = _select_in(con, sql_query, [t.track_id for t in tracks])
+    result = defaultdict(list)
+    for row in rows:
+        tags = result[row["track_id"]]
+        if row["name"] is not None:
+            tags.append(row["name"])
+    return dict(result)
+
+
+@maybe_wrap_connection
+def get_tracks_by_tag(con: sqlite3.Connection, tag: str) -> List[Track]:
+    """All tracks that have `tag`, ordered by track_id."""
+    return get_tracks_by_tags(con, [tag])
+
+
+@maybe_wrap_connection
+def get_tracks_by_tags(
+    con: sqlite3.Connection, tags: List[str], match: str = "any"
+) -> List[Track]:
+    """All tracks that have any (`match="any"`) or all (`match="all"`) of `tags`,
+    ordered by track_id. Unknown tags never match."""
+    if match not in ("any", "all"):
+        raise ValueError(f"match must be 'any' or 'all', got {match}")
+    tags = list(dict.fromkeys(tags))
+    if len(tags) == 0:
+        return []
     sql_query = f"""
-        SELECT * FROM tags WHERE tags.track_id in ({_to_sql_string([t.track_id for t in tracks])});
+        SELECT * FROM tracks WHERE track_id IN (
+            SELECT track_tags.track_id FROM tag_names
+            JOIN track_tags ON track_tags.tag_id = tag_names.tag_id
+            WHERE tag_names.name IN ({", ".join(["?"] * len(tags))})
+            GROUP BY track_tags.track_id HAVING count(*) >= ?
+        ) ORDER BY track_id;
     """
-    rows = con.execute(sql_query).fetchall()
-    result = {
-        row["track_id"]: [key for key, val in row.items() if val == 1] for row in rows
-    }
-    return result
+    min_matches = len(tags) if match == "all" else 1
+    rows = con.execute(sql_query, (*tags, min_matches)).fetchall()
+    return [Track(**row) for row in rows]
 
 
 @maybe_wrap_connection
+@cached_lookup()
 def get_similars(
     con: sqlite3.Connection, tracks: Union[List[Track], List[str]]
 ) -> Dict[str, List[str]]:
-    """Keys are track_ids and values the corresponding similar track_ids. Values can be empty list. """
+    """Keys are track_ids and values the corresponding similar track_ids. Values can be empty list."""
     sql_query = """
-        SELECT * FROM similar WHERE similar.track_id_a = '{}';
+        SELECT track_id_a, track_id_b FROM similar WHERE similar.track_id_a IN ({ids});
     """
-    if isinstance(tracks[0], Track):
-        tracks: List[str] = [t.track_id for t in tracks]
-
-    result = dict()
-    for track in tracks:
-        rows = con.execute(sql_query.format(track)).fetchall()
-        similars = [row["track_id_b"] for row in rows]
-        result[track] = similars
+    tracks: List[str] = [t.track_id if isinstance(t, Track) else t for t in tracks]
+
+    result = {track: [] for track in tracks}
+    for row in _select_in(con, sql_query, tracks):
+        result[row["track_id_a"]].append(row["track_id_b"])
     return result
 
 
+@maybe_wrap_connection
+@cached_lookup()
+def get_colistened(
+    con: sqlite3.Connection, tracks: Union[List[Track], List[str]]
+) -> Dict[str, List[str]]:
+    """Keys are track_ids and values the track_ids most often listened to by the same users,
+    most similar first. Values can be empty list."""
+    sql_query = """
+        SELECT track_id_a, track_id_b FROM colistened WHERE colistened.track_id_a IN ({ids})
+        ORDER BY track_id_a, rank;
+    """
+    tracks: List[str] = [t.track_id if isinstance(t, Track) else t for t in tracks]
+
+    result = {track: [] for track in tracks}
+    for row in _select_in(con, sql_query, tracks):
+        result[row["track_id_a"]].append(row["track_id_b"])
+    return result
+
+
+@maybe_wrap_connection
+def iter_users(con: sqlite3.Connection, fetch_size: int = 1000) -> Iterator[User]:
+    """Streams all users ordered by user_id, `fetch_size` rows at a time."""
+    for row in _iter_by_key(con, "users", ["user_id"], fetch_size):
+        yield User(**row)
+
+
 @maybe_wrap_connection
 def get_users(con: sqlite3.Connection, offset: int = 0, limit: int = 100) -> List[User]:
-    """Get users with pagination."""
-    sql_query = f"""
-        SELECT * FROM users LIMIT {limit} OFFSET {offset};
+    """Get users with pagination, ordered by user_id like `iter_users`.
+    Prefer `iter_users` to walk all users, every page here re-reads its offset."""
+    sql_query = """
+        SELECT * FROM users ORDER BY user_id LIMIT ? OFFSET ?;
     """
-    rows = con.execute(sql_query)
+    rows = con.execute(sql_query, (limit, offset))
     return [User(**row) for row in rows]
 
 
 @maybe_wrap_connection
+def iter_track_users(
+    con: sqlite3.Connection, fetch_size: int = 1000
+) -> Iterator[TrackUser]:
+    """Streams all (track_id, user_id, playcount) records ordered by track_id and user_id,
+    `fetch_size` rows at a time."""
+    for row in _iter_by_key(con, "track_users", ["track_id", "user_id"], fetch_size):
+        yield TrackUser(**row)
+
+
+@maybe_wrap_connection
+@cached_lookup(result_key=lambda user: user.user_id)
 def get_users_by_ids(con: sqlite3.Connection, ids: List[str]) -> List[User]:
-    """ Get users by ids """
-    sql_query = f"""
-           SELECT * FROM users WHERE user_id IN ({_to_sql_string(ids)});
-       """
-    rows = con.execute(sql_query).fetchall()
+    """Get users by ids"""
+    sql_query = """
+        SELECT * FROM users WHERE user_id IN ({ids});
+    """
+    rows = _select_in(con, sql_query, ids)
     return [User(**row) for row in rows]
 
 
 @maybe_wrap_connection
+@cached_lookup(default_factory=list)
 def get_track_listeners(
     con: sqlite3.Connection, tracks: List[Track]
 ) -> Dict[str, List[str]]:
     """Keys are track_ids and values are corresponding user that listened to that track"""
-    sql_query = f"""
-        SELECT * FROM track_users WHERE track_users.track_id in ({_to_sql_string([track.track_id for track in tracks])});
+    sql_query = """
+        SELECT track_id, user_id FROM track_users WHERE track_users.track_id IN ({ids});
     """
-    rows = con.execute(sql_query).fetchall()
+    rows = _select_in(con, sql_query, [track.track_id for track in tracks])
     result = defaultdict(list)
     for row in rows:
         result[row["track_id"]].append(row["user_id"])
@@ -122,14 +249,15 @@ def get_track_listeners(
 
 
 @maybe_wrap_connection
+@cached_lookup(default_factory=list)
 def get_user_listening_history(
     con: sqlite3.Connection, users: List[User]
 ) -> Dict[str, List[str]]:
-    """Finds all tracks the users listened to. Every user has at least on track he listened to. """
-    sql_query = f"""
-        SELECT * FROM track_users WHERE track_users.user_id in ({_to_sql_string([u.user_id for u in users])});
+    """Finds all tracks the users listened to. Every user has at least on track he listened to."""
+    sql_query = """
+        SELECT user_id, track_id FROM track_users WHERE track_users.user_id IN ({ids});
     """
-    rows = con.execute(sql_query).fetchall()
+    rows = _select_in(con, sql_query, [u.user_id for u in users])
     result = defaultdict(list)
     for row in rows:
         result[row["user_id"]].append(row["track_id"])
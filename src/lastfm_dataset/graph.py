@@ -0,0 +1,183 @@
+""" Implements an in-memory similarity graph over the `similar` table.
+
+The table is loaded once into CSR adjacency arrays. Every node is a track id (the ids of
+`tracks` plus every id that occurs in `similar`), sorted so that ids map to dense indices.
+Neighbours of a node are ordered by descending score, which makes top-k a slice.
+All queries work on batches of node indices with NumPy and never touch SQLite.
+"""
+import sqlite3
+from typing import Sequence, Tuple
+
+import numpy as np
+
+from lastfm_dataset import maybe_wrap_connection
+from lastfm_dataset.matrix import index_ids
+
+TRACK_ID_DTYPE = "S18"
+
+
+class SimilarityGraph:
+    """Directed, weighted graph: an edge a -> b with weight `score` for every row of `similar`."""
+
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        scores: np.ndarray,
+        track_ids: np.ndarray,
+    ):
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+        self.track_ids = track_ids
+        # source node of every edge, used to vectorize traversals
+        self.sources = np.repeat(
+            np.arange(len(track_ids), dtype=np.int32), np.diff(indptr)
+        )
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.track_ids)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    def index(self, track_ids: Sequence[str]) -> np.ndarray:
+        """Dense node indices of `track_ids`. Raises KeyError for unknown ids."""
+        return index_ids(self.track_ids, track_ids)
+
+    def ids(self, indices: np.ndarray) -> np.ndarray:
+        """Track ids (as str) of node indices."""
+        return self.track_ids[indices].astype(str)
+
+    def top_k(self, nodes: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """The `k` highest scored neighbours of every node.
+
+        :return: neighbour indices and scores of shape (len(nodes), k), padded with -1 and
+            nan for nodes with less than `k` neighbours
+        """
+        nodes = np.asarray(nodes)
+        offsets = self.indptr[nodes][:, None] + np.arange(k)[None, :]
+        valid = offsets < self.indptr[nodes + 1][:, None]
+        neighbours = np.full(offsets.shape, -1, dtype=np.int64)
+        scores = np.full(offsets.shape, np.nan, dtype=np.float32)
+        neighbours[valid] = self.indices[offsets[valid]]
+        scores[valid] = self.scores[offsets[valid]]
+        return neighbours, scores
+
+    def _edges_of(self, nodes: np.ndarray) -> np.ndarray:
+        """Positions of all outgoing edges of `nodes` in `indices`."""
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        # arange per node without a python loop
+        ends = np.cumsum(counts)
+        return np.repeat(starts - ends + counts, counts) + np.arange(
+            ends[-1] if len(ends) else 0
+        )
+
+    def expand(
+        self, seeds: np.ndarray, hops: int, min_score: float = 0.0
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Breadth-first expansion from `seeds` along edges with `score >= min_score`.
+
+        :return: The reached nodes (seeds included) and the hop they were first reached at
+        """
+        seeds = np.unique(np.asarray(seeds))
+        distance = np.full(self.num_nodes, -1, dtype=np.int32)
+        distance[seeds] = 0
+        frontier = seeds
+        for hop in range(1, hops + 1):
+            if len(frontier) == 0:
+                break
+            edges = self._edges_of(frontier)
+            edges = edges[self.scores[edges] >= min_score]
+            reached = np.unique(self.indices[edges])
+            frontier = reached[distance[reached] < 0]
+            distance[frontier] = hop
+        nodes = np.flatnonzero(distance >= 0)
+        return nodes, distance[nodes]
+
+    def personalized_pagerank(
+        self,
+        seeds: np.ndarray,
+        alpha: float = 0.15,
+        iterations: int = 50,
+        tol: float = 1e-8,
+    ) -> np.ndarray:
+        """Personalized PageRank with restart probability `alpha` to the seed set.
+        Outgoing mass is split proportionally to the edge scores, the mass of nodes without
+        outgoing edges restarts at the seeds.
+
+        :return: The score of every node, summing up to 1
+        """
+        seeds = np.asarray(seeds)
+        if seeds.size == 0:
+            raise ValueError("seeds must not be empty.")
+        restart = np.zeros(self.num_nodes)
+        restart[seeds] = 1.0
+        restart /= restart.sum()
+        out_weight = np.bincount(
+            self.sources, weights=self.scores, minlength=self.num_nodes
+        )
+        # nodes whose edges all score 0 are dangling as well
+        dangling = out_weight == 0
+        transition = np.divide(
+            self.scores,
+            out_weight[self.sources],
+            out=np.zeros(self.num_edges),
+            where=~dangling[self.sources],
+        )
+        rank = restart.copy()
+        for _ in range(iterations):
+            spread = np.bincount(
+                self.indices,
+                weights=rank[self.sources] * transition,
+                minlength=self.num_nodes,
+            )
+            new_rank = (1 - alpha) * (spread + rank[dangling].sum() * restart)
+            new_rank += alpha * restart
+            converged = np.abs(new_rank - rank).sum() < tol
+            rank = new_rank
+            if converged:
+                break
+        return rank
+
+
+@maybe_wrap_connection
+def load_similarity_graph(
+    con: sqlite3.Connection, fetch_size: int = 100_000
+) -> SimilarityGraph:
+    """Streams `similar` once into preallocated arrays and builds a `SimilarityGraph`."""
+    cursor = con.cursor()
+    cursor.row_factory = None
+    (total,) = cursor.execute("SELECT count(*) FROM similar;").fetchone()
+    sources = np.empty(total, dtype=TRACK_ID_DTYPE)
+    targets = np.empty(total, dtype=TRACK_ID_DTYPE)
+    scores = np.empty(total, dtype=np.float32)
+    n = 0
+    cursor.execute("SELECT track_id_a, track_id_b, score FROM similar;")
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if len(rows) == 0:
+            break
+        sources[n : n + len(rows)] = [row[0] for row in rows]
+        targets[n : n + len(rows)] = [row[1] for row in rows]
+        scores[n : n + len(rows)] = [row[2] for row in rows]
+        n += len(rows)
+    tracks = [row[0] for row in cursor.execute("SELECT track_id FROM tracks;")]
+
+    track_ids = np.unique(
+        np.concatenate([np.array(tracks, dtype=TRACK_ID_DTYPE), sources, targets])
+    )
+    source_index = np.searchsorted(track_ids, sources)
+    # group edges by source, highest score first
+    order = np.lexsort((-scores, source_index))
+    indptr = np.zeros(len(track_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(source_index, minlength=len(track_ids)), out=indptr[1:])
+    return SimilarityGraph(
+        indptr=indptr,
+        indices=np.searchsorted(track_ids, targets[order]).astype(np.int32),
+        scores=scores[order],
+        track_ids=track_ids,
+    )
@@ -0,0 +1,128 @@
+""" Implements a NumPy CSR export of the user x track playcount matrix from `track_users`.
+
+Rows are users and columns tracks, both sorted by id, so `user_ids[i]` / `track_ids[j]`
+map the dense indices back to ids. The arrays are saved as plain `.npy` files that can be
+memory mapped, so loading the matrix costs no copy.
+"""
+import os
+import sqlite3
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+from lastfm_dataset import maybe_wrap_connection
+
+TRACK_ID_DTYPE = "S18"
+USER_ID_DTYPE = "S40"
+FILES = ["indptr", "indices", "data", "user_ids", "track_ids"]
+
+
+class InteractionMatrix(NamedTuple):
+    """User x track matrix in CSR form: the playcounts of user `i` are
+    `data[indptr[i]:indptr[i + 1]]` for the tracks `indices[indptr[i]:indptr[i + 1]]`."""
+
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    user_ids: np.ndarray
+    track_ids: np.ndarray
+
+    @property
+    def shape(self):
+        return len(self.user_ids), len(self.track_ids)
+
+    def user_index(self, user_ids: Sequence[str]) -> np.ndarray:
+        """Dense row indices of `user_ids`. Raises KeyError for unknown ids."""
+        return index_ids(self.user_ids, user_ids)
+
+    def track_index(self, track_ids: Sequence[str]) -> np.ndarray:
+        """Dense column indices of `track_ids`. Raises KeyError for unknown ids."""
+        return index_ids(self.track_ids, track_ids)
+
+
+def index_ids(sorted_ids: np.ndarray, ids: Sequence[str]) -> np.ndarray:
+    """Positions of `ids` in the sorted fixed width bytes array `sorted_ids`. Raises
+    KeyError for unknown ids, including ids longer than the width of `sorted_ids`, which
+    would otherwise be truncated to a prefix that may be a known id."""
+    ids = np.asarray(ids, dtype=bytes)
+    too_long = np.char.str_len(ids) > sorted_ids.dtype.itemsize
+    if np.any(too_long):
+        raise KeyError(ids[too_long][0].decode())
+    if len(sorted_ids) == 0:
+        if len(ids) > 0:
+            raise KeyError(ids[0].decode())
+        return np.empty(0, dtype=np.int64)
+    ids = ids.astype(sorted_ids.dtype)
+    index = np.searchsorted(sorted_ids, ids)
+    index = np.minimum(index, len(sorted_ids) - 1)
+    unknown = sorted_ids[index] != ids
+    if np.any(unknown):
+        raise KeyError(ids[unknown][0].decode())
+    return index
+
+
+@maybe_wrap_connection
+def build_interaction_matrix(
+    con: sqlite3.Connection, fetch_size: int = 100_000
+) -> InteractionMatrix:
+    """Streams `track_users` once in user order (served by the covering user index)
+    and fills preallocated CSR arrays, so memory is the size of the result."""
+    cursor = con.cursor()
+    cursor.row_factory = None
+    track_ids = np.array(
+        [
+            row[0]
+            for row in cursor.execute("SELECT track_id FROM tracks ORDER BY track_id;")
+        ],
+        dtype=TRACK_ID_DTYPE,
+    )
+    track_index = {track_id.decode(): i for i, track_id in enumerate(track_ids)}
+    (total,) = cursor.execute("SELECT count(*) FROM track_users;").fetchone()
+
+    indices = np.empty(total, dtype=np.int32)
+    data = np.empty(total, dtype=np.int32)
+    user_ids = []
+    user_starts = []
+    n = 0
+    cursor.execute(
+        "SELECT user_id, track_id, playcount FROM track_users ORDER BY user_id, track_id;"
+    )
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if len(rows) == 0:
+            break
+        indices[n : n + len(rows)] = [track_index[row[1]] for row in rows]
+        data[n : n + len(rows)] = [row[2] for row in rows]
+        for i, row in enumerate(rows):
+            if len(user_ids) == 0 or user_ids[-1] != row[0]:
+                user_ids.append(row[0])
+                user_starts.append(n + i)
+        n += len(rows)
+
+    indptr = np.empty(len(user_ids) + 1, dtype=np.int64)
+    indptr[:-1] = user_starts
+    indptr[-1] = n
+    return InteractionMatrix(
+        indptr=indptr,
+        indices=indices[:n],
+        data=data[:n],
+        user_ids=np.array(user_ids, dtype=USER_ID_DTYPE),
+        track_ids=track_ids,
+    )
+
+
+def save_interaction_matrix(matrix: InteractionMatrix, directory: str):
+    """Writes every array as `<directory>/<name>.npy`."""
+    os.makedirs(directory, exist_ok=True)
+    for name in FILES:
+        np.save(os.path.join(directory, f"{name}.npy"), getattr(matrix, name))
+
+
+def load_interaction_matrix(directory: str, mmap_mode: str = "r") -> InteractionMatrix:
+    """Loads a matrix written by `save_interaction_matrix`. With the default `mmap_mode`
+    the arrays are memory mapped read-only instead of read into memory."""
+    arrays = {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in FILES
+    }
+    return InteractionMatrix(**arrays)
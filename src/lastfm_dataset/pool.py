@@ -0,0 +1,106 @@
+""" Implements a pool of long-lived, read-only connections used when `lastfm_dataset.init` is set. """
+import os
+import pathlib
+import sqlite3
+import threading
+import weakref
+from typing import Callable, List, Optional, Union
+
+from lastfm_dataset import tracing
+
+# The dataset is around a GB, so by default it is mapped completely.
+DEFAULT_MMAP_SIZE = 2 * 1024**3
+# Page cache per connection in KiB
+DEFAULT_CACHE_SIZE = 64 * 1024
+
+
+class _Holder:
+    """The connection of a thread, freed with the thread's locals when it exits."""
+
+    __slots__ = ("con", "__weakref__")
+
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+
+
+class ConnectionPool:
+    """
+    Hands out one read-only connection per thread, created on first use and kept open
+    so that the page cache survives between calls. The connection of a thread is closed
+    when the thread exits.
+
+    Connections are never shared between processes: after a fork (e.g. in DataLoader
+    workers) the child opens its own connections and leaves the inherited ones untouched,
+    as SQLite requires.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, pathlib.Path],
+        row_factory: Optional[Callable] = None,
+        mmap_size: int = DEFAULT_MMAP_SIZE,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        self.path = path
+        self.row_factory = row_factory
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        # reentrant: dropping the thread locals in `_reset` runs `_discard`
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._connections: List[sqlite3.Connection] = []
+        self._local = threading.local()
+
+    def _discard(self, con: sqlite3.Connection, pid: int):
+        """Closes the connection of an exited thread."""
+        if os.getpid() != pid:
+            return  # forked, the connection belongs to the parent
+        with self._lock:
+            if con not in self._connections:
+                return  # closed by `close`
+            self._connections.remove(con)
+        con.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = f"{pathlib.Path(self.path).resolve().as_uri()}?mode=ro"
+        # Each connection is only used by the thread that created it, but `close` may
+        # be called from any thread.
+        con = sqlite3.connect(
+            uri,
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+            factory=tracing.connection_factory(),
+        )
+        con.row_factory = self.row_factory
+        con.execute(f"PRAGMA mmap_size = {int(self.mmap_size)};").fetchall()
+        con.execute(f"PRAGMA cache_size = {-int(self.cache_size)};")
+        return con
+
+    def connection(self) -> sqlite3.Connection:
+        """The connection of the calling thread."""
+        if os.getpid() != self._pid:
+            # Forked: the inherited connections belong to the parent. They are
+            # dropped without closing them, closing would touch the parent's state.
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._orphaned = self._connections
+                    self._reset()
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _Holder(self._connect())
+            with self._lock:
+                self._connections.append(holder.con)
+            weakref.finalize(holder, self._discard, holder.con, self._pid)
+        return holder.con
+
+    def close(self):
+        """Closes all connections this process opened."""
+        with self._lock:
+            connections = self._connections if os.getpid() == self._pid else []
+            self._reset()
+        for con in connections:
+            con.close()
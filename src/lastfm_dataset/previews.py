@@ -0,0 +1,273 @@
+""" Implements a concurrent, resumable downloader for the Spotify previews of `tracks`.
+
+Previews are stored content addressed: a file is named after the sha256 of its bytes,
+`<directory>/<sha[:2]>/<sha>.mp3`. A journal (a small sqlite file) maps every track_id to
+the hash of its preview, so a rerun skips tracks that are done and an interrupted run
+loses at most the downloads in flight.
+
+Downloads use plain `http.client` with one keep-alive connection per thread and host.
+"""
+import hashlib
+import http.client
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing, contextmanager
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from tqdm import tqdm
+
+from lastfm_dataset import maybe_wrap_connection
+from lastfm_dataset.get import iter_tracks
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 16
+# Statuses worth another attempt, everything else >= 400 fails the track for good.
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """A download failed. `retry` tells whether another attempt might succeed."""
+
+    def __init__(self, message: str, retry: bool):
+        super().__init__(message)
+        self.retry = retry
+
+
+class HttpClient:
+    """Keeps one keep-alive connection per thread and host."""
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        connections = self._local.__dict__.setdefault("connections", {})
+        con = connections.get((scheme, netloc))
+        if con is None:
+            cls = (
+                http.client.HTTPSConnection
+                if scheme == "https"
+                else http.client.HTTPConnection
+            )
+            con = connections[(scheme, netloc)] = cls(netloc, timeout=self.timeout)
+            with self._lock:
+                self._connections.append(con)
+        return con
+
+    def _drop(self, scheme: str, netloc: str):
+        con = self._local.__dict__.get("connections", {}).pop((scheme, netloc), None)
+        if con is not None:
+            con.close()
+            with self._lock:
+                self._connections.remove(con)
+
+    def close(self):
+        """Closes the connections of all threads."""
+        with self._lock:
+            for con in self._connections:
+                con.close()
+            self._connections.clear()
+            # threads must not reuse the closed connections
+            self._local = threading.local()
+
+    def get(self, url: str) -> bytes:
+        """The body of `url`. Raises `DownloadError` for failed requests."""
+        try:
+            parts = urlsplit(url)
+            if parts.scheme not in ("http", "https") or not parts.netloc:
+                raise ValueError("not an http(s) url")
+            con = self._connection(parts.scheme, parts.netloc)
+        except (ValueError, http.client.InvalidURL) as e:
+            raise DownloadError(f"{url}: {e!r}", retry=False) from e
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        try:
+            con.request("GET", path or "/")
+            response = con.getresponse()
+            body = response.read()
+        except (ValueError, http.client.InvalidURL) as e:  # e.g. a control character
+            self._drop(parts.scheme, parts.netloc)
+            raise DownloadError(f"{url}: {e!r}", retry=False) from e
+        except (OSError, http.client.HTTPException) as e:
+            # the server may have closed the kept-alive connection, open a new one next time
+            self._drop(parts.scheme, parts.netloc)
+            raise DownloadError(f"{url}: {e!r}", retry=True) from e
+        if response.will_close:
+            self._drop(parts.scheme, parts.netloc)
+        if response.status != 200:
+            raise DownloadError(
+                f"{url}: HTTP {response.status}",
+                retry=response.status in RETRY_STATUSES,
+            )
+        return body
+
+
+def fetch(
+    client: HttpClient, url: str, retries: int = 3, backoff: float = 0.5
+) -> bytes:
+    """`client.get(url)` with up to `retries` retries, waiting `backoff * 2**attempt`
+    seconds before each."""
+    for attempt in range(retries + 1):
+        try:
+            return client.get(url)
+        except DownloadError as e:
+            if not e.retry or attempt == retries:
+                raise
+            log.debug(f"Retrying {url} after {e}")
+            time.sleep(backoff * 2**attempt)
+
+
+def preview_path(directory: str, sha256: str) -> str:
+    return os.path.join(directory, sha256[:2], f"{sha256}.mp3")
+
+
+def store(directory: str, content: bytes) -> str:
+    """Writes `content` to its content address below `directory`, returns its sha256."""
+    sha256 = hashlib.sha256(content).hexdigest()
+    path = preview_path(directory, sha256)
+    if not os.path.isfile(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first so that a crash never leaves a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return sha256
+
+
+@contextmanager
+def open_journal(path: str):
+    """Opens (and creates if necessary) the download journal at `path`.
+    `error` is set for tracks that failed permanently (e.g. HTTP 404)."""
+    con = sqlite3.connect(path, isolation_level=None)
+    # every finished track is committed on its own, WAL keeps these commits cheap
+    con.execute("PRAGMA journal_mode = WAL;")
+    con.execute("PRAGMA synchronous = NORMAL;")
+    con.execute(
+        """
+        CREATE TABLE IF NOT EXISTS downloads (
+            track_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            sha256 TEXT,
+            size INTEGER,
+            error TEXT
+        );
+    """
+    )
+    try:
+        yield con
+    finally:
+        con.close()
+
+
+def _done(
+    journal: sqlite3.Connection, directory: str, retry_failed: bool
+) -> Dict[str, str]:
+    """Urls by track_id of the journaled tracks that need no new download."""
+    done = {}
+    rows = journal.execute("SELECT track_id, url, sha256, error FROM downloads;")
+    for track_id, url, sha256, error in rows:
+        if error is not None:
+            if not retry_failed:
+                done[track_id] = url
+        elif os.path.isfile(preview_path(directory, sha256)):
+            done[track_id] = url
+    return done
+
+
+@maybe_wrap_connection
+def iter_preview_urls(con: sqlite3.Connection) -> Iterator[Tuple[str, str]]:
+    """(track_id, spotify_preview_url) of all tracks with a preview url."""
+    for track in iter_tracks(con):
+        if track.spotify_preview_url:
+            yield track.track_id, track.spotify_preview_url
+
+
+def download_previews(
+    urls: Iterable[Tuple[str, str]],
+    directory: str,
+    journal_path: Optional[str] = None,
+    workers: int = DEFAULT_WORKERS,
+    retries: int = 3,
+    backoff: float = 0.5,
+    timeout: float = 30.0,
+    retry_failed: bool = False,
+) -> Dict[str, int]:
+    """
+    Downloads the previews of `urls` into `directory`, see the module docstring.
+
+    :param urls: (track_id, url) pairs, e.g. `iter_preview_urls(con)`
+    :param directory: Root of the content addressed storage
+    :param journal_path: Defaults to `<directory>/journal.db`
+    :param workers: Number of concurrent downloads
+    :param retries: Retries per track for connection errors and HTTP 408, 429 and 5xx
+    :param backoff: Seconds to wait before the first retry, doubled for every further one
+    :param timeout: Socket timeout in seconds
+    :param retry_failed: Also retry tracks that failed permanently in an earlier run
+    :return: Number of tracks downloaded, skipped (done in an earlier run) and failed
+    """
+    os.makedirs(directory, exist_ok=True)
+    if journal_path is None:
+        journal_path = os.path.join(directory, "journal.db")
+    client = HttpClient(timeout)
+    counts = {"downloaded": 0, "skipped": 0, "failed": 0}
+
+    def _download(url: str) -> Tuple[str, int]:
+        content = fetch(client, url, retries, backoff)
+        try:
+            return store(directory, content), len(content)
+        except OSError as e:
+            # e.g. a full disk, not journaled so that the next run tries again
+            raise DownloadError(f"{url}: storing failed: {e!r}", retry=True) from e
+
+    with open_journal(journal_path) as journal, closing(client):
+        done = _done(journal, directory, retry_failed)
+        todo = []
+        for track_id, url in urls:
+            if done.get(track_id) == url:
+                counts["skipped"] += 1
+            else:
+                todo.append((track_id, url))
+        log.info(f"Downloading {len(todo)} previews, {counts['skipped']} are done.")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor, tqdm(
+            total=len(todo)
+        ) as pbar:
+            futures = {
+                executor.submit(_download, url): (track_id, url)
+                for track_id, url in todo
+            }
+            try:
+                for future in as_completed(futures):
+                    track_id, url = futures[future]
+                    try:
+                        sha256, size = future.result()
+                        row = (track_id, url, sha256, size, None)
+                        counts["downloaded"] += 1
+                    except DownloadError as e:
+                        counts["failed"] += 1
+                        log.warning(
+                            f"Failed to download the preview of {track_id}: {e}"
+                        )
+                        if e.retry:  # not journaled, the next run tries again
+                            pbar.update(1)
+                            continue
+                        row = (track_id, url, None, None, str(e))
+                    journal.execute(
+                        "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?);", row
+                    )
+                    pbar.update(1)
+            except BaseException:
+                # e.g. a failing journal, don't start the downloads still queued
+                for future in futures:
+                    future.cancel()
+                raise
+    return counts
@@ -0,0 +1,226 @@
+""" Implements a minibatch sampler for implicit-feedback training over an `InteractionMatrix`.
+
+Every epoch visits each (user, track) interaction of the matrix once in a shuffled order
+and pairs it with `num_negatives` tracks drawn by popularity::
+
+    matrix = load_interaction_matrix(PATH_TO_INTERACTION_MATRIX)
+    sampler = BatchSampler(matrix, batch_size=4096, num_negatives=4, seed=1)
+    for epoch in range(10):
+        for batch in sampler.iter_batches(epoch):
+            ...
+
+A batch is a handful of vectorized gathers from the CSR arrays, which may be memory
+mapped, so nothing is copied per interaction.
+
+Batches only depend on `seed`, the epoch and the shard. All shards of an epoch share one
+permutation and take every `num_shards`-th interaction of it, so N workers started with
+the same seed see disjoint parts of the data that together cover every interaction.
+"""
+import queue
+import threading
+from typing import Iterable, Iterator, NamedTuple, Optional, Tuple, TypeVar
+
+import numpy as np
+
+from lastfm_dataset.matrix import InteractionMatrix
+
+DEFAULT_BATCH_SIZE = 1024
+DEFAULT_NUM_NEGATIVES = 4
+# Negatives are drawn proportional to popularity ** alpha, 0.75 as in word2vec
+DEFAULT_POPULARITY_ALPHA = 0.75
+# Rounds of re-drawing negatives that turned out to be positives of the user
+MAX_REJECTION_ROUNDS = 10
+
+T = TypeVar("T")
+
+
+def alias_table(weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vose's alias table of `weights`: draw `i` uniformly, keep it with `probability[i]`
+    and take `alias[i]` otherwise, which draws `i` proportional to `weights[i]` in O(1).
+    """
+    n = len(weights)
+    total = weights.sum()
+    if n == 0 or total <= 0:
+        raise ValueError("Weights must contain a positive value.")
+    probability = weights * (n / total)
+    alias = np.arange(n, dtype=np.int32)
+    small = np.flatnonzero(probability < 1).tolist()
+    large = np.flatnonzero(probability >= 1).tolist()
+    scaled = probability.tolist()
+    while small and large:
+        less, more = small.pop(), large.pop()
+        alias[less] = more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    probability = np.array(scaled)
+    # whatever is left is 1 up to rounding
+    probability[small + large] = 1.0
+    return probability, alias
+
+
+class Batch(NamedTuple):
+    """Dense indices of `InteractionMatrix`, `neg_track_idxs` has one row per sample."""
+
+    user_idx: np.ndarray
+    pos_track_idx: np.ndarray
+    neg_track_idxs: np.ndarray
+    playcount: np.ndarray
+
+
+def prefetch(iterable: Iterable[T], size: int) -> Iterator[T]:
+    """Iterates `iterable` in a background thread, up to `size` items ahead. Errors of
+    the producer are raised in the consumer, closing the iterator stops the producer."""
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class BatchSampler:
+    """
+    Yields shuffled `Batch`es of the interactions in `matrix`, see the module docstring.
+
+    :param batch_size: Samples per batch, the last batch of an epoch may be smaller
+    :param num_negatives: Negative tracks per sample
+    :param popularity_alpha: Negatives are drawn with probability proportional to the
+        number of listeners of a track to this power, 0 draws them uniformly
+    :param seed: Seed of the permutations and of the negatives
+    :param shard: Index of this worker in `[0, num_shards)`
+    :param num_shards: Number of workers splitting every epoch
+    :param exclude_positives: Re-draw negatives the user has listened to, up to
+        `MAX_REJECTION_ROUNDS` times. Costs an int64 key per interaction.
+    :param drop_last: Skip the last batch of an epoch if it is smaller than `batch_size`
+    """
+
+    def __init__(
+        self,
+        matrix: InteractionMatrix,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        num_negatives: int = DEFAULT_NUM_NEGATIVES,
+        popularity_alpha: float = DEFAULT_POPULARITY_ALPHA,
+        seed: int = 0,
+        shard: int = 0,
+        num_shards: int = 1,
+        exclude_positives: bool = False,
+        drop_last: bool = False,
+    ):
+        if batch_size < 1 or num_negatives < 0:
+            raise ValueError("batch_size must be positive and num_negatives >= 0.")
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"shard {shard} is not in [0, {num_shards}).")
+        self.matrix = matrix
+        self.batch_size = batch_size
+        self.num_negatives = num_negatives
+        self.seed = seed
+        self.shard = shard
+        self.num_shards = num_shards
+        self.drop_last = drop_last
+
+        self.alias: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        if popularity_alpha != 0:
+            popularity = np.bincount(matrix.indices, minlength=matrix.shape[1])
+            self.alias = alias_table(popularity.astype(np.float64) ** popularity_alpha)
+        self.keys: Optional[np.ndarray] = None
+        if exclude_positives:
+            # rows are sorted by user and within a row by track, so are the keys
+            self.keys = self._keys(self._users(np.arange(len(matrix.indices))))
+            self.keys += matrix.indices
+
+    @property
+    def num_samples(self) -> int:
+        """Samples per epoch of this shard."""
+        total = len(self.matrix.indices)
+        return max(0, (total - self.shard + self.num_shards - 1) // self.num_shards)
+
+    def __len__(self) -> int:
+        """Batches per epoch of this shard."""
+        if self.drop_last:
+            return self.num_samples // self.batch_size
+        return -(-self.num_samples // self.batch_size)
+
+    def _users(self, positions: np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.matrix.indptr, positions, side="right") - 1
+
+    def _keys(self, users: np.ndarray) -> np.ndarray:
+        return users.astype(np.int64) * self.matrix.shape[1]
+
+    def _draw(self, rng: np.random.Generator, shape) -> np.ndarray:
+        tracks = rng.integers(0, self.matrix.shape[1], size=shape, dtype=np.int32)
+        if self.alias is None:
+            return tracks
+        probability, alias = self.alias
+        return np.where(
+            rng.random(size=shape) < probability[tracks], tracks, alias[tracks]
+        )
+
+    def _negatives(self, rng: np.random.Generator, users: np.ndarray) -> np.ndarray:
+        negatives = self._draw(rng, (len(users), self.num_negatives))
+        if self.keys is None or self.keys.size == 0:
+            return negatives
+        negatives = negatives.reshape(-1)
+        user_keys = np.repeat(self._keys(users), self.num_negatives)
+        check = np.arange(len(negatives))
+        for _ in range(MAX_REJECTION_ROUNDS):
+            keys = user_keys[check] + negatives[check]
+            found = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            check = check[self.keys[found] == keys]
+            if len(check) == 0:
+                break
+            negatives[check] = self._draw(rng, len(check))
+        return negatives.reshape(len(users), self.num_negatives)
+
+    def iter_batches(self, epoch: int = 0, prefetch_size: int = 2) -> Iterator[Batch]:
+        """The batches of `epoch`, built `prefetch_size` batches ahead in a background
+        thread (0 builds them in the calling thread)."""
+        batches = self._iter_batches(epoch)
+        if prefetch_size > 0:
+            return prefetch(batches, prefetch_size)
+        return batches
+
+    def _iter_batches(self, epoch: int) -> Iterator[Batch]:
+        # the permutation is shared by all shards, the negatives are drawn per shard
+        shuffle = np.random.default_rng([self.seed, epoch])
+        order = shuffle.permutation(len(self.matrix.indices))
+        positions = order[self.shard :: self.num_shards]
+        rng = np.random.default_rng([self.seed, epoch, self.num_shards, self.shard])
+        for i in range(len(self)):
+            batch = positions[i * self.batch_size : (i + 1) * self.batch_size]
+            users = self._users(batch)
+            yield Batch(
+                user_idx=users.astype(np.int32),
+                pos_track_idx=np.asarray(self.matrix.indices[batch], dtype=np.int32),
+                neg_track_idxs=self._negatives(rng, users),
+                playcount=np.asarray(self.matrix.data[batch], dtype=np.int32),
+            )
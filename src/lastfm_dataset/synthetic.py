@@ -0,0 +1,447 @@
+""" Generates synthetic stand-ins for the raw inputs and the result database.
+
+`sample_dataset` draws tracks, users, tags, listening histories and similars with the
+sizes of the real dataset (see `constants.py`) times `scale`. Track and tag popularity
+follow a power law and the number of tracks per user a geometric distribution, so lookups
+and joins hit skewed keys like on the real data.
+
+From one sample, `write_database` writes a result database with the schema of a build and
+`write_raw_inputs` the files a build reads. Building from the raw inputs (with the paths of
+the build pointed at them by `redirect_inputs`) gives the same rows as `write_database`:
+on top of the dataset, the raw inputs hold songs, LastFM files and triplets that the build
+filters out, in the proportions of the real inputs.
+
+Usage::
+
+    dataset = sample_dataset(scale=0.01)
+    write_database("data/synthetic/dataset.db", dataset)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from lastfm_dataset import constants
+from lastfm_dataset.constants import (
+    NUM_TAGS,
+    TOTAL_TRACK_SIMILAR_PAIRS,
+    TOTAL_TRACK_USER_PAIRS,
+    TOTAL_TRACKS,
+    TOTAL_USERS,
+)
+from lastfm_dataset.create import (
+    base_data,
+    colistened_data,
+    lastfm_corpus,
+    pipeline,
+    shards,
+    similars_data,
+    track_and_tags_data,
+    user_behavior_data,
+)
+from lastfm_dataset.create.utils import chunks, transaction
+
+# Sizes of the real raw inputs, most of their songs never make it into the dataset.
+TOTAL_UNIQUE_TRACKS = 1_000_000
+TOTAL_LASTFM_FILES = 943_347
+TOTAL_TRIPLETS = 48_373_586
+# Not published for the processed database and the LastFM files, chosen to look alike.
+PROCESSED_SONGS_PER_TRACK = 2.5
+TAGS_PER_TRACK = 3.0
+TRACK_POPULARITY_EXPONENT = 0.9
+TAG_POPULARITY_EXPONENT = 1.0
+PLAYCOUNT_EXPONENT = 2.2
+MAX_PLAYCOUNT = 10_000
+MAX_SIMILARS = 100  # LastFM lists at most 100 similar tracks per file
+
+LASTFM_DIR = "lastfm"
+# Build settings that `redirect_inputs` points below a directory.
+_INPUT_PATHS = [
+    "PATH_TO_RESULT",
+    "PATH_TO_PROCESSED_DB",
+    "PATH_TO_TRAIN_TRIPLETS",
+    "PATH_TO_NAME2ID_MAPPING",
+    "PATH_TO_NAME2ID_SUMMARY",
+    "PATH_TO_LASTFM_MANIFEST",
+    "PATH_TO_UNIQUE_TRACKS",
+    "PATH_TO_SONG_ID2TRACK_ID_MAPPING",
+    "PATH_TO_SONG_ID2TRACK_ID_SUMMARY",
+    "PATH_TO_USER_TRACK_PAIR_COUNT",
+]
+_BUILD_MODULES = [
+    base_data,
+    colistened_data,
+    lastfm_corpus,
+    pipeline,
+    shards,
+    similars_data,
+    track_and_tags_data,
+    user_behavior_data,
+]
+
+SyntheticDataset = namedtuple(
+    "SyntheticDataset",
+    [
+        "scale",
+        "seed",
+        "track_ids",
+        "user_ids",
+        "tags",
+        # (track index, tag index) arrays
+        "track_tags",
+        # (track index, user index, playcount) arrays, grouped by user
+        "track_users",
+        # (track index a, track index b, score) arrays
+        "similars",
+    ],
+)
+
+
+def _ids(prefix: str, n: int, seed: int, namespace: str, length: int = 16) -> List[str]:
+    """`n` distinct ids that look like MSD ids, e.g. `TR` followed by 16 characters."""
+    ids = [
+        prefix
+        + hashlib.sha1(f"{seed}:{namespace}:{i}".encode()).hexdigest()[:length].upper()
+        for i in range(n)
+    ]
+    if len(set(ids)) != n:
+        raise RuntimeError(f"Id collision in {namespace}, use another seed.")
+    return ids
+
+
+def _user_ids(n: int, seed: int) -> List[str]:
+    # Echo Nest user ids are 40 lower case hex characters
+    return [hashlib.sha1(f"{seed}:user:{i}".encode()).hexdigest() for i in range(n)]
+
+
+def _power_law(rng: np.random.Generator, n: int, exponent: float) -> np.ndarray:
+    """Probabilities of `n` items whose popularity falls with rank**-exponent, with the
+    ranks in random order."""
+    weights = np.arange(1, n + 1, dtype=np.float64) ** -exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
+
+
+def _first_unique_pairs(a: np.ndarray, b: np.ndarray, n_b: int) -> np.ndarray:
+    """Positions of the first occurrence of every (a, b) pair, in order."""
+    _, first = np.unique(a.astype(np.int64) * n_b + b, return_index=True)
+    first.sort()
+    return first
+
+
+def sample_dataset(scale: float = 0.01, seed: int = 0) -> SyntheticDataset:
+    """
+    Draws a synthetic dataset, see the module docstring.
+
+    :param scale: Size relative to the real dataset, 1.0 is ~48k tracks and ~9M track-user pairs
+    :param seed: Same seed and scale give the same dataset
+    """
+    if scale <= 0:
+        raise ValueError(f"scale must be positive, got {scale}")
+    rng = np.random.default_rng(seed)
+    n_tracks = max(2, round(TOTAL_TRACKS * scale))
+    n_users = max(1, round(TOTAL_USERS * scale))
+    popularity = _power_law(rng, n_tracks, TRACK_POPULARITY_EXPONENT)
+
+    tags_per_track = 1 + rng.poisson(TAGS_PER_TRACK - 1, n_tracks)
+    tag_tracks = np.repeat(np.arange(n_tracks), tags_per_track)
+    tag_ids = rng.choice(
+        NUM_TAGS,
+        size=len(tag_tracks),
+        p=_power_law(rng, NUM_TAGS, TAG_POPULARITY_EXPONENT),
+    )
+    keep = _first_unique_pairs(tag_tracks, tag_ids, NUM_TAGS)
+    track_tags = (tag_tracks[keep], tag_ids[keep])
+
+    # every user listened to at least one track
+    tracks_per_user = rng.geometric(TOTAL_USERS / TOTAL_TRACK_USER_PAIRS, n_users)
+    users = np.repeat(np.arange(n_users), tracks_per_user)
+    tracks = rng.choice(n_tracks, size=len(users), p=popularity)
+    keep = _first_unique_pairs(users, tracks, n_tracks)
+    playcounts = np.minimum(rng.zipf(PLAYCOUNT_EXPONENT, len(keep)), MAX_PLAYCOUNT)
+    track_users = (tracks[keep], users[keep], playcounts)
+
+    similars_per_track = np.minimum(
+        rng.poisson(TOTAL_TRACK_SIMILAR_PAIRS / TOTAL_TRACKS, n_tracks),
+        min(MAX_SIMILARS, n_tracks - 1),
+    )
+    a = np.repeat(np.arange(n_tracks), similars_per_track)
+    b = rng.choice(n_tracks, size=len(a), p=popularity)
+    keep = _first_unique_pairs(a, b, n_tracks)
+    keep = keep[a[keep] != b[keep]]
+    similars = (a[keep], b[keep], rng.random(len(keep)))
+
+    return SyntheticDataset(
+        scale=scale,
+        seed=seed,
+        track_ids=_ids("TR", n_tracks, seed, "track"),
+        user_ids=_user_ids(n_users, seed),
+        tags=[f"tag{i}" for i in range(NUM_TAGS)],
+        track_tags=track_tags,
+        track_users=track_users,
+        similars=similars,
+    )
+
+
+def _song(name: str, artist: str, spotify_id: str) -> Tuple[str, str, str, str, str]:
+    """name, artist, spotify preview url, lastfm url and spotify id of a song."""
+    lastfm_name = f"{artist}/_/{name}".replace(" ", "+")
+    return (
+        name,
+        artist,
+        f"https://p.scdn.co/mp3-preview/{spotify_id}",
+        f"https://www.last.fm/music/{lastfm_name}",
+        spotify_id,
+    )
+
+
+def _spotify_ids(n: int, seed: int, namespace: str) -> List[str]:
+    return [_id.lower() for _id in _ids("", n, seed, namespace, length=22)]
+
+
+def iter_track_rows(dataset: SyntheticDataset) -> Iterator[Tuple]:
+    """Rows of the `tracks` table."""
+    spotify_ids = _spotify_ids(len(dataset.track_ids), dataset.seed, "spotify")
+    for i, (track_id, spotify_id) in enumerate(zip(dataset.track_ids, spotify_ids)):
+        yield (track_id, *_song(f"Song {i}", f"Artist {i // 10}", spotify_id))
+
+
+def write_database(path: str, dataset: SyntheticDataset, overwrite: bool = False):
+    """Writes `dataset` into a result database at `path` with the schema of a build.
+    The colistened table is computed from the track-user pairs like in a build."""
+    track_ids, user_ids = dataset.track_ids, dataset.user_ids
+    with base_data.create_database_file(
+        overwrite_existing=overwrite, bulk_load=True, path=path
+    ) as con:
+        base_data.create_track_table(con)
+        base_data.create_users_table(con)
+        base_data.create_similar_table(con, with_keys=False)
+        base_data.create_tags_table(con, dataset.tags)
+        base_data.create_track_user_table(con, with_keys=False)
+        base_data.create_colistened_table(con)
+
+        with transaction(con):
+            con.executemany(
+                "INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?);",
+                iter_track_rows(dataset),
+            )
+            con.executemany(
+                "INSERT INTO track_tags VALUES (?, ?);",
+                ((track_ids[t], int(tag)) for t, tag in zip(*dataset.track_tags)),
+            )
+            con.executemany(
+                "INSERT INTO similar VALUES (?, ?, ?);",
+                (
+                    (track_ids[a], track_ids[b], float(score))
+                    for a, b, score in zip(*dataset.similars)
+                ),
+            )
+        for batch in chunks(list(zip(*dataset.track_users)), 100_000):
+            with transaction(con):
+                # users are inserted in order of first appearance, like in a build
+                con.executemany(
+                    "INSERT OR IGNORE INTO users VALUES (?);",
+                    ((user_ids[u],) for _, u, _ in batch),
+                )
+                con.executemany(
+                    "INSERT INTO track_users VALUES (?, ?, ?);",
+                    ((track_ids[t], user_ids[u], int(p)) for t, u, p in batch),
+                )
+        colistened_data.populate_colistened_table(con)
+
+
+def _write_processed_database(
+    path: str, dataset: SyntheticDataset, rng: np.random.Generator
+):
+    """The processed database has more songs than make it into `tracks`, their names
+    match no LastFM file."""
+    n_tracks = len(dataset.track_ids)
+    n_unmatched = round(n_tracks * (PROCESSED_SONGS_PER_TRACK - 1))
+    spotify_ids = _spotify_ids(n_unmatched, dataset.seed, "unmatched spotify")
+    songs = [row[1:] for row in iter_track_rows(dataset)]
+    songs.extend(
+        _song(f"Unmatched song {j}", f"Artist {j // 10}", spotify_ids[j])
+        for j in range(n_unmatched)
+    )
+    tags = np.zeros((len(songs), len(dataset.tags)), dtype=np.int64)
+    tags[dataset.track_tags] = 1
+
+    con = sqlite3.connect(path)
+    try:
+        con.execute(
+            "CREATE TABLE metadata (id_dataset TEXT, name TEXT, artist TEXT, id_spotify TEXT,"
+            " url_spotify_preview TEXT, url_lastfm TEXT);"
+        )
+        columns = ", ".join(f"{tag} INTEGER" for tag in dataset.tags)
+        con.execute(f"CREATE TABLE tags (id_dataset TEXT, {columns});")
+        order = rng.permutation(len(songs))
+        con.executemany(
+            "INSERT INTO metadata VALUES (?, ?, ?, ?, ?, ?);",
+            (
+                (str(i), name, artist, spotify_id, preview_url, lastfm_url)
+                for i in order
+                for name, artist, preview_url, lastfm_url, spotify_id in [songs[i]]
+            ),
+        )
+        con.executemany(
+            f"INSERT INTO tags VALUES ({', '.join('?' * (1 + len(dataset.tags)))});",
+            ((str(i), *tags[i].tolist()) for i in order),
+        )
+        con.commit()
+    finally:
+        con.close()
+
+
+def _group_starts(keys: np.ndarray, n: int) -> np.ndarray:
+    """Boundaries of the groups of the sorted `keys`, group i is [starts[i], starts[i + 1])."""
+    return np.searchsorted(keys, np.arange(n + 1))
+
+
+def _write_lastfm_files(
+    directory: str,
+    dataset: SyntheticDataset,
+    track_ids: List[str],
+    rng: np.random.Generator,
+):
+    """One json file per LastFM track, laid out like the LastFM dataset
+    (`<directory>/A/B/C/TRABC....json`). `track_ids` continues the ids of the dataset
+    with songs that are not in the processed database."""
+    n_tracks = len(dataset.track_ids)
+    a, b, scores = dataset.similars
+    similar_starts = _group_starts(a, n_tracks)
+    tag_tracks, tag_ids = dataset.track_tags
+    tag_starts = _group_starts(tag_tracks, n_tracks)
+    for i, track_id in enumerate(track_ids):
+        if i < n_tracks:
+            title = f"Song {i}"
+            lo, hi = similar_starts[i], similar_starts[i + 1]
+            similars = [
+                [track_ids[b[j]], float(scores[j])]
+                for j in sorted(range(lo, hi), key=lambda j: -scores[j])
+            ]
+            tags = [
+                [dataset.tags[tag], "100"]
+                for tag in tag_ids[tag_starts[i] : tag_starts[i + 1]]
+            ]
+        else:
+            title = f"Other song {i - n_tracks}"
+            n = min(rng.poisson(TOTAL_TRACK_SIMILAR_PAIRS / TOTAL_TRACKS), MAX_SIMILARS)
+            similars = [
+                [track_ids[j], float(score)]
+                for j, score in zip(
+                    rng.integers(0, len(track_ids), n), np.sort(rng.random(n))[::-1]
+                )
+            ]
+            tags = []
+        data = {
+            "artist": f"Artist {i // 10}",
+            "timestamp": "2011-08-15 00:00:00.000000",
+            "similars": similars,
+            "tags": tags,
+            "track_id": track_id,
+            "title": title,
+        }
+        path = os.path.join(directory, *track_id[2:5], f"{track_id}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fj:
+            fj.write(json.dumps(data))  # dumps uses the C encoder, dump does not
+
+
+def _write_triplets(
+    path: str, dataset: SyntheticDataset, song_ids: List[str], rng: np.random.Generator
+):
+    """Triplets of the dataset's track-user pairs plus triplets of songs without a track,
+    grouped by user like the Echo Nest file."""
+    n_tracks = len(dataset.track_ids)
+    tracks, users, playcounts = dataset.track_users
+    n_other = len(song_ids) - n_tracks
+    if n_other > 0:
+        per_user = rng.poisson(
+            (TOTAL_TRIPLETS - TOTAL_TRACK_USER_PAIRS) / TOTAL_USERS,
+            len(dataset.user_ids),
+        )
+        other_users = np.repeat(np.arange(len(dataset.user_ids)), per_user)
+        other_songs = n_tracks + rng.choice(
+            n_other,
+            size=len(other_users),
+            p=_power_law(rng, n_other, TRACK_POPULARITY_EXPONENT),
+        )
+        keep = _first_unique_pairs(other_users, other_songs, len(song_ids))
+        other_playcounts = np.minimum(
+            rng.zipf(PLAYCOUNT_EXPONENT, len(keep)), MAX_PLAYCOUNT
+        )
+        tracks = np.concatenate([tracks, other_songs[keep]])
+        users = np.concatenate([users, other_users[keep]])
+        playcounts = np.concatenate([playcounts, other_playcounts])
+    # shuffled within every user
+    order = rng.permutation(len(users))
+    order = order[np.argsort(users[order], kind="stable")]
+    with open(path, "w") as fh:
+        for batch in chunks(order, 100_000):
+            fh.write(
+                "".join(
+                    f"{dataset.user_ids[users[i]]}\t{song_ids[tracks[i]]}\t{playcounts[i]}\n"
+                    for i in batch
+                )
+            )
+
+
+def write_raw_inputs(directory: str, dataset: SyntheticDataset):
+    """
+    Writes the raw inputs of a build of `dataset` below `directory`, named like the
+    files in `data`: the processed database, the train triplets, unique tracks and the
+    LastFM json files (in `directory/lastfm`). Build from them with `redirect_inputs`.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng([dataset.seed, 1])
+    n_tracks = len(dataset.track_ids)
+    n_songs = max(n_tracks, round(TOTAL_UNIQUE_TRACKS * dataset.scale))
+    n_files = max(n_tracks, round(TOTAL_LASTFM_FILES * dataset.scale))
+    # the ids of the dataset come first as ids depend on the position only
+    track_ids = _ids("TR", n_songs, dataset.seed, "track")
+    song_ids = _ids("SO", n_songs, dataset.seed, "song")
+
+    def _path(name: str) -> str:
+        return os.path.join(directory, os.path.basename(getattr(constants, name)))
+
+    _write_processed_database(_path("PATH_TO_PROCESSED_DB"), dataset, rng)
+    _write_lastfm_files(
+        os.path.join(directory, LASTFM_DIR), dataset, track_ids[:n_files], rng
+    )
+    with open(_path("PATH_TO_UNIQUE_TRACKS"), "w") as fh:
+        for i, (track_id, song_id) in enumerate(zip(track_ids, song_ids)):
+            fh.write(f"{track_id}<SEP>{song_id}<SEP>Artist {i // 10}<SEP>Song {i}\n")
+    _write_triplets(_path("PATH_TO_TRAIN_TRIPLETS"), dataset, song_ids, rng)
+
+
+@contextmanager
+def redirect_inputs(directory: str):
+    """Points the input and output paths of the build (`lastfm_dataset.create`) below
+    `directory` while the block runs, e.g. to build from `write_raw_inputs`."""
+    patches = [
+        (
+            module,
+            name,
+            os.path.join(directory, os.path.basename(getattr(constants, name))),
+        )
+        for module in _BUILD_MODULES
+        for name in _INPUT_PATHS
+        if hasattr(module, name)
+    ]
+    patches += [
+        (lastfm_corpus, "ROOT_DIR", directory),
+        (lastfm_corpus, "DATA_DIR", LASTFM_DIR),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    try:
+        for module, name, value in patches:
+            setattr(module, name, value)
+        yield directory
+    finally:
+        for module, name, value in originals:
+            setattr(module, name, value)
@@ -0,0 +1,222 @@
+""" Implements nearest neighbour search over the tag vectors of the tracks.
+
+The tags of all tracks are materialized once as a bit-packed matrix (one bit per tag, so
+13 bytes per track for 100 tags) plus the sorted list of tracks of every tag.
+
+A track sharing `s` of the `n` tags of a query scores at most `s / n` (jaccard) or
+`sqrt(s / n)` (cosine), and one that has none of the `j` rarest tags of the query shares at
+most `n - j`. So `nearest_by_tags` scores the tracks of the rarest tag of a query first,
+the shared tags of a candidate being a popcount of the AND of the packed bits, and only
+adds the tracks of the next tag while an unseen track could still make the top `k`. Most
+queries are answered from a few hundred candidates instead of all tracks.
+"""
+import sqlite3
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from lastfm_dataset import maybe_wrap_connection
+from lastfm_dataset.matrix import index_ids
+
+TRACK_ID_DTYPE = "S18"
+METRICS = ("jaccard", "cosine")
+
+
+if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+    _bitwise_count = np.bitwise_count
+else:
+    _BYTE_COUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(
+        axis=1, dtype=np.uint8
+    )
+
+    def _bitwise_count(x: np.ndarray) -> np.ndarray:
+        counts = _BYTE_COUNTS[x.view(np.uint8)].reshape(*x.shape, x.itemsize)
+        return counts.sum(axis=-1, dtype=np.uint8)
+
+
+def _popcount(bits: np.ndarray) -> np.ndarray:
+    return _bitwise_count(bits).sum(axis=1, dtype=np.int64)
+
+
+def _words(bits: np.ndarray) -> np.ndarray:
+    """The bit-packed rows padded to whole uint64 words."""
+    num_words = -(-bits.shape[1] // 8)
+    words = np.zeros((len(bits), num_words * 8), dtype=np.uint8)
+    words[:, : bits.shape[1]] = bits
+    return words.view(np.uint64)
+
+
+def _shared(words: np.ndarray, query_words: np.ndarray) -> np.ndarray:
+    """Number of bits set in both `query_words` and every column of `words`."""
+    shared = _bitwise_count(words[0] & query_words[0]).astype(np.int64)
+    for i in range(1, len(query_words)):
+        shared += _bitwise_count(words[i] & query_words[i])
+    return shared
+
+
+def _scores(shared: np.ndarray, counts: np.ndarray, query_count: int, metric: str):
+    if metric == "jaccard":
+        return shared / (query_count + counts - shared)
+    return shared / np.sqrt(query_count * counts)
+
+
+class TagMatrix:
+    """Bit-packed track x tag matrix, rows sorted by track_id."""
+
+    def __init__(self, bits: np.ndarray, track_ids: np.ndarray, tag_names: List[str]):
+        self.bits = bits
+        self.track_ids = track_ids
+        self.tag_names = tag_names
+        self.tag_counts = _popcount(bits)
+
+        # the tracks of every tag grouped by their number of tags, in track order: those
+        # of tag t with c tags are postings[offsets[g] : offsets[g + 1]], g = t * groups + c
+        self.groups = int(self.tag_counts.max(initial=0)) + 1
+        unpacked = np.unpackbits(bits, axis=1, count=len(tag_names)).astype(bool)
+        tags, tracks = np.nonzero(unpacked.T)
+        group = tags * self.groups + self.tag_counts[tracks]
+        order = np.argsort(group, kind="stable")
+        self.postings = tracks[order]
+        self.offsets = np.searchsorted(
+            group[order], np.arange(len(tag_names) * self.groups + 1)
+        )
+        # the packed rows of the postings, one row per word, so that a group is contiguous
+        self.words = _words(bits)
+        self.posting_words = np.ascontiguousarray(self.words[self.postings].T)
+        # the tags of every track, rarest first: those of track i are
+        # track_tags[track_offsets[i] : track_offsets[i + 1]]
+        rarity = np.argsort(np.argsort(unpacked.sum(axis=0), kind="stable"))
+        tracks, tags = np.nonzero(unpacked)
+        self.track_tags = tags[np.lexsort((rarity[tags], tracks))]
+        self.track_offsets = np.searchsorted(tracks, np.arange(len(bits) + 1))
+        self.tag_words = _words(np.packbits(np.eye(len(tag_names), dtype=bool), axis=1))
+        self._blocks: Dict[
+            Tuple[int, str], Tuple[List[Tuple[int, int]], List[float]]
+        ] = {}
+
+    def index(self, track_ids: Sequence[str]) -> np.ndarray:
+        """Row indices of `track_ids`. Raises KeyError for unknown ids."""
+        return index_ids(self.track_ids, track_ids)
+
+    def _blocks_by_bound(self, query_count: int, metric: str):
+        """
+        The blocks (j, c) of the tracks that have the j-th rarest of `query_count` query
+        tags but none of the rarer ones, and c tags, with the best score of any of their
+        tracks, in descending order of that score.
+        """
+        key = (query_count, metric)
+        if key not in self._blocks:
+            j = np.arange(query_count)[:, None]
+            count = np.arange(1, self.groups)[None, :]
+            # a track of block (j, c) shares at most n - j and at most c tags
+            shared = np.minimum(count, query_count - j)
+            bounds = _scores(shared, count, query_count, metric).ravel()
+            order = np.argsort(-bounds, kind="stable")
+            blocks = [divmod(block, self.groups - 1) for block in order.tolist()]
+            self._blocks[key] = (
+                [(j, c + 1) for j, c in blocks],
+                bounds[order].tolist(),
+            )
+        return self._blocks[key]
+
+    def _nearest(self, row: int, k: int, metric: str) -> Tuple[np.ndarray, np.ndarray]:
+        """The `k` nearest tracks of the tags of `row` in order, may include `row`."""
+        query_count = int(self.tag_counts[row])
+        query_words = self.words[row]
+        tags = self.track_tags[self.track_offsets[row] : self.track_offsets[row + 1]]
+        seen = np.bitwise_or.accumulate(self.tag_words[tags], axis=0)
+
+        candidates, scores = [], []
+        top, kth = np.zeros(0), -np.inf
+        for (j, count), bound in zip(*self._blocks_by_bound(query_count, metric)):
+            if kth > bound:
+                # an unseen track with the same score could still win the tie
+                break
+            group = int(tags[j]) * self.groups + count
+            start, end = self.offsets[group], self.offsets[group + 1]
+            if start == end:
+                continue
+            tracks, words = self.postings[start:end], self.posting_words[:, start:end]
+            if j > 0:  # the tracks of the rarer tags of the query are scored already
+                new = _shared(words, seen[j - 1]) == 0
+                tracks, words = tracks[new], words[:, new]
+            block_scores = _scores(
+                _shared(words, query_words), count, query_count, metric
+            )
+            candidates.append(tracks)
+            scores.append(block_scores)
+            if len(top) < k or block_scores.max(initial=-np.inf) > kth:
+                top = np.concatenate([top, block_scores])
+                if len(top) >= k:
+                    top = np.partition(top, len(top) - k)[len(top) - k :]
+                    kth = top[0]
+        if candidates:
+            candidates, scores = np.concatenate(candidates), np.concatenate(scores)
+            keep = scores >= kth
+            candidates, scores = candidates[keep], scores[keep]
+        else:
+            candidates, scores = np.zeros(0, dtype=np.int64), np.zeros(0)
+        # sort by descending similarity, then by index (= track_id order)
+        order = np.lexsort((candidates, -scores))[:k]
+        candidates, scores = candidates[order], scores[order]
+        if len(candidates) < k:
+            # all other tracks have similarity 0, take them in track_id order
+            rest = np.arange(min(len(self.track_ids), k + len(candidates)))
+            rest = np.setdiff1d(rest, candidates)[: k - len(candidates)]
+            candidates = np.concatenate([candidates, rest])
+            scores = np.concatenate([scores, np.zeros(len(rest))])
+        return candidates, scores
+
+    def nearest_by_tags(
+        self, track_ids: Sequence[str], k: int, metric: str = "jaccard"
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The `k` tracks with the most similar tags for every track in `track_ids`,
+        excluding the track itself. Ties are broken by track_id.
+
+        :param track_ids: Query tracks
+        :param k: Number of neighbours per query
+        :param metric: "jaccard" or "cosine" similarity of the tag sets
+        :return: Neighbour track ids and similarities, both of shape (len(track_ids), k)
+        """
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}, got {metric}")
+        rows = self.index(track_ids)
+        k = max(min(k, len(self.track_ids) - 1), 0)
+        neighbours = np.empty((len(rows), k), dtype=np.int64)
+        scores = np.empty((len(rows), k), dtype=np.float32)
+        # queries with the same tags have the same neighbours, up to the query itself
+        _, patterns = np.unique(self.bits[rows], axis=0, return_inverse=True)
+        nearest = {}
+        for i, (row, pattern) in enumerate(zip(rows.tolist(), patterns.tolist())):
+            if pattern not in nearest:
+                nearest[pattern] = self._nearest(row, k + 1, metric)
+            candidates, candidate_scores = nearest[pattern]
+            keep = candidates != row
+            neighbours[i] = candidates[keep][:k]
+            scores[i] = candidate_scores[keep][:k]
+        return self.track_ids[neighbours].astype(str), scores
+
+
+@maybe_wrap_connection
+def load_tag_matrix(con: sqlite3.Connection) -> TagMatrix:
+    """Reads the sparse `track_tags` rows of all tracks into a `TagMatrix`."""
+    cursor = con.cursor()
+    cursor.row_factory = None
+    tag_names = [
+        row[0] for row in cursor.execute("SELECT name FROM tag_names ORDER BY tag_id;")
+    ]
+    track_ids = np.array(
+        [
+            row[0]
+            for row in cursor.execute("SELECT track_id FROM tracks ORDER BY track_id;")
+        ],
+        dtype=TRACK_ID_DTYPE,
+    )
+    pairs = cursor.execute("SELECT track_id, tag_id FROM track_tags;").fetchall()
+    dense = np.zeros((len(track_ids), len(tag_names)), dtype=bool)
+    if len(pairs) > 0:
+        rows = np.searchsorted(
+            track_ids, np.array([p[0] for p in pairs], dtype=TRACK_ID_DTYPE)
+        )
+        dense[rows, [p[1] for p in pairs]] = True
+    return TagMatrix(np.packbits(dense, axis=1), track_ids, tag_names)
@@ -0,0 +1,456 @@
+""" Implements opt-in tracing of the queries of the read path.
+
+Enable it with `lastfm_dataset.init(path, trace=True)`, `lastfm_dataset.tracing.enable(...)`
+or by setting the environment variable `LASTFM_DATASET_TRACE=1` before the package is
+imported. Connections opened afterwards by `get_connection` and by the pool of
+`lastfm_dataset.init` are traced, and so is every call of a function wrapped by
+`maybe_wrap_connection` (all of `lastfm_dataset.get`).
+
+Recorded are latency histograms and row counts per function and per statement (statements
+are grouped by their SQL with whitespace and `IN (?, ?, ...)` lists collapsed), plus the
+latest statements slower than `slow_ms` with their `EXPLAIN QUERY PLAN`. The time of a
+statement includes fetching its rows. `snapshot()` returns everything as a json-able dict,
+with `dump_path` it is also written to a file every `dump_interval` seconds and at exit.
+
+Further environment variables: `LASTFM_DATASET_TRACE_SLOW_MS`, `LASTFM_DATASET_TRACE_DUMP`
+(the dump path) and `LASTFM_DATASET_TRACE_DUMP_INTERVAL`.
+"""
+import atexit
+import bisect
+import datetime
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import types
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Type
+
+# Upper bounds in seconds of the histogram buckets, the last bucket is unbounded.
+BUCKETS = [
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+]
+DEFAULT_SLOW_MS = 100.0
+DEFAULT_MAX_SAMPLES = 50
+DEFAULT_DUMP_INTERVAL = 60.0
+# Parameters stored with a slow statement, lookups bind up to hundreds of ids
+MAX_SAMPLE_PARAMETERS = 10
+
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+def normalize_sql(sql: str) -> str:
+    """The statement `sql` is grouped by."""
+    return _PLACEHOLDER_LIST.sub("(?, ...)", " ".join(sql.split()))
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class Histogram:
+    """Latencies in `BUCKETS` plus their count, sum, max and the number of rows."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def add(self, seconds: float, rows: int):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket of the `q` quantile, `max` for the last bucket."""
+        if self.count == 0:
+            return None
+        rank, seen = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "rows": self.rows,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                str(bound): count
+                for bound, count in zip([*BUCKETS, "inf"], self.counts)
+            },
+        }
+
+
+class Tracer:
+    """Collects the measurements, see the module docstring. Thread-safe."""
+
+    def __init__(
+        self,
+        slow_ms: float = DEFAULT_SLOW_MS,
+        max_samples: int = DEFAULT_MAX_SAMPLES,
+    ):
+        self.slow_seconds = slow_ms / 1000
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._max_samples = max_samples
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = _now()
+            self.functions: Dict[str, Histogram] = {}
+            self.statements: Dict[str, Histogram] = {}
+            self.statement_functions: Dict[str, set] = {}
+            self.slow: deque = deque(maxlen=self._max_samples)
+
+    def current_function(self) -> Optional[str]:
+        stack = self._local.__dict__.get("functions")
+        return stack[-1] if stack else None
+
+    def enter(self, name: str):
+        self._local.__dict__.setdefault("functions", []).append(name)
+
+    def exit(self):
+        self._local.functions.pop()
+
+    def record_function(self, name: str, seconds: float, rows: int):
+        with self._lock:
+            self.functions.setdefault(name, Histogram()).add(seconds, rows)
+
+    def record_statement(
+        self,
+        con: sqlite3.Connection,
+        sql: str,
+        parameters: Any,
+        seconds: float,
+        rows: int,
+    ):
+        key = normalize_sql(sql)
+        function = self.current_function()
+        sample = None
+        if seconds >= self.slow_seconds:
+            sample = {
+                "time": _now(),
+                "function": function,
+                "sql": key,
+                "parameters": _sample_parameters(parameters),
+                "seconds": round(seconds, 6),
+                "rows": rows,
+                "plan": explain(con, sql, parameters),
+            }
+        with self._lock:
+            self.statements.setdefault(key, Histogram()).add(seconds, rows)
+            if function is not None:
+                self.statement_functions.setdefault(key, set()).add(function)
+            if sample is not None:
+                self.slow.append(sample)
+
+    def snapshot(self, reset: bool = False) -> Dict:
+        with self._lock:
+            snapshot = {
+                "started": self.started,
+                "taken": _now(),
+                "slow_ms": self.slow_seconds * 1000,
+                "functions": {k: h.to_dict() for k, h in self.functions.items()},
+                "statements": {
+                    k: {
+                        **h.to_dict(),
+                        "functions": sorted(self.statement_functions.get(k, ())),
+                    }
+                    for k, h in self.statements.items()
+                },
+                "slow_queries": list(self.slow),
+            }
+        if reset:
+            self.reset()
+        return snapshot
+
+
+def _sample_parameters(parameters: Any) -> Any:
+    if isinstance(parameters, dict):
+        return {k: repr(v) for k, v in list(parameters.items())[:MAX_SAMPLE_PARAMETERS]}
+    return [repr(v) for v in list(parameters)[:MAX_SAMPLE_PARAMETERS]]
+
+
+def explain(
+    con: sqlite3.Connection, sql: str, parameters: Any = ()
+) -> Optional[List[str]]:
+    """The `EXPLAIN QUERY PLAN` of a query, indented by depth, or None for other statements."""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    try:
+        cursor = sqlite3.Cursor(con)
+        cursor.row_factory = None
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error:
+        return None
+    depth = {0: -1}
+    plan = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node] + detail)
+    return plan
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Records every statement with the time spent executing it and fetching its rows.
+    A statement is recorded once all rows are fetched, or when the cursor executes the
+    next one, is closed or garbage collected."""
+
+    _statement = None
+
+    def _finish(self):
+        statement, self._statement = self._statement, None
+        tracer = _TRACER
+        if statement is not None and tracer is not None:
+            sql, parameters, seconds, rows = statement
+            tracer.record_statement(self.connection, sql, parameters, seconds, rows)
+
+    def _timed(self, seconds: float, rows: int):
+        if self._statement is not None:
+            self._statement[2] += seconds
+            self._statement[3] += rows
+
+    def execute(self, sql: str, parameters: Any = ()):
+        self._finish()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._statement = [sql, parameters, time.perf_counter() - start, 0]
+        if self.description is None:  # no rows to fetch
+            self._finish()
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters):
+        self._finish()
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._statement = [sql, (), time.perf_counter() - start, max(self.rowcount, 0)]
+        self._finish()
+        return self
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._timed(time.perf_counter() - start, 0)
+            self._finish()
+            raise
+        self._timed(time.perf_counter() - start, 1)
+        return row
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._timed(time.perf_counter() - start, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        size = self.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._timed(time.perf_counter() - start, len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._timed(time.perf_counter() - start, len(rows))
+        self._finish()
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:  # e.g. the connection is closed already
+            pass
+
+
+class TracedConnection(sqlite3.Connection):
+    """Hands out `TracedCursor`s while tracing is enabled."""
+
+    def cursor(self, factory: Optional[Type[sqlite3.Cursor]] = None):
+        if factory is None:
+            factory = TracedCursor if _TRACER is not None else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql: str, parameters: Any = ()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory() -> Type[sqlite3.Connection]:
+    """The `factory` for `sqlite3.connect` of the package's connections."""
+    return TracedConnection if _TRACER is not None else sqlite3.Connection
+
+
+def _rows(result: Any) -> int:
+    return len(result) if isinstance(result, (list, dict)) else 0
+
+
+def _traced_generator(tracer: Tracer, name: str, generator):
+    """Times the consumption of `generator`, recorded when it is exhausted or closed."""
+    seconds, rows = 0.0, 0
+    try:
+        while True:
+            start = time.perf_counter()
+            tracer.enter(name)
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                tracer.exit()
+                seconds += time.perf_counter() - start
+            rows += 1
+            yield item
+    finally:
+        generator.close()
+        tracer.record_function(name, seconds, rows)
+
+
+def trace_call(func: Callable, *args, **kwargs):
+    """Calls `func`, recording its latency and number of results if tracing is enabled."""
+    tracer = _TRACER
+    if tracer is None:
+        return func(*args, **kwargs)
+    name = func.__name__
+    start = time.perf_counter()
+    tracer.enter(name)
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        tracer.exit()
+    if isinstance(result, types.GeneratorType):
+        return _traced_generator(tracer, name, result)
+    tracer.record_function(name, time.perf_counter() - start, _rows(result))
+    return result
+
+
+class _Dumper(threading.Thread):
+    def __init__(self, path: str, interval: float):
+        super().__init__(name="lastfm_dataset.tracing", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            dump(self.path)
+
+
+_TRACER: Optional[Tracer] = None
+_DUMPER: Optional[_Dumper] = None
+
+
+def enabled() -> bool:
+    return _TRACER is not None
+
+
+def enable(
+    slow_ms: float = DEFAULT_SLOW_MS,
+    max_samples: int = DEFAULT_MAX_SAMPLES,
+    dump_path: Optional[str] = None,
+    dump_interval: float = DEFAULT_DUMP_INTERVAL,
+):
+    """
+    Starts tracing (again, with empty measurements), see the module docstring.
+    Connections that are already open stay untraced, `lastfm_dataset.init` re-opens
+    those of the pool.
+
+    :param slow_ms: Statements taking at least this long are kept as samples
+    :param max_samples: Number of latest slow statements kept
+    :param dump_path: Write `snapshot()` as json to this file periodically and at exit
+    :param dump_interval: Seconds between two dumps
+    """
+    global _TRACER, _DUMPER
+    disable()
+    _TRACER = Tracer(slow_ms, max_samples)
+    if dump_path is not None:
+        _DUMPER = _Dumper(dump_path, dump_interval)
+        _DUMPER.start()
+
+
+def disable():
+    """Stops tracing, writing a last dump if `dump_path` was set."""
+    global _TRACER, _DUMPER
+    if _DUMPER is not None:
+        _DUMPER.stopped.set()
+        dump(_DUMPER.path)
+        _DUMPER = None
+    _TRACER = None
+
+
+def snapshot(reset: bool = False) -> Dict:
+    """Everything recorded since tracing was enabled or last reset, empty if disabled.
+
+    :param reset: Start over with empty measurements, e.g. to report deltas
+    """
+    if _TRACER is None:
+        return {}
+    return _TRACER.snapshot(reset)
+
+
+def dump(path: str):
+    """Writes `snapshot()` as json to `path`, atomically replacing the file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as fj:
+        json.dump(snapshot(), fj, indent=2)
+    os.replace(tmp_path, path)
+
+
+def enable_from_env(environ=os.environ):
+    """Enables tracing if `LASTFM_DATASET_TRACE` is set to a true value."""
+    if environ.get("LASTFM_DATASET_TRACE", "").lower() not in ("1", "true", "yes"):
+        return
+    enable(
+        slow_ms=float(environ.get("LASTFM_DATASET_TRACE_SLOW_MS", DEFAULT_SLOW_MS)),
+        dump_path=environ.get("LASTFM_DATASET_TRACE_DUMP"),
+        dump_interval=float(
+            environ.get("LASTFM_DATASET_TRACE_DUMP_INTERVAL", DEFAULT_DUMP_INTERVAL)
+        ),
+    )
+
+
+atexit.register(disable)
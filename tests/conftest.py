@@ -0,0 +1,137 @@
+import sqlite3
+
+import pytest
+
+from lastfm_dataset import row_factory
+from lastfm_dataset.create.base_data import (
+    create_all_indexes,
+    create_colistened_table,
+    create_similar_table,
+    create_tags_table,
+    create_track_table,
+    create_track_user_table,
+    create_users_table,
+)
+
+TAGS = ["rock", "pop", "jazz"]
+
+
+@pytest.fixture()
+def empty_db(tmp_path) -> sqlite3.Connection:
+    """A result database with all tables created but no rows."""
+    con = sqlite3.connect(tmp_path / "dataset.db", isolation_level=None)
+    con.row_factory = row_factory
+    create_track_table(con)
+    create_users_table(con)
+    create_similar_table(con)
+    create_tags_table(con, TAGS)
+    create_track_user_table(con)
+    create_colistened_table(con)
+    yield con
+    con.close()
+
+
+TRACK_IDS = ["TRAAAAA128F93437B1", "TRBBBBB128F93437B2", "TRCCCCC128F93437B3"]
+USER_IDS = ["a" * 40, "b" * 40]
+
+
+@pytest.fixture()
+def tiny_db(empty_db: sqlite3.Connection) -> sqlite3.Connection:
+    """A result database with indexes and a handful of rows in every table."""
+    con = empty_db
+    create_all_indexes(con)
+    for i, track_id in enumerate(TRACK_IDS):
+        con.execute(
+            "INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?);",
+            (
+                track_id,
+                f"Song {i}",
+                f"Artist {i}",
+                f"https://p/{i}",
+                f"https://l/{i}",
+                f"sp{i}",
+            ),
+        )
+    # rock & jazz, pop, rock & pop
+    con.executemany(
+        "INSERT INTO track_tags VALUES (?, ?);",
+        [
+            (TRACK_IDS[0], 0),
+            (TRACK_IDS[0], 2),
+            (TRACK_IDS[1], 1),
+            (TRACK_IDS[2], 0),
+            (TRACK_IDS[2], 1),
+        ],
+    )
+    con.executemany("INSERT INTO users VALUES (?);", [(u,) for u in USER_IDS])
+    con.executemany(
+        "INSERT INTO similar VALUES (?, ?, ?);",
+        [
+            (TRACK_IDS[0], TRACK_IDS[1], 0.9),
+            (TRACK_IDS[0], TRACK_IDS[2], 0.4),
+            (TRACK_IDS[1], TRACK_IDS[0], 0.8),
+        ],
+    )
+    con.executemany(
+        "INSERT INTO track_users VALUES (?, ?, ?);",
+        [
+            (TRACK_IDS[0], USER_IDS[0], 3),
+            (TRACK_IDS[1], USER_IDS[0], 1),
+            (TRACK_IDS[0], USER_IDS[1], 7),
+        ],
+    )
+    con.executemany(
+        "INSERT INTO colistened VALUES (?, ?, ?, ?);",
+        [
+            (TRACK_IDS[0], 0, TRACK_IDS[1], 0.5**0.5),
+            (TRACK_IDS[1], 0, TRACK_IDS[0], 0.5**0.5),
+        ],
+    )
+    return con
+
+
+METADATA = [
+    # id_dataset, name, artist, id_spotify, url_spotify_preview, url_lastfm
+    ("d1", "Song 1", "Artist 1", "sp1", "https://p/1.mp3", "https://l/1"),
+    ("d2", "Song 2", "Artist 2", "sp2", "https://p/2.mp3", "https://l/2"),
+    ("d3", "Song 1", "Artist 3", "sp3", "https://p/3.mp3", "https://l/3"),
+    ("d4", "Unmatched", "Artist 4", "sp4", "https://p/4.mp3", "https://l/4"),
+    ("d5", "Song 3", "Artist 5", "sp5", "https://p/5.mp3", "https://l/5"),
+]
+PROCESSED_TAGS = {
+    "d1": (1, 0, 1),
+    "d2": (0, 1, 0),
+    "d3": (1, 1, 1),
+    "d4": (0, 0, 1),
+    "d5": (0, 0, 1),
+}
+
+
+@pytest.fixture()
+def processed_db(tmp_path, monkeypatch) -> str:
+    """A tiny stand-in for `lastfm_dataset_2020.db` used by the tracks and tags stage."""
+    from lastfm_dataset.create import track_and_tags_data
+
+    path = str(tmp_path / "lastfm_dataset_2020.db")
+    con = sqlite3.connect(path)
+    con.execute(
+        "CREATE TABLE metadata (id_dataset TEXT, name TEXT, artist TEXT, id_spotify TEXT,"
+        " url_spotify_preview TEXT, url_lastfm TEXT);"
+    )
+    con.execute(
+        f"CREATE TABLE tags (id_dataset TEXT, {', '.join(f'{t} INTEGER' for t in TAGS)});"
+    )
+    con.executemany("INSERT INTO metadata VALUES (?, ?, ?, ?, ?, ?);", METADATA)
+    con.executemany(
+        "INSERT INTO tags VALUES (?, ?, ?, ?);",
+        [(d_id, *tags) for d_id, tags in PROCESSED_TAGS.items()],
+    )
+    con.commit()
+    con.close()
+    monkeypatch.setattr(track_and_tags_data, "PATH_TO_PROCESSED_DB", path)
+    monkeypatch.setattr(
+        track_and_tags_data,
+        "PATH_TO_NAME2ID_MAPPING",
+        str(tmp_path / "name2track_id_mapping.json"),
+    )
+    return path
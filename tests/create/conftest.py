@@ -0,0 +1,63 @@
+import json
+import random
+
+import pytest
+
+from lastfm_dataset.create import (
+    base_data,
+    lastfm_corpus,
+    pipeline,
+    shards,
+    similars_data,
+    user_behavior_data,
+)
+from lastfm_dataset.create.id_mapping import build_id_mapping, save_id_mapping
+
+FILES = {
+    "A/B/TRAAA.json": ("Song 1", [["TRBBB", 1.0], ["TREEE", 0.5], ["TRBBB", 0.3]]),
+    "A/C/TRBBB.json": ("Song 2", [["TRAAA", 0.7]]),
+    "B/A/TRCCC.json": ("Song 1", [["TRAAA", 0.2]]),  # duplicated title
+    "C/A/TREEE.json": ("Song 3", [["TRAAA", 0.1], ["TRXXX", 0.9]]),
+}
+MAPPING = {"SOA": "TRAAA", "SOB": "TRBBB", "SOC": "TRCCC", "SOE": "TREEE"}
+
+
+@pytest.fixture()
+def raw_inputs(tmp_path, monkeypatch, processed_db):
+    """Every raw input of a build: LastFM json files, train triplets and unique tracks,
+    plus the processed database, below `tmp_path`."""
+    for rel_path, (title, similars) in FILES.items():
+        path = tmp_path / "lastfm" / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps({"title": title, "track_id": path.stem, "similars": similars})
+        )
+    monkeypatch.setattr(lastfm_corpus, "ROOT_DIR", str(tmp_path))
+    monkeypatch.setattr(lastfm_corpus, "DATA_DIR", "lastfm")
+    for module in [base_data, pipeline, shards, similars_data]:
+        monkeypatch.setattr(
+            module, "PATH_TO_LASTFM_MANIFEST", str(tmp_path / "manifest.db")
+        )
+
+    rng = random.Random(0)
+    songs = list(MAPPING) + ["SOX"]
+    # users repeat across lines, so they cross the boundaries between shards
+    triplets = {(f"u{rng.randint(0, 30)}", rng.choice(songs)) for _ in range(300)}
+    (tmp_path / "train_triplets.txt").write_text(
+        "".join(f"{u}\t{s}\t{rng.randint(1, 9)}\n" for u, s in sorted(triplets))
+    )
+    mapping, _ = build_id_mapping(list(MAPPING), list(MAPPING.values()))
+    save_id_mapping(mapping, str(tmp_path / "song_id2track_id.npy"))
+    (tmp_path / "unique_tracks.txt").write_text(
+        "".join(f"{t}<SEP>{s}<SEP>Artist<SEP>Title\n" for s, t in MAPPING.items())
+    )
+    for name, file_name in [
+        ("PATH_TO_TRAIN_TRIPLETS", "train_triplets.txt"),
+        ("PATH_TO_SONG_ID2TRACK_ID_MAPPING", "song_id2track_id.npy"),
+        ("PATH_TO_USER_TRACK_PAIR_COUNT", "user_track_pair_count.json"),
+        ("PATH_TO_UNIQUE_TRACKS", "unique_tracks.txt"),
+    ]:
+        monkeypatch.setattr(user_behavior_data, name, str(tmp_path / file_name))
+    for name in ["PATH_TO_NAME2ID_SUMMARY", "PATH_TO_SONG_ID2TRACK_ID_SUMMARY"]:
+        monkeypatch.setattr(pipeline, name, str(tmp_path / f"{name}.json"))
+    return tmp_path
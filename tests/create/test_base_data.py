@@ -0,0 +1,89 @@
+import sqlite3
+
+import pytest
+
+from lastfm_dataset import row_factory
+from lastfm_dataset.create.base_data import (
+    convert_tags_to_sparse,
+    create_all_tables,
+    create_database_file,
+    create_track_table,
+)
+
+SIMILARS = [("TRB", "TRA", 0.5), ("TRA", "TRB", 1.0), ("TRA", "TRB", 0.1)]
+TRACK_USERS = [("TRB", "u1", 3), ("TRA", "u2", 1), ("TRA", "u1", 2)]
+
+
+def _build(path: str, bulk_load: bool):
+    with create_database_file(path=path, bulk_load=bulk_load) as con:
+        create_all_tables(con, defer_keys=bulk_load)
+        con.executemany("INSERT OR IGNORE INTO similar VALUES (?, ?, ?);", SIMILARS)
+        con.executemany("INSERT INTO track_users VALUES (?, ?, ?);", TRACK_USERS)
+
+
+def _dump(path: str):
+    con = sqlite3.connect(path)
+    schema = dict(
+        con.execute(
+            "SELECT name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_stat%';"
+        ).fetchall()
+    )
+    similar = con.execute("SELECT * FROM similar ORDER BY 1, 2;").fetchall()
+    track_users = con.execute("SELECT * FROM track_users ORDER BY 1, 2;").fetchall()
+    con.close()
+    return schema, similar, track_users
+
+
+def test_bulk_load_matches_normal_build(tmp_path, processed_db):
+    _build(str(tmp_path / "normal.db"), bulk_load=False)
+    _build(str(tmp_path / "bulk.db"), bulk_load=True)
+
+    normal = _dump(str(tmp_path / "normal.db"))
+    bulk = _dump(str(tmp_path / "bulk.db"))
+    assert bulk == normal
+    assert ("TRA", "TRB", 1.0) in bulk[1]
+
+
+def test_bulk_load_keeps_failing_on_duplicate_track_users(tmp_path, processed_db):
+    with pytest.raises(sqlite3.IntegrityError):
+        with create_database_file(
+            path=str(tmp_path / "bulk.db"), bulk_load=True
+        ) as con:
+            create_all_tables(con, defer_keys=True)
+            con.executemany(
+                "INSERT INTO track_users VALUES (?, ?, ?);", TRACK_USERS * 2
+            )
+
+
+def test_create_database_file_does_not_overwrite(tmp_path):
+    path = tmp_path / "dataset.db"
+    path.touch()
+    with pytest.raises(FileExistsError):
+        with create_database_file(path=str(path)):
+            pass
+
+
+def test_convert_tags_to_sparse(tmp_path):
+    con = sqlite3.connect(str(tmp_path / "old.db"), isolation_level=None)
+    con.row_factory = row_factory
+    create_track_table(con)
+    con.execute(
+        "CREATE TABLE tags (track_id INTEGER, 'rock' INTEGER NOT NULL,"
+        " 'hip hop' INTEGER NOT NULL);"
+    )
+    for track_id, tags in [("TRA", (1, 0)), ("TRB", (1, 1)), ("TRC", (0, 0))]:
+        con.execute(
+            "INSERT INTO tracks VALUES (?, 'n', 'a', 'p', 'l', 's');", (track_id,)
+        )
+        con.execute("INSERT INTO tags VALUES (?, ?, ?);", (track_id, *tags))
+    wide = con.execute("SELECT * FROM tags ORDER BY track_id;").fetchall()
+
+    convert_tags_to_sparse(con)
+    convert_tags_to_sparse(con)  # no-op once converted
+
+    assert con.execute("SELECT * FROM tags ORDER BY track_id;").fetchall() == wide
+    assert con.execute("SELECT * FROM track_tags;").fetchall() == [
+        {"track_id": "TRA", "tag_id": 0},
+        {"track_id": "TRB", "tag_id": 0},
+        {"track_id": "TRB", "tag_id": 1},
+    ]
@@ -0,0 +1,92 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from lastfm_dataset.create.colistened_data import (
+    iter_colistened,
+    populate_colistened_table,
+)
+from lastfm_dataset.get import get_colistened
+from lastfm_dataset.matrix import InteractionMatrix, build_interaction_matrix
+
+A, B, C, D = "TRA", "TRB", "TRC", "TRD"
+# listeners: A {u1, u2}, B {u1, u2}, C {u1, u3}, D {u3}
+TRACK_USERS = [(A, "u1", 1), (B, "u1", 2), (C, "u1", 1), (A, "u2", 5), (B, "u2", 1)]
+TRACK_USERS += [(C, "u3", 1), (D, "u3", 3)]
+
+
+@pytest.fixture()
+def db(empty_db: sqlite3.Connection) -> sqlite3.Connection:
+    for track_id in [A, B, C, D]:
+        empty_db.execute(
+            "INSERT INTO tracks VALUES (?, '', '', '', '', '');", (track_id,)
+        )
+    empty_db.executemany("INSERT INTO track_users VALUES (?, ?, ?);", TRACK_USERS)
+    return empty_db
+
+
+@pytest.mark.parametrize(
+    "metric, expected",
+    [
+        ("cosine", {A: [B, C], B: [A, C], C: [D, A], D: [C]}),
+        ("jaccard", {A: [B, C], B: [A, C], C: [D, A], D: [C]}),
+    ],
+)
+def test_populate_colistened_table(db: sqlite3.Connection, metric, expected):
+    populate_colistened_table(db, k=2, metric=metric, block_size=3)
+
+    assert get_colistened(db, [A, B, C, D]) == expected
+    scores = db.execute(
+        "SELECT score FROM colistened WHERE track_id_a = ? ORDER BY rank;", (C,)
+    ).fetchall()
+    if metric == "cosine":
+        assert np.allclose([r["score"] for r in scores], [0.5**0.5, 0.5])
+    else:
+        assert np.allclose([r["score"] for r in scores], [0.5, 1 / 3])
+
+
+@pytest.mark.parametrize(
+    "block_size, max_pairs", [(1, 1 << 24), (7, 1 << 24), (100, 1 << 24), (100, 1)]
+)
+def test_iter_colistened_matches_dense_computation(block_size: int, max_pairs: int):
+    rng = np.random.default_rng(0)
+    dense = rng.random((40, 25)) < 0.2
+    users, tracks = np.nonzero(dense)
+    matrix = InteractionMatrix(
+        indptr=np.concatenate([[0], np.cumsum(dense.sum(axis=1))]),
+        indices=tracks.astype(np.int32),
+        data=np.ones(len(tracks), dtype=np.int32),
+        user_ids=np.arange(40).astype("S40"),
+        track_ids=np.arange(25).astype("S18"),
+    )
+    listeners = dense.astype(float)
+    shared = listeners.T @ listeners
+    counts = listeners.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = np.nan_to_num(shared / np.sqrt(np.outer(counts, counts)))
+    np.fill_diagonal(expected, 0)
+
+    blocks = list(iter_colistened(matrix, 5, "cosine", block_size, max_pairs))
+    assert np.concatenate([block for block, _, _ in blocks]).tolist() == list(range(25))
+    for block, neighbours, scores in blocks:
+        for row, track in enumerate(block):
+            valid = neighbours[row] >= 0
+            best = np.sort(expected[track][expected[track] > 0])[::-1][:5]
+            assert np.allclose(scores[row][valid], best)
+            assert np.allclose(expected[track][neighbours[row][valid]], best)
+
+
+def test_iter_colistened_cuts_blocks_by_pairs(db: sqlite3.Connection):
+    # pairs per track: A 3 + 2, B 3 + 2, C 3 + 2, D 2
+    matrix = build_interaction_matrix(db)
+
+    blocks = [block.tolist() for block, _, _ in iter_colistened(matrix, max_pairs=10)]
+    assert blocks == [[0, 1], [2, 3]]
+    blocks = [block.tolist() for block, _, _ in iter_colistened(matrix, max_pairs=4)]
+    assert blocks == [[0], [1], [2], [3]]
+    blocks = [
+        block.tolist()
+        for block, _, _ in iter_colistened(matrix, block_size=1, max_pairs=100)
+    ]
+    assert blocks == [[0], [1], [2], [3]]
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from lastfm_dataset.create import id_mapping
+from lastfm_dataset.create.id_mapping import (
+    build_id_mapping,
+    load_id_mapping,
+    save_id_mapping,
+)
+
+SONG_IDS = ["SOAAAGQ12A8C1420C8", "SOB", "SOAAAGQ12A8C1420C8", "SOCCCCC12A8C1420C8"]
+TRACK_IDS = ["TRAAAAA128F93437B1", "TRBBBBB128F93437B2", "TRXXXXX128F93437B9", "TRC"]
+
+
+def test_build_and_lookup():
+    mapping, duplicated = build_id_mapping(SONG_IDS, TRACK_IDS)
+
+    assert len(mapping) == 3
+    assert duplicated.tolist() == [2]  # the first occurrence wins
+    values, found = mapping.lookup(
+        [b"SOCCCCC12A8C1420C8", b"SOUNKNOWN", b"SOAAAGQ12A8C1420C8", b"SOB"]
+    )
+    assert found.tolist() == [True, False, True, True]
+    assert values.tolist() == [
+        b"TRC",
+        b"",
+        b"TRAAAAA128F93437B1",
+        b"TRBBBBB128F93437B2",
+    ]
+    assert mapping.get("SOB") == "TRBBBBB128F93437B2"
+    assert mapping.get("SOX", "missing") == "missing"
+    assert "SOB" in mapping
+    # longer ids are never found, not even by their first 18 bytes
+    assert not mapping.lookup(["SOAAAGQ12A8C1420C8X"])[1][0]
+    assert mapping.lookup([])[0].tolist() == []
+    with pytest.raises(ValueError):
+        build_id_mapping(["SO" * 10], ["TRA"])
+
+
+def test_lookup_with_hash_collisions(monkeypatch):
+    # every id hashes the same, lookups fall back to comparing the keys
+    monkeypatch.setattr(
+        id_mapping, "hash_ids", lambda ids: np.zeros(len(ids), dtype=np.uint64)
+    )
+    mapping, _ = build_id_mapping(SONG_IDS, TRACK_IDS)
+
+    values, found = mapping.lookup(["SOCCCCC12A8C1420C8", "SOB", "SOX"])
+    assert found.tolist() == [True, True, False]
+    assert values[:2].tolist() == [b"TRC", b"TRBBBBB128F93437B2"]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "mapping.npy")
+    mapping, _ = build_id_mapping(SONG_IDS, TRACK_IDS)
+    save_id_mapping(mapping, path)
+
+    loaded = load_id_mapping(path)
+
+    assert isinstance(loaded.entries, np.memmap)
+    assert loaded.get("SOAAAGQ12A8C1420C8") == "TRAAAAA128F93437B1"
+    np.save(str(tmp_path / "other.npy"), np.arange(3))
+    with pytest.raises(ValueError):
+        load_id_mapping(str(tmp_path / "other.npy"))
+
+
+def test_with_values():
+    mapping, _ = build_id_mapping(SONG_IDS, TRACK_IDS)
+
+    subset = mapping.with_values(["TRC", "TRBBBBB128F93437B2", "TRUNKNOWN"])
+
+    assert len(subset) == 2
+    assert subset.lookup(SONG_IDS)[1].tolist() == [False, True, False, True]
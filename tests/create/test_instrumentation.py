@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+from lastfm_dataset.create.instrumentation import (
+    build_report,
+    current_step,
+    report_path,
+    step,
+)
+
+
+def test_steps_nest_and_add_up(tmp_path):
+    path = str(tmp_path / "report.json")
+    with build_report(path, database="dataset.db"):
+        with step("users") as users:
+            for _ in range(3):
+                with step("insert") as insert:
+                    insert.rows_out += 10
+            current_step().rows_in += 50
+        with step("similars"):
+            pass
+
+    with open(path) as fj:
+        report = json.load(fj)
+    assert report["status"] == "completed"
+    assert report["database"] == "dataset.db"
+    assert [s["name"] for s in report["steps"]] == ["users", "similars"]
+    users = report["steps"][0]
+    assert users["calls"] == 1
+    assert users["rows_in"] == 50
+    (insert,) = users["steps"]
+    assert insert["name"] == "insert"
+    assert insert["calls"] == 3
+    assert insert["rows_out"] == 30
+    assert insert["wall"] <= users["wall"]
+    assert users["self_wall"] == pytest.approx(users["wall"] - insert["wall"], abs=1e-5)
+    assert users["cpu"] >= 0
+
+
+def test_failed_build_is_reported(tmp_path):
+    path = str(tmp_path / "report.json")
+    with pytest.raises(RuntimeError):
+        with build_report(path), step("tracks"):
+            raise RuntimeError("boom")
+    with open(path) as fj:
+        report = json.load(fj)
+    assert report["status"] == "failed"
+    assert report["steps"][0]["name"] == "tracks"
+
+
+def test_steps_outside_of_a_report_are_discarded(tmp_path):
+    with step("tracks") as s:
+        s.rows_out += 1
+    with build_report(str(tmp_path / "report.json")) as report:
+        pass
+    assert report.steps == {}
+    assert current_step().name == ""
+
+
+def test_profile_dumps_top_level_steps(tmp_path):
+    path = report_path(str(tmp_path / "dataset.db"))
+    assert path == str(tmp_path / "build_report.json")
+    with build_report(path, profile=True):
+        with step("tracks"), step("insert"):
+            sum(range(1000))
+    assert os.listdir(tmp_path / "build_profiles") == ["tracks.prof"]
@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from lastfm_dataset.create import lastfm_corpus
+from lastfm_dataset.create.lastfm_corpus import (
+    find_lastfm_json_files,
+    scan_lastfm_corpus,
+)
+
+FILES = {
+    "A/B/TRAAA.json": ("Song 1", [["TRBBB", 1.0], ["TRCCC", 0.5]]),
+    "A/C/TRBBB.json": ("Song 2", [["TRAAA", 0.7]]),
+    "B/A/TRCCC.json": ("Song 1", [["TRAAA", 0.2]]),  # duplicated title
+    "B/B/TRDDD.json": ("Unknown", [["TRAAA", 0.1]]),
+    "C/A/TREEE.json": ("Song 3", []),
+}
+
+
+@pytest.fixture()
+def corpus(tmp_path):
+    for rel_path, (title, similars) in FILES.items():
+        path = tmp_path / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        track_id = path.stem
+        path.write_text(
+            json.dumps({"title": title, "track_id": track_id, "similars": similars})
+        )
+    return tmp_path
+
+
+def test_scan_lastfm_corpus(corpus):
+    paths = find_lastfm_json_files(str(corpus))
+    scan = scan_lastfm_corpus(
+        song_names={"Song 1", "Song 2", "Song 3"}, paths=paths, workers=1
+    )
+
+    assert scan.name2track_id == {
+        "Song 1": "TRAAA",
+        "Song 2": "TRBBB",
+        "Song 3": "TREEE",
+    }
+    assert scan.summary == {"not_found": ["Unknown"], "duplicate": ["Song 1"]}
+    assert scan.similars == {
+        "TRAAA": [("TRBBB", 1.0), ("TRCCC", 0.5)],
+        "TRBBB": [("TRAAA", 0.7)],
+        "TRCCC": [("TRAAA", 0.2)],
+        "TREEE": [],
+    }
+
+
+def test_scan_lastfm_corpus_keeps_similars_of_known_track_ids(corpus):
+    scan = scan_lastfm_corpus(
+        track_ids={"TRDDD"}, paths=find_lastfm_json_files(str(corpus)), workers=1
+    )
+
+    assert scan.similars == {"TRDDD": [("TRAAA", 0.1)]}
+
+
+def test_find_lastfm_json_files_skips_build_outputs(corpus):
+    # the build writes these to the data dir, next to the LastFM files
+    for name in ["name2track_id_mapping.json", "build_report.json", "A/summary.json"]:
+        (corpus / name).write_text(json.dumps({"not": "a lastfm file"}))
+
+    paths = find_lastfm_json_files(str(corpus))
+
+    assert paths == sorted(str(corpus / rel_path) for rel_path in FILES)
+    scan = scan_lastfm_corpus(song_names={"Song 3"}, paths=paths, workers=1)
+    assert scan.name2track_id == {"Song 3": "TREEE"}
+
+
+@pytest.mark.parametrize(["workers", "chunk_size"], [(2, 1), (3, 2)])
+def test_scan_lastfm_corpus_is_independent_of_workers(corpus, workers, chunk_size):
+    paths = find_lastfm_json_files(str(corpus))
+    song_names = {"Song 1", "Song 2", "Song 3"}
+
+    serial = scan_lastfm_corpus(song_names=song_names, paths=paths, workers=1)
+    parallel = scan_lastfm_corpus(
+        song_names=song_names, paths=paths, workers=workers, chunk_size=chunk_size
+    )
+
+    assert serial == parallel
+
+
+def test_scan_lastfm_corpus_with_manifest(corpus, tmp_path, monkeypatch):
+    paths = find_lastfm_json_files(str(corpus))
+    song_names = {"Song 1", "Song 2", "Song 3"}
+    manifest_path = str(tmp_path / "manifest.db")
+    expected = scan_lastfm_corpus(song_names=song_names, paths=paths, workers=1)
+
+    cold = scan_lastfm_corpus(
+        song_names=song_names, paths=paths, workers=1, manifest_path=manifest_path
+    )
+    parsed = []
+    original = lastfm_corpus.read_lastfm_file
+    monkeypatch.setattr(
+        lastfm_corpus,
+        "read_lastfm_file",
+        lambda path, *args: parsed.append(path) or original(path, *args),
+    )
+    warm = scan_lastfm_corpus(
+        song_names=song_names, paths=paths, workers=1, manifest_path=manifest_path
+    )
+
+    assert cold == expected
+    assert warm == expected
+    assert parsed == []
+
+    # change one file and remove another one
+    (corpus / "A/C/TRBBB.json").write_text(
+        json.dumps({"title": "Song 2", "track_id": "TRBBB", "similars": []})
+    )
+    (corpus / "B/B/TRDDD.json").unlink()
+    paths = find_lastfm_json_files(str(corpus))
+    updated = scan_lastfm_corpus(
+        song_names=song_names, paths=paths, workers=1, manifest_path=manifest_path
+    )
+
+    assert parsed == [str(corpus / "A/C/TRBBB.json")]
+    assert updated.similars["TRBBB"] == []
+    assert updated.summary["not_found"] == []
+    assert updated == scan_lastfm_corpus(song_names=song_names, paths=paths, workers=1)
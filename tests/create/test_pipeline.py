@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from lastfm_dataset.create import lastfm_corpus, pipeline
+from lastfm_dataset.create.base_data import (
+    create_all_tables,
+    create_database_file,
+    populate_all_tables,
+)
+from lastfm_dataset.create.pipeline import get_checkpoints, run_pipeline
+
+ALL_STAGES = ["mappings", "tracks", "users", "similars", "colistened", "indexes"]
+
+
+def _dump(path: str):
+    con = sqlite3.connect(path)
+    tables = [
+        row[0]
+        for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE"
+            " 'sqlite_%' AND name != 'build_checkpoints' ORDER BY name;"
+        )
+    ]
+    dump = {t: sorted(con.execute(f"SELECT * FROM {t};").fetchall()) for t in tables}
+    schema = sorted(
+        con.execute(
+            "SELECT name, sql FROM sqlite_master"
+            " WHERE name NOT LIKE 'sqlite_%' AND name != 'build_checkpoints';"
+        ).fetchall()
+    )
+    con.close()
+    return schema, dump
+
+
+@pytest.fixture()
+def serial_build(raw_inputs) -> str:
+    path = str(raw_inputs / "serial.db")
+    with create_database_file(path=path, bulk_load=True) as con:
+        create_all_tables(con, defer_keys=True)
+        populate_all_tables(con, workers=1)
+    return path
+
+
+def test_pipeline_equals_serial_build_and_skips_completed_stages(
+    raw_inputs, serial_build
+):
+    path = str(raw_inputs / "dataset.db")
+
+    assert run_pipeline(path, workers=1) == ALL_STAGES
+    assert _dump(path) == _dump(serial_build)
+    assert run_pipeline(path, workers=1) == []
+
+
+def test_pipeline_resumes_after_a_crash(raw_inputs, serial_build, monkeypatch):
+    path = str(raw_inputs / "dataset.db")
+    stages = list(pipeline.STAGES)
+
+    def crash(stage):
+        def run(con, params):
+            stage.run(con, params)
+            raise KeyboardInterrupt()
+
+        return stage._replace(run=run)
+
+    monkeypatch.setattr(
+        pipeline, "STAGES", [crash(s) if s.name == "similars" else s for s in stages]
+    )
+    with pytest.raises(KeyboardInterrupt):
+        run_pipeline(path, workers=1)
+    monkeypatch.setattr(pipeline, "STAGES", stages)
+
+    con = sqlite3.connect(path)
+    con.row_factory = sqlite3.Row
+    assert set(get_checkpoints(con)) == {"mappings", "tracks", "users"}
+    con.close()
+    assert run_pipeline(path, workers=1) == ["similars", "colistened", "indexes"]
+    assert _dump(path) == _dump(serial_build)
+
+
+def test_pipeline_reruns_forced_and_changed_stages(raw_inputs, serial_build):
+    path = str(raw_inputs / "dataset.db")
+    run_pipeline(path, workers=1)
+
+    assert run_pipeline(path, force=["similars"]) == ["similars", "indexes"]
+    assert _dump(path) == _dump(serial_build)
+
+    triplets = raw_inputs / "train_triplets.txt"
+    stat = os.stat(triplets)
+    os.utime(triplets, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert run_pipeline(path) == ["users", "colistened", "indexes"]
+    assert _dump(path) == _dump(serial_build)
+
+    with pytest.raises(ValueError):
+        run_pipeline(path, force=["unknown"])
+
+
+def test_pipeline_rebuilds_with_the_outputs_in_the_data_dir(
+    raw_inputs, serial_build, monkeypatch
+):
+    # the mappings, summaries and the report end up next to the LastFM files
+    monkeypatch.setattr(lastfm_corpus, "DATA_DIR", "")
+    path = str(raw_inputs / "dataset.db")
+    run_pipeline(path, workers=1)
+
+    assert run_pipeline(path, force=["mappings"]) == ALL_STAGES
+    assert _dump(path) == _dump(serial_build)
+
+
+def test_pipeline_rebuilds_after_a_profiled_build(
+    raw_inputs, serial_build, monkeypatch
+):
+    # the report and the profiles are written next to the database
+    monkeypatch.setattr(lastfm_corpus, "DATA_DIR", "")
+    path = str(raw_inputs / "dataset.db")
+    run_pipeline(path, workers=1, profile=True)
+    assert (raw_inputs / "build_report.json").exists()
+
+    assert run_pipeline(path, force=["mappings"], profile=True) == ALL_STAGES
+    assert _dump(path) == _dump(serial_build)
+    with open(raw_inputs / "build_report.json") as fj:
+        assert json.load(fj)["status"] == "completed"
+
+
+def test_pipeline_writes_a_report(raw_inputs):
+    path = str(raw_inputs / "dataset.db")
+    run_pipeline(path, workers=1)
+
+    with open(raw_inputs / "build_report.json") as fj:
+        report = json.load(fj)
+    assert report["status"] == "completed"
+    assert report["skipped"] == []
+    assert [s["name"] for s in report["steps"]] == ALL_STAGES
+    users = next(s for s in report["steps"] if s["name"] == "users")
+    with sqlite3.connect(path) as con:
+        pairs = con.execute("SELECT count(*) FROM track_users;").fetchone()[0]
+    lines = (raw_inputs / "train_triplets.txt").read_text().count("\n")
+    assert users["rows_in"] == lines
+    assert users["rows_out"] == pairs
+    assert {"insert", "commit"} <= {s["name"] for s in users["steps"]}
+
+    run_pipeline(path, workers=1)
+    with open(raw_inputs / "build_report.json") as fj:
+        assert json.load(fj)["skipped"] == ALL_STAGES
@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+
+from lastfm_dataset.create.base_data import (
+    BULK_LOAD_PRAGMAS,
+    create_all_tables,
+    create_database_file,
+    populate_all_tables,
+)
+from lastfm_dataset.create.shards import populate_all_tables_sharded, shard_pragmas
+
+
+def dump_tables(path: str):
+    con = sqlite3.connect(path)
+    tables = [
+        row[0]
+        for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name;"
+        )
+    ]
+    # tables are read in storage order, i.e. by rowid or primary key
+    dump = {
+        table: con.execute(f"SELECT * FROM {table};").fetchall() for table in tables
+    }
+    con.close()
+    return dump
+
+
+@pytest.mark.parametrize("bulk_load", [False, True])
+def test_sharded_build_equals_serial_build(raw_inputs, bulk_load: bool):
+    with create_database_file(
+        path=str(raw_inputs / "serial.db"), bulk_load=bulk_load
+    ) as con:
+        create_all_tables(con, defer_keys=bulk_load)
+        populate_all_tables(con, workers=1)
+    serial_summary = (raw_inputs / "user_track_pair_count.json").read_text()
+
+    with create_database_file(
+        path=str(raw_inputs / "sharded.db"), bulk_load=bulk_load
+    ) as con:
+        create_all_tables(con, defer_keys=bulk_load)
+        populate_all_tables_sharded(con, workers=2, shards=3, batch_size=7)
+
+    serial = dump_tables(str(raw_inputs / "serial.db"))
+    assert dump_tables(str(raw_inputs / "sharded.db")) == serial
+    assert len(serial["track_users"]) > 50
+    assert ("TRAAA", "TRBBB", 1.0) in serial["similar"]
+    assert (raw_inputs / "user_track_pair_count.json").read_text() == serial_summary
+    assert not list(raw_inputs.glob("shards-*"))
+
+
+def test_shards_split_the_page_cache():
+    assert shard_pragmas(1)["cache_size"] == BULK_LOAD_PRAGMAS["cache_size"]
+    assert shard_pragmas(4)["cache_size"] * 4 == BULK_LOAD_PRAGMAS["cache_size"]
+    assert shard_pragmas(4)["temp_store"] == "DEFAULT"
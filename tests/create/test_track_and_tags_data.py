@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from lastfm_dataset.create.lastfm_corpus import LastFmCorpusScan
+from lastfm_dataset.create.track_and_tags_data import populate_tracks_table
+
+NAME2TRACK_ID = {"Song 1": "TRAAA", "Song 2": "TRBBB", "Song 3": "TRCCC"}
+SCAN = LastFmCorpusScan(NAME2TRACK_ID, {"not_found": [], "duplicate": []}, {})
+
+
+def test_populate_tracks_table(empty_db: sqlite3.Connection, processed_db: str):
+    populate_tracks_table(empty_db, scan=SCAN)
+
+    tracks = empty_db.execute("SELECT * FROM tracks;").fetchall()
+    tags = empty_db.execute("SELECT * FROM tags;").fetchall()
+    assert tracks == [
+        {
+            "track_id": "TRAAA",
+            "name": "Song 1",
+            "artist": "Artist 1",
+            "spotify_preview_url": "https://p/1.mp3",
+            "lastfm_url": "https://l/1",
+            "spotify_id": "sp1",
+        },
+        {
+            "track_id": "TRBBB",
+            "name": "Song 2",
+            "artist": "Artist 2",
+            "spotify_preview_url": "https://p/2.mp3",
+            "lastfm_url": "https://l/2",
+            "spotify_id": "sp2",
+        },
+        {
+            "track_id": "TRCCC",
+            "name": "Song 3",
+            "artist": "Artist 5",
+            "spotify_preview_url": "https://p/5.mp3",
+            "lastfm_url": "https://l/5",
+            "spotify_id": "sp5",
+        },
+    ]
+    assert tags == [
+        {"track_id": "TRAAA", "rock": 1, "pop": 0, "jazz": 1},
+        {"track_id": "TRBBB", "rock": 0, "pop": 1, "jazz": 0},
+        {"track_id": "TRCCC", "rock": 0, "pop": 0, "jazz": 1},
+    ]
+
+
+def test_populate_tracks_table_with_limit(
+    empty_db: sqlite3.Connection, processed_db: str
+):
+    populate_tracks_table(empty_db, limit=2, scan=SCAN)
+
+    track_ids = [r["track_id"] for r in empty_db.execute("SELECT * FROM tracks;")]
+    assert track_ids == ["TRAAA", "TRBBB"]
+
+
+def test_populate_tracks_table_fails_without_tags(
+    empty_db: sqlite3.Connection, processed_db: str
+):
+    con = sqlite3.connect(processed_db)
+    con.execute("DELETE FROM tags WHERE id_dataset = 'd2';")
+    con.commit()
+    con.close()
+
+    with pytest.raises(RuntimeError):
+        populate_tracks_table(empty_db, scan=SCAN)
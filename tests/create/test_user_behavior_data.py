@@ -0,0 +1,126 @@
+import json
+import sqlite3
+
+import pytest
+
+from lastfm_dataset.create import user_behavior_data
+from lastfm_dataset.create.id_mapping import build_id_mapping, save_id_mapping
+from lastfm_dataset.create.user_behavior_data import (
+    get_song_id2track_id_mapping,
+    iter_triplet_chunks,
+    iter_triplets,
+    populate_users_table,
+)
+from lastfm_dataset.create.utils import byte_ranges
+
+TRIPLETS = [
+    ("u1", "SOA", 3),
+    ("u1", "SOB", 1),
+    ("u2", "SOA", 7),
+    ("u3", "SOC", 2),  # SOC maps to a track that is not in the tracks table
+    ("u3", "SOX", 2),  # SOX is unknown
+    ("u4", "SOB", 5),
+]
+MAPPING = {"SOA": "TRA", "SOB": "TRB", "SOC": "TRC"}
+
+
+@pytest.fixture()
+def raw_data(tmp_path, monkeypatch):
+    triplets = tmp_path / "train_triplets.txt"
+    triplets.write_text("".join(f"{u}\t{s}\t{c}\n" for u, s, c in TRIPLETS))
+    mapping = tmp_path / "song_id2track_id_mapping.npy"
+    save_id_mapping(
+        build_id_mapping(list(MAPPING), list(MAPPING.values()))[0], str(mapping)
+    )
+    monkeypatch.setattr(user_behavior_data, "PATH_TO_TRAIN_TRIPLETS", str(triplets))
+    monkeypatch.setattr(
+        user_behavior_data, "PATH_TO_SONG_ID2TRACK_ID_MAPPING", str(mapping)
+    )
+    monkeypatch.setattr(
+        user_behavior_data,
+        "PATH_TO_USER_TRACK_PAIR_COUNT",
+        str(tmp_path / "user_track_pair_count.json"),
+    )
+    return tmp_path
+
+
+def test_iter_triplets(raw_data):
+    assert list(iter_triplets(str(raw_data / "train_triplets.txt"))) == TRIPLETS
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+def test_populate_users_table(empty_db: sqlite3.Connection, raw_data, batch_size: int):
+    for track_id in ["TRA", "TRB"]:
+        empty_db.execute(
+            "INSERT INTO tracks VALUES (?, 'n', 'a', 'p', 'l', 's');", (track_id,)
+        )
+
+    populate_users_table(empty_db, batch_size=batch_size)
+
+    users = [r["user_id"] for r in empty_db.execute("SELECT * FROM users;")]
+    pairs = [
+        (r["track_id"], r["user_id"], r["playcount"])
+        for r in empty_db.execute("SELECT * FROM track_users;")
+    ]
+    assert users == ["u1", "u2", "u4"]
+    assert pairs == [
+        ("TRA", "u1", 3),
+        ("TRB", "u1", 1),
+        ("TRA", "u2", 7),
+        ("TRB", "u4", 5),
+    ]
+    with open(raw_data / "user_track_pair_count.json") as fh:
+        assert json.load(fh) == {"u1": 2, "u2": 1, "u4": 1}
+
+
+@pytest.mark.parametrize("n", [1, 2, 5, 40])
+def test_iter_triplets_byte_ranges_cover_every_line_once(raw_data, n: int):
+    path = str(raw_data / "train_triplets.txt")
+
+    triplets = [
+        t
+        for start, end in byte_ranges(path, n)
+        for t in iter_triplets(path, start, end)
+    ]
+
+    assert triplets == TRIPLETS
+
+
+@pytest.mark.parametrize("n", [1, 3, 40])
+@pytest.mark.parametrize("block_size", [1, 10, 1000])
+def test_iter_triplet_chunks(raw_data, n: int, block_size: int):
+    path = str(raw_data / "train_triplets.txt")
+
+    chunks = [
+        chunk
+        for start, end in byte_ranges(path, n)
+        for chunk in iter_triplet_chunks(path, start, end, block_size=block_size)
+    ]
+
+    triplets = [
+        (u.decode(), s.decode(), int(c)) for chunk in chunks for u, s, c in zip(*chunk)
+    ]
+    assert triplets == TRIPLETS
+    if n == 1 and block_size != 10:
+        # a block always ends with a complete line
+        assert len(chunks) == (1 if block_size == 1000 else len(TRIPLETS))
+
+
+def test_get_song_id2track_id_mapping(tmp_path, monkeypatch):
+    path = tmp_path / "unique_tracks.txt"
+    path.write_text(
+        "TRA<SEP>SOA<SEP>Artist A<SEP>Song A\n"
+        "TRB<SEP>SOB<SEP>Artist B<SEP>Song B\n"
+        "TRC<SEP>SOA<SEP>Artist C<SEP>Song C\n"
+    )
+    monkeypatch.setattr(user_behavior_data, "PATH_TO_UNIQUE_TRACKS", str(path))
+
+    mapping, summary = get_song_id2track_id_mapping(chunk_size=2)
+
+    assert len(mapping) == 2
+    assert mapping.get("SOA") == "TRA"
+    assert mapping.get("SOB") == "TRB"
+    assert summary == {
+        "songs": 2,
+        "duplicated_song_ids": [["TRC", "Artist C", "Song C\n"]],
+    }
@@ -0,0 +1,118 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import lastfm_dataset
+from lastfm_dataset import aio, get
+from tests.conftest import TRACK_IDS, USER_IDS
+
+
+@pytest.fixture()
+def db_path(tiny_db: sqlite3.Connection, tmp_path) -> str:
+    path = str(tmp_path / "dataset.db")
+    lastfm_dataset.init(path)
+    aio.init(max_workers=2)
+    yield path
+    aio.close()
+    lastfm_dataset.init(None)
+
+
+@pytest.fixture()
+def calls(monkeypatch, db_path):
+    """Records the arguments of every call that reaches `lastfm_dataset.get`."""
+    recorded = []
+    for name in ["get_tracks_by_ids", "get_similars", "get_tracks"]:
+        func = getattr(get, name)
+
+        def record(*args, _func=func, _name=name, **kwargs):
+            recorded.append((_name, args, kwargs))
+            return _func(*args, **kwargs)
+
+        monkeypatch.setattr(get, name, record)
+    return recorded
+
+
+def test_every_get_function_has_an_async_version():
+    public = {
+        name
+        for name in dir(get)
+        if name.startswith("get_") and name != "get_connection"
+    }
+    assert all(asyncio.iscoroutinefunction(getattr(aio, name)) for name in public)
+
+
+def test_results_equal_the_sync_api(db_path: str):
+    async def main():
+        tracks = await aio.get_tracks_by_ids(TRACK_IDS)
+        users = await aio.get_users_by_ids(USER_IDS)
+        return {
+            "tracks": tracks,
+            "page": await aio.get_tracks(offset=1, limit=1),
+            "tags": await aio.get_tags(tracks),
+            "similars": await aio.get_similars(TRACK_IDS),
+            "by_tags": await aio.get_tracks_by_tags(["rock", "pop"], match="all"),
+            "listeners": await aio.get_track_listeners(tracks),
+            "history": await aio.get_user_listening_history(users),
+        }
+
+    result = asyncio.run(main())
+
+    tracks = get.get_tracks_by_ids(TRACK_IDS)
+    assert sorted(result["tracks"]) == sorted(tracks)
+    assert result["page"] == get.get_tracks(offset=1, limit=1)
+    assert result["tags"] == get.get_tags(tracks)
+    assert result["similars"] == get.get_similars(TRACK_IDS)
+    assert result["by_tags"] == get.get_tracks_by_tags(["rock", "pop"], match="all")
+    assert result["listeners"] == get.get_track_listeners(tracks)
+    assert result["history"] == get.get_user_listening_history(
+        [get.User(u) for u in USER_IDS]
+    )
+
+
+def test_concurrent_lookups_are_batched(calls):
+    async def main():
+        requests = [aio.get_similars([TRACK_IDS[i % 3]]) for i in range(50)]
+        requests.append(aio.get_similars(["TRUNKNOWN"]))
+        return await asyncio.gather(*requests)
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert sorted(calls[0][1][0]) == sorted(TRACK_IDS + ["TRUNKNOWN"])
+    assert results[0] == {TRACK_IDS[0]: [TRACK_IDS[1], TRACK_IDS[2]]}
+    assert results[2] == {TRACK_IDS[2]: []}
+    assert results[-1] == {"TRUNKNOWN": []}
+
+
+def test_identical_requests_are_coalesced(calls):
+    async def main():
+        return await asyncio.gather(
+            *[aio.get_tracks(offset=0, limit=2) for _ in range(10)]
+        )
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert all(r == results[0] for r in results)
+    results[0].clear()  # callers get their own copy
+    assert len(results[1]) == 2
+
+
+def test_full_batches_are_sent_without_waiting(calls):
+    aio.init(max_workers=2, batch_delay=60, max_batch_size=2)
+
+    async def main():
+        return await asyncio.gather(
+            aio.get_tracks_by_ids(TRACK_IDS[:1]), aio.get_tracks_by_ids(TRACK_IDS[1:])
+        )
+
+    first, second = asyncio.run(main())
+
+    assert [t.track_id for t in first] == TRACK_IDS[:1]
+    assert sorted(t.track_id for t in second) == TRACK_IDS[1:]
+
+
+def test_requires_init():
+    with pytest.raises(RuntimeError):
+        asyncio.run(aio.get_tracks())
@@ -0,0 +1,101 @@
+import os
+import sqlite3
+
+import pytest
+
+from lastfm_dataset import cache
+from lastfm_dataset.cache import LRUCache
+from lastfm_dataset.get import (
+    get_similars,
+    get_tags,
+    get_track_listeners,
+    get_tracks_by_ids,
+)
+from tests.conftest import TRACK_IDS, USER_IDS
+
+
+@pytest.fixture()
+def enabled_cache():
+    cache.enable(max_entries=100)
+    yield cache
+    cache.disable()
+
+
+def test_batch_is_served_partly_from_cache(tiny_db: sqlite3.Connection):
+    uncached = get_similars(tiny_db, TRACK_IDS)
+    cache.enable(max_entries=100)
+    try:
+        get_similars(tiny_db, TRACK_IDS[:2])
+        statements = []
+        tiny_db.set_trace_callback(statements.append)
+        result = get_similars(tiny_db, TRACK_IDS)
+        tiny_db.set_trace_callback(None)
+        stats = cache.stats()
+    finally:
+        cache.disable()
+
+    selects = [s for s in statements if s.lstrip().startswith("SELECT")]
+    assert result == uncached
+    assert len(selects) == 1
+    assert TRACK_IDS[0] not in selects[0]
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2 + 1
+
+
+def test_cached_results_match_uncached(tiny_db: sqlite3.Connection, enabled_cache):
+    ids = TRACK_IDS + ["TRUNKNOWN"]
+    expected_tracks = get_tracks_by_ids(tiny_db, ids)
+    tracks = get_tracks_by_ids(tiny_db, ids=ids)  # keyword arguments are cached too
+
+    assert sorted(tracks) == sorted(expected_tracks)
+    for _ in range(2):
+        listeners = get_track_listeners(tiny_db, tracks)
+        assert listeners == {
+            TRACK_IDS[0]: USER_IDS,
+            TRACK_IDS[1]: USER_IDS[:1],
+        }
+        assert listeners["TRUNKNOWN"] == []  # still a defaultdict
+    tags = get_tags(tiny_db, tracks)
+    tags[TRACK_IDS[0]].append("modified")
+    assert get_tags(tiny_db, tracks)[TRACK_IDS[0]] == ["rock", "jazz"]
+
+
+def test_generator_arguments_are_cached(tiny_db: sqlite3.Connection, enabled_cache):
+    tracks = get_tracks_by_ids(tiny_db, (i for i in TRACK_IDS[:1]))
+
+    assert [t.track_id for t in tracks] == TRACK_IDS[:1]
+    assert get_tracks_by_ids(tiny_db, TRACK_IDS[:1]) == tracks
+
+
+def test_cache_is_invalidated_when_the_database_changes(
+    tiny_db: sqlite3.Connection, enabled_cache
+):
+    assert get_similars(tiny_db, TRACK_IDS[2:]) == {TRACK_IDS[2]: []}
+
+    tiny_db.execute(
+        "INSERT INTO similar VALUES (?, ?, ?);", (TRACK_IDS[2], TRACK_IDS[0], 0.3)
+    )
+    path = tiny_db.execute("PRAGMA database_list;").fetchone()["file"]
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    assert get_similars(tiny_db, TRACK_IDS[2:]) == {TRACK_IDS[2]: [TRACK_IDS[0]]}
+
+
+def test_lru_cache_evicts_by_entries_and_bytes():
+    database = ("db", (1,))
+    by_entries = LRUCache(max_entries=2)
+    by_entries.put_many(database, "f", {"a": 1, "b": 2})
+    by_entries.get_many(database, "f", ["a"])
+    by_entries.put_many(database, "f", {"c": 3})
+
+    assert by_entries.get_many(database, "f", ["a", "b", "c"]) == (
+        {"a": 1, "c": 3},
+        ["b"],
+    )
+    assert by_entries.stats()["evictions"] == 1
+
+    by_bytes = LRUCache(max_entries=None, max_bytes=500)
+    by_bytes.put_many(database, "f", {str(i): ["x" * 50] for i in range(10)})
+    assert 0 < by_bytes.stats()["bytes"] <= 500
+    assert by_bytes.stats()["entries"] < 10
@@ -0,0 +1,104 @@
+import json
+import sqlite3
+
+import numpy as np
+import pytest
+
+from lastfm_dataset.export import (
+    export_tables,
+    iter_row_groups,
+    user_bucket,
+)
+from tests.conftest import TRACK_IDS, USER_IDS
+
+
+def _read(directory: str, table: str):
+    groups = list(iter_row_groups(directory, table))
+    return groups, {
+        name: np.concatenate([g[name] for g in groups]).tolist() for name in groups[0]
+    }
+
+
+@pytest.mark.parametrize("row_group_size", [1, 2, 100])
+def test_export_npz(tiny_db: sqlite3.Connection, tmp_path, row_group_size: int):
+    out = str(tmp_path / "export")
+    manifest = export_tables(
+        tiny_db, out, row_group_size=row_group_size, file_format="npz"
+    )
+
+    with open(tmp_path / "export" / "manifest.json") as fj:
+        assert json.load(fj) == manifest
+    rows = {name: t["rows"] for name, t in manifest["tables"].items()}
+    assert rows == {
+        "tracks": 3,
+        "users": 2,
+        "tag_names": 3,
+        "tags": 5,
+        "similar": 3,
+        "track_users": 3,
+    }
+
+    groups, tracks = _read(out, "tracks")
+    assert max(len(g["track_id"]) for g in groups) == min(row_group_size, 3)
+    assert tracks["track_id"] == TRACK_IDS
+    assert tracks["name"] == ["Song 0", "Song 1", "Song 2"]
+    _, tags = _read(out, "tags")
+    assert tags == {"track_idx": [0, 0, 1, 2, 2], "tag_id": [0, 2, 1, 0, 1]}
+    _, similar = _read(out, "similar")
+    assert similar["track_idx_a"] == [0, 0, 1]
+    assert similar["track_idx_b"] == [1, 2, 0]
+    assert similar["score"] == [0.9, 0.4, 0.8]
+    _, track_users = _read(out, "track_users")
+    assert track_users == {
+        "user_idx": [0, 0, 1],
+        "track_idx": [0, 1, 0],
+        "playcount": [3, 1, 7],
+    }
+
+
+def test_export_partitions_track_users_by_user(tiny_db: sqlite3.Connection, tmp_path):
+    out = str(tmp_path / "export")
+    partitions = 4
+    manifest = export_tables(
+        tiny_db,
+        out,
+        tables=["track_users"],
+        file_format="npz",
+        user_partitions=partitions,
+    )
+
+    files = manifest["tables"]["track_users"]["files"]
+    buckets = sorted({user_bucket(u, partitions) for u in USER_IDS})
+    assert files == [f"track_users/user_bucket={b:02d}/part-00000.npz" for b in buckets]
+    for group, file in zip(iter_row_groups(out, "track_users"), files):
+        users = {USER_IDS[i] for i in group["user_idx"]}
+        assert {f"user_bucket={user_bucket(u, partitions):02d}" for u in users} == {
+            file.split("/")[1]
+        }
+    assert sum(len(g["user_idx"]) for g in iter_row_groups(out, "track_users")) == 3
+
+
+def test_export_empty_table(empty_db: sqlite3.Connection, tmp_path):
+    out = str(tmp_path / "export")
+    manifest = export_tables(empty_db, out, tables=["similar"], file_format="npz")
+    assert manifest["tables"]["similar"]["rows"] == 0
+    (group,) = iter_row_groups(out, "similar")
+    assert list(group) == ["track_idx_a", "track_idx_b", "score"]
+    assert group["track_idx_a"].dtype == np.int32
+
+
+def test_export_rejects_unknown_tables(tiny_db: sqlite3.Connection, tmp_path):
+    with pytest.raises(ValueError):
+        export_tables(tiny_db, str(tmp_path), tables=["colistened"])
+
+
+def test_export_parquet(tiny_db: sqlite3.Connection, tmp_path):
+    pytest.importorskip("pyarrow")
+    out = str(tmp_path / "export")
+    export_tables(tiny_db, out, row_group_size=2, file_format="parquet")
+
+    groups, tracks = _read(out, "tracks")
+    assert len(groups) == 2
+    assert tracks["track_id"] == TRACK_IDS
+    _, track_users = _read(out, "track_users")
+    assert track_users["playcount"] == [3, 1, 7]
@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+from lastfm_dataset.get import (
+    TrackUser,
+    get_tracks,
+    get_users,
+    iter_track_users,
+    iter_tracks,
+    iter_users,
+)
+
+
+@pytest.mark.parametrize("fetch_size", [1, 2, 3, 1000])
+def test_iterators_stream_whole_tables(tiny_db: sqlite3.Connection, fetch_size: int):
+    tracks = list(iter_tracks(tiny_db, fetch_size=fetch_size))
+    users = list(iter_users(tiny_db, fetch_size=fetch_size))
+    track_users = list(iter_track_users(tiny_db, fetch_size=fetch_size))
+
+    assert tracks == get_tracks(tiny_db, offset=0, limit=100)
+    assert users == get_users(tiny_db, offset=0, limit=100)
+    assert len(tracks) == 3
+    assert len(users) == 2
+    assert track_users == sorted(track_users)
+    assert len(track_users) == 3
+    assert all(isinstance(t, TrackUser) for t in track_users)
+
+
+def test_offset_pagination_matches_iterator(tiny_db: sqlite3.Connection):
+    pages = get_tracks(tiny_db, offset=0, limit=2) + get_tracks(
+        tiny_db, offset=2, limit=2
+    )
+
+    assert pages == list(iter_tracks(tiny_db, fetch_size=2))
+
+
+@pytest.mark.parametrize("iterator", [iter_tracks, iter_users, iter_track_users])
+@pytest.mark.parametrize("fetch_size", [0, -1])
+def test_iterators_reject_empty_pages(
+    tiny_db: sqlite3.Connection, iterator, fetch_size: int
+):
+    with pytest.raises(ValueError, match="fetch_size"):
+        list(iterator(tiny_db, fetch_size=fetch_size))
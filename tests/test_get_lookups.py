@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from lastfm_dataset import get
+from lastfm_dataset.get import (
+    get_similars,
+    get_track_listeners,
+    get_tracks_by_ids,
+    get_user_listening_history,
+    get_users_by_ids,
+)
+from tests.conftest import TRACK_IDS, USER_IDS
+
+
+@pytest.fixture(params=[1, 2, 500])
+def chunk_size(request, monkeypatch) -> int:
+    monkeypatch.setattr(get, "CHUNK_SIZE", request.param)
+    return request.param
+
+
+def test_lookups_are_chunked(tiny_db: sqlite3.Connection, chunk_size: int):
+    tracks = get_tracks_by_ids(tiny_db, TRACK_IDS + TRACK_IDS[:1])
+    users = get_users_by_ids(tiny_db, USER_IDS)
+
+    assert sorted(t.track_id for t in tracks) == TRACK_IDS
+    assert sorted(u.user_id for u in users) == USER_IDS
+    assert get_similars(tiny_db, tracks) == {
+        TRACK_IDS[0]: [TRACK_IDS[1], TRACK_IDS[2]],
+        TRACK_IDS[1]: [TRACK_IDS[0]],
+        TRACK_IDS[2]: [],
+    }
+    assert get_track_listeners(tiny_db, tracks) == {
+        TRACK_IDS[0]: USER_IDS,
+        TRACK_IDS[1]: USER_IDS[:1],
+    }
+    assert get_user_listening_history(tiny_db, users) == {
+        USER_IDS[0]: TRACK_IDS[:2],
+        USER_IDS[1]: TRACK_IDS[:1],
+    }
+
+
+def test_lookups_bind_parameters(tiny_db: sqlite3.Connection):
+    assert get_tracks_by_ids(tiny_db, ["TR'); DROP TABLE tracks; --"]) == []
+    assert len(get_tracks_by_ids(tiny_db, TRACK_IDS)) == 3
+
+
+def test_lookups_with_empty_input(tiny_db: sqlite3.Connection):
+    assert get_tracks_by_ids(tiny_db, []) == []
+    assert get_similars(tiny_db, []) == {}
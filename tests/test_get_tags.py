@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+from lastfm_dataset.get import (
+    get_tags,
+    get_tracks_by_ids,
+    get_tracks_by_tag,
+    get_tracks_by_tags,
+)
+from tests.conftest import TRACK_IDS
+
+
+def _ids(tracks):
+    return [t.track_id for t in tracks]
+
+
+def test_get_tags(tiny_db: sqlite3.Connection):
+    tracks = get_tracks_by_ids(tiny_db, TRACK_IDS)
+    tiny_db.execute("DELETE FROM track_tags WHERE track_id = ?;", (TRACK_IDS[1],))
+
+    assert get_tags(tiny_db, tracks) == {
+        TRACK_IDS[0]: ["rock", "jazz"],
+        TRACK_IDS[1]: [],
+        TRACK_IDS[2]: ["rock", "pop"],
+    }
+
+
+def test_get_tracks_by_tag(tiny_db: sqlite3.Connection):
+    assert _ids(get_tracks_by_tag(tiny_db, "rock")) == [TRACK_IDS[0], TRACK_IDS[2]]
+    assert _ids(get_tracks_by_tag(tiny_db, "unknown")) == []
+
+
+@pytest.mark.parametrize(
+    ["tags", "match", "expected"],
+    [
+        (["rock", "pop"], "any", TRACK_IDS),
+        (["rock", "pop"], "all", TRACK_IDS[2:]),
+        (["rock", "rock"], "all", [TRACK_IDS[0], TRACK_IDS[2]]),
+        (["jazz", "unknown"], "all", []),
+        ([], "any", []),
+    ],
+)
+def test_get_tracks_by_tags(tiny_db: sqlite3.Connection, tags, match, expected):
+    assert _ids(get_tracks_by_tags(tiny_db, tags, match=match)) == expected
+
+
+def test_get_tracks_by_tags_rejects_unknown_match(tiny_db: sqlite3.Connection):
+    with pytest.raises(ValueError):
+        get_tracks_by_tags(tiny_db, ["rock"], match="some")
+
+
+def test_tags_view_keeps_wide_layout(tiny_db: sqlite3.Connection):
+    rows = tiny_db.execute("SELECT * FROM tags ORDER BY track_id;").fetchall()
+
+    assert rows == [
+        {"track_id": TRACK_IDS[0], "rock": 1, "pop": 0, "jazz": 1},
+        {"track_id": TRACK_IDS[1], "rock": 0, "pop": 1, "jazz": 0},
+        {"track_id": TRACK_IDS[2], "rock": 1, "pop": 1, "jazz": 0},
+    ]
@@ -0,0 +1,75 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from lastfm_dataset.graph import load_similarity_graph
+from tests.conftest import TRACK_IDS
+
+A, B, C = TRACK_IDS
+D = "TRDDDDD128F93437B4"  # similar to C, but not in the tracks table
+
+
+@pytest.fixture()
+def graph(tiny_db: sqlite3.Connection):
+    tiny_db.execute("INSERT INTO similar VALUES (?, ?, ?);", (C, D, 0.2))
+    return load_similarity_graph(tiny_db, fetch_size=2)
+
+
+def test_load_similarity_graph(graph):
+    assert graph.ids(np.arange(graph.num_nodes)).tolist() == [A, B, C, D]
+    assert graph.num_edges == 4
+    assert graph.index([C, A]).tolist() == [2, 0]
+    with pytest.raises(KeyError):
+        graph.index(["TRUNKNOWN"])
+    with pytest.raises(KeyError):
+        graph.index([A + "X"])
+
+
+def test_top_k(graph):
+    neighbours, scores = graph.top_k(graph.index([A, B, D]), k=2)
+
+    assert neighbours.tolist() == [[1, 2], [0, -1], [-1, -1]]
+    assert np.allclose(scores[0], [0.9, 0.4])
+    assert np.isnan(scores[2]).all()
+
+
+@pytest.mark.parametrize(
+    ["hops", "min_score", "expected"],
+    [
+        (0, 0.0, {"TRBBBBB128F93437B2": 0}),
+        (1, 0.0, {B: 0, A: 1}),
+        (3, 0.0, {B: 0, A: 1, C: 2, D: 3}),
+        (3, 0.3, {B: 0, A: 1, C: 2}),
+        (3, 0.85, {B: 0}),
+    ],
+)
+def test_expand(graph, hops, min_score, expected):
+    nodes, distance = graph.expand(graph.index([B]), hops=hops, min_score=min_score)
+
+    assert dict(zip(graph.ids(nodes).tolist(), distance.tolist())) == expected
+
+
+def test_personalized_pagerank(graph):
+    rank = graph.personalized_pagerank(graph.index([B]), alpha=0.15)
+
+    assert rank.sum() == pytest.approx(1.0)
+    assert rank[graph.index([B])[0]] > rank[graph.index([C])[0]]
+    assert (rank > 0).all()
+
+
+def test_personalized_pagerank_with_zero_scores(tiny_db: sqlite3.Connection):
+    # the only edge of D scores 0, so D is dangling
+    tiny_db.execute("INSERT INTO similar VALUES (?, ?, ?);", (C, D, 0.2))
+    tiny_db.execute("INSERT INTO similar VALUES (?, ?, ?);", (D, A, 0.0))
+    graph = load_similarity_graph(tiny_db)
+
+    rank = graph.personalized_pagerank(graph.index([C]), alpha=0.15)
+
+    assert np.isfinite(rank).all()
+    assert rank.sum() == pytest.approx(1.0)
+
+
+def test_personalized_pagerank_without_seeds(graph):
+    with pytest.raises(ValueError):
+        graph.personalized_pagerank(np.array([], dtype=np.int64))
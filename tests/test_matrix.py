@@ -0,0 +1,51 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from lastfm_dataset.matrix import (
+    build_interaction_matrix,
+    index_ids,
+    load_interaction_matrix,
+    save_interaction_matrix,
+)
+from tests.conftest import TRACK_IDS, USER_IDS
+
+
+@pytest.mark.parametrize("fetch_size", [1, 2, 100])
+def test_build_interaction_matrix(tiny_db: sqlite3.Connection, fetch_size: int):
+    matrix = build_interaction_matrix(tiny_db, fetch_size=fetch_size)
+
+    assert matrix.shape == (2, 3)
+    assert matrix.indptr.tolist() == [0, 2, 3]
+    assert matrix.indices.tolist() == [0, 1, 0]
+    assert matrix.data.tolist() == [3, 1, 7]
+    assert matrix.user_index(USER_IDS[::-1]).tolist() == [1, 0]
+    assert matrix.track_index(TRACK_IDS).tolist() == [0, 1, 2]
+    with pytest.raises(KeyError):
+        matrix.track_index(["TRUNKNOWN"])
+
+
+def test_index_ids():
+    sorted_ids = np.array(TRACK_IDS, dtype="S18")
+
+    assert index_ids(sorted_ids, [TRACK_IDS[2], TRACK_IDS[0]]).tolist() == [2, 0]
+    assert index_ids(sorted_ids, []).tolist() == []
+    # truncated to 18 bytes this would be TRACK_IDS[0]
+    with pytest.raises(KeyError):
+        index_ids(sorted_ids, [TRACK_IDS[0] + "X"])
+    assert index_ids(np.array([], dtype="S18"), []).tolist() == []
+    with pytest.raises(KeyError):
+        index_ids(np.array([], dtype="S18"), TRACK_IDS[:1])
+
+
+def test_save_and_load_interaction_matrix(tiny_db: sqlite3.Connection, tmp_path):
+    matrix = build_interaction_matrix(tiny_db)
+    save_interaction_matrix(matrix, str(tmp_path / "matrix"))
+
+    loaded = load_interaction_matrix(str(tmp_path / "matrix"))
+
+    assert isinstance(loaded.indices, np.memmap)
+    for name in matrix._fields:
+        assert np.array_equal(getattr(loaded, name), getattr(matrix, name))
+    assert loaded.user_index(USER_IDS).tolist() == [0, 1]
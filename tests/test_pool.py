@@ -0,0 +1,88 @@
+import multiprocessing
+import shutil
+import sqlite3
+import threading
+
+import pytest
+
+import lastfm_dataset
+from lastfm_dataset.get import get_tracks, get_tracks_by_ids
+from tests.conftest import TRACK_IDS
+
+
+@pytest.fixture()
+def db_path(tiny_db: sqlite3.Connection, tmp_path) -> str:
+    path = str(tmp_path / "dataset.db")
+    lastfm_dataset.init(path)
+    yield path
+    lastfm_dataset.init(None)
+
+
+def test_connection_is_reused_per_thread(db_path: str):
+    pool = lastfm_dataset._POOL
+    main_con = pool.connection()
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.connection()))
+    thread.start()
+    thread.join()
+
+    assert pool.connection() is main_con
+    assert other[0] is not main_con
+    assert len(get_tracks(limit=2)) == 2
+
+
+def test_connection_of_an_exited_thread_is_closed(db_path: str):
+    pool = lastfm_dataset._POOL
+    main_con = pool.connection()
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.connection()))
+    thread.start()
+    thread.join()
+
+    assert pool._connections == [main_con]
+    with pytest.raises(sqlite3.ProgrammingError):
+        other[0].execute("SELECT 1;")
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        main_con.execute("SELECT 1;")
+
+
+def test_pool_settings_survive_assigning_the_path(db_path: str, tmp_path):
+    lastfm_dataset.init(db_path, mmap_size=0, cache_size=100)
+    lastfm_dataset.DB_PATH = shutil.copy(db_path, tmp_path / "copy.db")
+
+    assert len(get_tracks(limit=2)) == 2
+    pool = lastfm_dataset._POOL
+    assert pool.path == lastfm_dataset.DB_PATH
+    assert pool.connection().execute("PRAGMA mmap_size;").fetchone() == {"mmap_size": 0}
+    assert pool.connection().execute("PRAGMA cache_size;").fetchone() == {
+        "cache_size": -100
+    }
+
+
+def test_connection_is_read_only(db_path: str):
+    with pytest.raises(sqlite3.OperationalError):
+        lastfm_dataset._POOL.connection().execute("DELETE FROM tracks;")
+
+
+def test_explicit_connection_argument_is_replaced(db_path: str):
+    with sqlite3.connect(":memory:") as con:
+        tracks = get_tracks(con, offset=0, limit=1)
+
+    assert len(tracks) == 1
+
+
+def _count_tracks_in_child(queue):
+    queue.put(len(get_tracks(limit=100)))
+
+
+def test_pool_survives_fork(db_path: str):
+    lastfm_dataset._POOL.connection()
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_count_tracks_in_child, args=(queue,))
+    process.start()
+    process.join()
+
+    assert queue.get(timeout=5) == 3
+    assert len(get_tracks_by_ids(TRACK_IDS[:1])) == 1
@@ -0,0 +1,156 @@
+import hashlib
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from lastfm_dataset import previews
+from lastfm_dataset.previews import (
+    download_previews,
+    iter_preview_urls,
+    open_journal,
+    preview_path,
+)
+from tests.conftest import TRACK_IDS
+
+CONTENT = {"/a.mp3": b"a" * 1000, "/b.mp3": b"b" * 10, "/a-copy.mp3": b"a" * 1000}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            server.clients.add(self.client_address)
+            attempt = server.requests.count(self.path)
+        if self.path == "/flaky.mp3" and attempt < 3:
+            status, body = 503, b""
+        elif self.path in CONTENT or self.path == "/flaky.mp3":
+            status, body = 200, CONTENT.get(self.path, b"flaky")
+        else:
+            status, body = 404, b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.clients = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _urls(server, paths):
+    host, port = server.server_address
+    return [(f"TR{i}", f"http://{host}:{port}{path}") for i, path in enumerate(paths)]
+
+
+def test_download_previews(server, tmp_path):
+    urls = _urls(server, ["/a.mp3", "/b.mp3", "/a-copy.mp3", "/flaky.mp3", "/gone.mp3"])
+
+    counts = download_previews(urls, str(tmp_path), workers=1, backoff=0)
+
+    assert counts == {"downloaded": 4, "skipped": 0, "failed": 1}
+    sha = hashlib.sha256(CONTENT["/a.mp3"]).hexdigest()
+    with open(preview_path(str(tmp_path), sha), "rb") as f:
+        assert f.read() == CONTENT["/a.mp3"]
+    # one kept-alive connection for all requests of the single worker
+    assert len(server.clients) == 1
+    with open_journal(str(tmp_path / "journal.db")) as journal:
+        rows = dict(journal.execute("SELECT track_id, sha256 FROM downloads;"))
+    assert rows["TR0"] == rows["TR2"] == sha
+    assert rows["TR4"] is None
+
+
+def test_download_previews_resumes(server, tmp_path):
+    urls = _urls(server, ["/a.mp3", "/b.mp3", "/gone.mp3"])
+    download_previews(urls[:1], str(tmp_path), workers=2)
+    server.requests.clear()
+
+    counts = download_previews(urls, str(tmp_path), workers=2)
+    assert counts == {"downloaded": 1, "skipped": 1, "failed": 1}
+    assert sorted(server.requests) == ["/b.mp3", "/gone.mp3"]
+
+    # permanent failures are skipped as well unless asked to retry them
+    server.requests.clear()
+    counts = download_previews(urls, str(tmp_path), retry_failed=True)
+    assert counts == {"downloaded": 0, "skipped": 2, "failed": 1}
+    assert server.requests == ["/gone.mp3"]
+
+
+def test_download_previews_journals_bad_urls(server, tmp_path):
+    host, port = server.server_address
+    bad = [
+        "http://127.0.0.1:notaport/a.mp3",
+        "ftp://127.0.0.1/a.mp3",
+        "not a url",
+        f"http://{host}:{port}/a b.mp3",
+    ]
+    urls = [(f"BAD{i}", url) for i, url in enumerate(bad)] + _urls(server, ["/b.mp3"])
+
+    counts = download_previews(urls, str(tmp_path), workers=2, backoff=0)
+
+    assert counts == {"downloaded": 1, "skipped": 0, "failed": 4}
+    with open_journal(str(tmp_path / "journal.db")) as journal:
+        errors = dict(journal.execute("SELECT track_id, error FROM downloads;"))
+    assert errors.pop("TR0") is None
+    assert sorted(errors) == ["BAD0", "BAD1", "BAD2", "BAD3"]
+    assert all(errors.values())
+
+
+def test_download_previews_does_not_journal_storage_errors(
+    server, tmp_path, monkeypatch
+):
+    def store(directory, content):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(previews, "store", store)
+    urls = _urls(server, ["/a.mp3", "/b.mp3"])
+
+    counts = download_previews(urls, str(tmp_path), workers=1)
+
+    assert counts == {"downloaded": 0, "skipped": 0, "failed": 2}
+    with open_journal(str(tmp_path / "journal.db")) as journal:
+        assert journal.execute("SELECT count(*) FROM downloads;").fetchone() == (0,)
+
+
+def test_iter_preview_urls(tiny_db: sqlite3.Connection):
+    tiny_db.execute("UPDATE tracks SET spotify_preview_url = '' WHERE name = 'Song 1';")
+
+    assert list(iter_preview_urls(tiny_db)) == [
+        (TRACK_IDS[0], "https://p/0"),
+        (TRACK_IDS[2], "https://p/2"),
+    ]
+
+
+def test_http_client_forgets_closed_connections(server):
+    [(_, url)] = _urls(server, ["/b.mp3"])
+    client = previews.HttpClient()
+
+    assert client.get(url) == CONTENT["/b.mp3"]
+    assert len(client._connections) == 1
+
+    client._drop("http", "%s:%d" % server.server_address)
+    assert client._connections == []
+
+    client.get(url)
+    client.close()
+    assert client._connections == []
+    # a closed client opens fresh connections again
+    assert client.get(url) == CONTENT["/b.mp3"]
+    assert len(client._connections) == 1
+    client.close()
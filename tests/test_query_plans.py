@@ -0,0 +1,67 @@
+"""Makes sure the indexes created by `create_all_indexes` serve every query of the read API."""
+import sqlite3
+from typing import Callable, List
+
+import pytest
+
+from lastfm_dataset import get
+from tests.conftest import TRACK_IDS, USER_IDS
+
+# Offset pagination has to walk the table up to the offset by design.
+ALLOWED_SCANS = {"get_tracks": "tracks", "get_users": "users"}
+
+
+CALLS = {
+    "get_tracks_by_ids": lambda con: get.get_tracks_by_ids(con, TRACK_IDS),
+    "get_tracks": lambda con: get.get_tracks(con, offset=1, limit=1),
+    "get_tags": lambda con: get.get_tags(con, get.get_tracks_by_ids(con, TRACK_IDS)),
+    "get_similars": lambda con: get.get_similars(con, TRACK_IDS),
+    "get_colistened": lambda con: get.get_colistened(con, TRACK_IDS),
+    "get_tracks_by_tag": lambda con: get.get_tracks_by_tag(con, "rock"),
+    "get_tracks_by_tags": lambda con: get.get_tracks_by_tags(
+        con, ["rock", "pop"], match="all"
+    ),
+    "get_users": lambda con: get.get_users(con, offset=1, limit=1),
+    "iter_tracks": lambda con: list(get.iter_tracks(con, fetch_size=2)),
+    "iter_users": lambda con: list(get.iter_users(con, fetch_size=1)),
+    "iter_track_users": lambda con: list(get.iter_track_users(con, fetch_size=2)),
+    "get_users_by_ids": lambda con: get.get_users_by_ids(con, USER_IDS),
+    "get_track_listeners": lambda con: get.get_track_listeners(
+        con, get.get_tracks_by_ids(con, TRACK_IDS)
+    ),
+    "get_user_listening_history": lambda con: get.get_user_listening_history(
+        con, [get.User(u) for u in USER_IDS]
+    ),
+}
+
+
+def _traced_statements(con: sqlite3.Connection, call: Callable) -> List[str]:
+    statements = []
+    con.set_trace_callback(statements.append)
+    try:
+        call(con)
+    finally:
+        con.set_trace_callback(None)
+    return [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+
+
+def test_all_public_queries_are_covered():
+    public = {
+        name
+        for name in dir(get)
+        if name.startswith(("get_", "iter_")) and name != "get_connection"
+    }
+    assert public <= set(CALLS)
+
+
+@pytest.mark.parametrize("name", sorted(CALLS))
+def test_query_plan_has_no_full_scan(tiny_db: sqlite3.Connection, name: str):
+    statements = _traced_statements(tiny_db, CALLS[name])
+    assert len(statements) > 0
+
+    for statement in statements:
+        plan = tiny_db.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+        scans = [row["detail"] for row in plan if row["detail"].startswith("SCAN")]
+        if name in ALLOWED_SCANS:
+            scans = [s for s in scans if s.split()[1] != ALLOWED_SCANS[name]]
+        assert scans == [], f"{name} scans a full table: {statement}"
@@ -0,0 +1,128 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from lastfm_dataset.matrix import build_interaction_matrix
+from lastfm_dataset.sampler import BatchSampler, alias_table, prefetch
+
+# (user_idx, track_idx, playcount) of the tiny database
+INTERACTIONS = {(0, 0, 3), (0, 1, 1), (1, 0, 7)}
+
+
+@pytest.fixture()
+def matrix(tiny_db: sqlite3.Connection):
+    return build_interaction_matrix(tiny_db)
+
+
+def _samples(batches):
+    return [
+        (u, p, c)
+        for b in batches
+        for u, p, c in zip(
+            b.user_idx.tolist(), b.pos_track_idx.tolist(), b.playcount.tolist()
+        )
+    ]
+
+
+def test_batches_cover_every_interaction_once(matrix):
+    sampler = BatchSampler(matrix, batch_size=2, num_negatives=3)
+    batches = list(sampler.iter_batches(epoch=0))
+
+    assert len(sampler) == len(batches) == 2
+    assert [len(b.user_idx) for b in batches] == [2, 1]
+    assert batches[0].neg_track_idxs.shape == (2, 3)
+    assert batches[0].user_idx.dtype == np.int32
+    samples = _samples(batches)
+    assert sorted(samples) == sorted(INTERACTIONS)
+
+    sampler = BatchSampler(matrix, batch_size=2, drop_last=True)
+    assert len(sampler) == len(list(sampler.iter_batches())) == 1
+
+
+def test_batches_are_deterministic(matrix):
+    def run(seed, epoch, prefetch_size):
+        sampler = BatchSampler(matrix, batch_size=1, seed=seed)
+        batches = sampler.iter_batches(epoch, prefetch_size=prefetch_size)
+        return [(s, b.neg_track_idxs.tolist()) for b in batches for s in _samples([b])]
+
+    assert run(1, 0, 0) == run(1, 0, 2)
+    orders = {
+        tuple(s for s, _ in run(seed, epoch, 0))
+        for seed in range(5)
+        for epoch in range(5)
+    }
+    assert len(orders) > 1
+
+
+def test_shards_split_every_epoch(matrix):
+    shards = [
+        BatchSampler(matrix, batch_size=1, seed=3, shard=shard, num_shards=2)
+        for shard in range(2)
+    ]
+    samples = [_samples(s.iter_batches(epoch=1)) for s in shards]
+
+    assert [len(s) for s in shards] == [2, 1]
+    assert sorted(samples[0] + samples[1]) == sorted(INTERACTIONS)
+    with pytest.raises(ValueError):
+        BatchSampler(matrix, shard=2, num_shards=2)
+
+
+def test_negatives_follow_popularity(matrix):
+    # track 2 has no listeners and is never drawn, track 0 twice as often as track 1
+    sampler = BatchSampler(matrix, batch_size=3, num_negatives=1000, popularity_alpha=1)
+    (batch,) = sampler.iter_batches(prefetch_size=0)
+    counts = np.bincount(batch.neg_track_idxs.ravel(), minlength=3)
+    assert counts[2] == 0
+    assert counts[0] / counts.sum() == pytest.approx(2 / 3, abs=0.05)
+
+    sampler = BatchSampler(matrix, batch_size=3, num_negatives=1000, popularity_alpha=0)
+    (batch,) = sampler.iter_batches(prefetch_size=0)
+    assert set(batch.neg_track_idxs.ravel().tolist()) == {0, 1, 2}
+
+
+def test_exclude_positives(matrix):
+    positives = {(u, t) for u, t, _ in INTERACTIONS}
+
+    def positive_rate(exclude_positives: bool) -> float:
+        sampler = BatchSampler(
+            matrix,
+            batch_size=3,
+            num_negatives=50,
+            popularity_alpha=0,
+            exclude_positives=exclude_positives,
+        )
+        (batch,) = sampler.iter_batches()
+        users = np.repeat(batch.user_idx, 50).tolist()
+        negatives = batch.neg_track_idxs.ravel().tolist()
+        return np.mean([(u, t) in positives for u, t in zip(users, negatives)])
+
+    # re-drawn at most MAX_REJECTION_ROUNDS times, user 0 has 2 of the 3 tracks
+    assert positive_rate(False) > 0.3
+    assert positive_rate(True) < 0.05
+
+
+def test_alias_table():
+    probability, alias = alias_table(np.array([1.0, 0.0, 3.0, 6.0]))
+    expected = np.zeros(4)
+    for i in range(4):
+        expected[i] += probability[i] / 4
+        expected[alias[i]] += (1 - probability[i]) / 4
+    assert expected == pytest.approx([0.1, 0.0, 0.3, 0.6])
+    with pytest.raises(ValueError):
+        alias_table(np.zeros(3))
+
+
+def test_prefetch_raises_errors_of_the_producer():
+    def produce():
+        yield 1
+        raise RuntimeError("boom")
+
+    items = prefetch(produce(), size=1)
+    assert next(items) == 1
+    with pytest.raises(RuntimeError):
+        next(items)
+
+    items = prefetch(iter(range(100)), size=1)
+    assert next(items) == 0
+    items.close()  # stops the producer blocked on the full queue
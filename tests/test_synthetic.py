@@ -0,0 +1,86 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from lastfm_dataset.create import base_data, lastfm_corpus, user_behavior_data
+from lastfm_dataset.synthetic import (
+    redirect_inputs,
+    sample_dataset,
+    write_database,
+    write_raw_inputs,
+)
+
+SCALE = 0.001
+
+
+def dump(path) -> dict:
+    """Schema and sorted rows of every table."""
+    con = sqlite3.connect(path)
+    try:
+        schema = sorted(
+            con.execute(
+                "SELECT type, name, tbl_name, sql FROM sqlite_master"
+                " WHERE name NOT LIKE 'sqlite_%';"
+            )
+        )
+        tables = [row[1] for row in schema if row[0] == "table"]
+        return {
+            "schema": schema,
+            **{t: sorted(con.execute(f"SELECT * FROM {t};")) for t in tables},
+        }
+    finally:
+        con.close()
+
+
+def test_sample_dataset():
+    dataset = sample_dataset(SCALE, seed=1)
+    assert len(dataset.track_ids) == 48
+    assert len(dataset.user_ids) == 954
+    assert len(set(dataset.track_ids)) == 48
+    assert all(len(_id) == 18 and _id.startswith("TR") for _id in dataset.track_ids)
+
+    tracks, users, playcounts = dataset.track_users
+    assert np.all(np.diff(users) >= 0)  # grouped by user
+    assert len(np.unique(users)) == len(dataset.user_ids)
+    assert len(set(zip(tracks, users))) == len(tracks)
+    assert playcounts.min() >= 1
+    a, b, _ = dataset.similars
+    assert np.all(a != b)
+    assert len(set(zip(a, b))) == len(a)
+
+    same = sample_dataset(SCALE, seed=1)
+    assert same.track_ids == dataset.track_ids
+    assert np.array_equal(same.track_users[0], tracks)
+    assert sample_dataset(SCALE, seed=2).track_ids != dataset.track_ids
+
+
+def test_sample_dataset_rejects_non_positive_scale():
+    with pytest.raises(ValueError):
+        sample_dataset(0)
+
+
+def test_build_from_raw_inputs_matches_written_database(tmp_path):
+    dataset = sample_dataset(SCALE)
+    write_database(str(tmp_path / "written.db"), dataset)
+    write_raw_inputs(str(tmp_path / "raw"), dataset)
+
+    with redirect_inputs(str(tmp_path / "raw")):
+        with base_data.create_database_file(bulk_load=True) as con:
+            base_data.create_all_tables(con, defer_keys=True)
+            base_data.populate_all_tables(con, workers=1)
+
+    written = dump(tmp_path / "written.db")
+    built = dump(tmp_path / "raw" / "dataset.db")
+    assert written == built
+    assert len(written["track_users"]) == len(dataset.track_users[0])
+
+
+def test_redirect_inputs_restores_paths(tmp_path):
+    original = user_behavior_data.PATH_TO_TRAIN_TRIPLETS
+    with redirect_inputs(str(tmp_path)):
+        assert user_behavior_data.PATH_TO_TRAIN_TRIPLETS == str(
+            tmp_path / "train_triplets.txt"
+        )
+        assert lastfm_corpus.ROOT_DIR == str(tmp_path)
+    assert user_behavior_data.PATH_TO_TRAIN_TRIPLETS == original
@@ -0,0 +1,70 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from lastfm_dataset.tag_search import TagMatrix, load_tag_matrix
+from tests.conftest import TRACK_IDS
+
+A, B, C = TRACK_IDS
+
+
+def test_load_tag_matrix(tiny_db: sqlite3.Connection):
+    matrix = load_tag_matrix(tiny_db)
+
+    assert matrix.tag_names == ["rock", "pop", "jazz"]
+    assert matrix.bits.shape == (3, 1)
+    assert matrix.tag_counts.tolist() == [2, 1, 2]
+    assert np.unpackbits(matrix.bits, axis=1, count=3).tolist() == [
+        [1, 0, 1],
+        [0, 1, 0],
+        [1, 1, 0],
+    ]
+
+
+def test_nearest_by_tags_jaccard(tiny_db: sqlite3.Connection):
+    matrix = load_tag_matrix(tiny_db)
+
+    ids, scores = matrix.nearest_by_tags([A, B, C], k=2)
+
+    assert ids.tolist() == [[C, B], [C, A], [B, A]]
+    assert np.allclose(scores, [[1 / 3, 0], [1 / 2, 0], [1 / 2, 1 / 3]])
+
+
+def test_nearest_by_tags_cosine(tiny_db: sqlite3.Connection):
+    matrix = load_tag_matrix(tiny_db)
+
+    ids, scores = matrix.nearest_by_tags([B], k=5, metric="cosine")
+
+    assert ids.tolist() == [[C, A]]
+    assert np.allclose(scores, [[1 / np.sqrt(2), 0]])
+    with pytest.raises(ValueError):
+        matrix.nearest_by_tags([B], k=1, metric="euclidean")
+    with pytest.raises(KeyError):
+        matrix.nearest_by_tags([B + "X"], k=1)
+
+
+@pytest.mark.parametrize("metric", ["jaccard", "cosine"])
+def test_nearest_by_tags_matches_dense_computation(metric: str):
+    rng = np.random.default_rng(0)
+    # few tags and many ties, some tracks without tags, more than 64 tags in total
+    dense = rng.random((150, 70)) < np.linspace(0.002, 0.1, 70)
+    assert not dense.any(axis=1).all()
+    track_ids = np.array([f"TR{i:016d}" for i in range(150)], dtype="S18")
+    matrix = TagMatrix(np.packbits(dense, axis=1), track_ids, [""] * 70)
+    tags = dense.astype(np.int64)
+    shared, counts = tags @ tags.T, tags.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if metric == "jaccard":
+            expected = shared / (counts[:, None] + counts[None, :] - shared)
+        else:
+            expected = shared / np.sqrt(np.outer(counts, counts))
+    expected = np.nan_to_num(expected)
+    np.fill_diagonal(expected, -np.inf)
+
+    for k in [1, 10, 149]:
+        ids, scores = matrix.nearest_by_tags(track_ids.astype(str), k, metric)
+        for row in range(150):
+            order = np.lexsort((np.arange(150), -expected[row]))[:k]
+            assert ids[row].tolist() == track_ids[order].astype(str).tolist()
+            assert np.allclose(scores[row], expected[row][order])
@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+import lastfm_dataset
+from lastfm_dataset import tracing
+from lastfm_dataset.get import (
+    get_connection,
+    get_similars,
+    get_tracks_by_ids,
+    iter_tracks,
+)
+from tests.conftest import TRACK_IDS
+
+
+@pytest.fixture()
+def db_path(tiny_db: sqlite3.Connection, tmp_path) -> str:
+    yield str(tmp_path / "dataset.db")
+    tracing.disable()
+    lastfm_dataset.init(None)
+
+
+def test_normalize_sql():
+    sql = """
+        SELECT * FROM tracks
+        WHERE track_id IN (?,?, ?);
+    """
+    assert (
+        tracing.normalize_sql(sql) == "SELECT * FROM tracks WHERE track_id IN (?, ...);"
+    )
+
+
+def test_disabled_by_default(db_path: str):
+    assert tracing.connection_factory() is sqlite3.Connection
+    assert tracing.snapshot() == {}
+    with get_connection(db_path) as con:
+        assert type(con.execute("SELECT 1;")) is sqlite3.Cursor
+
+
+def test_functions_and_statements_are_recorded(db_path: str):
+    tracing.enable()
+    with get_connection(db_path) as con:
+        assert len(get_tracks_by_ids(con, TRACK_IDS[:2])) == 2
+        get_similars(con, TRACK_IDS)
+        assert len(list(iter_tracks(con, fetch_size=2))) == 3
+
+    snapshot = tracing.snapshot()
+    functions = snapshot["functions"]
+    assert functions["get_tracks_by_ids"]["count"] == 1
+    assert functions["get_tracks_by_ids"]["rows"] == 2
+    assert functions["iter_tracks"]["rows"] == 3
+    assert sum(functions["get_similars"]["buckets"].values()) == 1
+
+    statement = snapshot["statements"][
+        "SELECT * FROM tracks WHERE track_id IN (?, ...);"
+    ]
+    assert statement["count"] == 1
+    assert statement["rows"] == 2
+    assert statement["functions"] == ["get_tracks_by_ids"]
+    # iter_tracks pages through the table with two statements
+    paged = [
+        s for s in snapshot["statements"].values() if "iter_tracks" in s["functions"]
+    ]
+    assert sum(s["rows"] for s in paged) == 3
+    assert snapshot["slow_queries"] == []
+
+    assert tracing.snapshot(reset=True)["functions"]
+    assert tracing.snapshot()["functions"] == {}
+
+
+def test_slow_queries_are_sampled_with_their_plan(db_path: str):
+    tracing.enable(slow_ms=0, max_samples=2)
+    with get_connection(db_path) as con:
+        get_tracks_by_ids(con, TRACK_IDS)
+        con.execute("SELECT count(*) FROM users;").fetchone()
+        get_similars(con, TRACK_IDS)
+
+    samples = tracing.snapshot()["slow_queries"]
+    assert len(samples) == 2
+    sample = samples[-1]
+    assert sample["function"] == "get_similars"
+    assert sample["rows"] == 3
+    assert sample["parameters"] == [repr(_id) for _id in TRACK_IDS]
+    assert any("similar" in line for line in sample["plan"])
+
+
+def test_pool_connections_are_traced(db_path: str):
+    lastfm_dataset.init(db_path, trace=True)
+    assert isinstance(lastfm_dataset._POOL.connection(), tracing.TracedConnection)
+    assert len(get_tracks_by_ids(TRACK_IDS)) == 3
+    assert tracing.snapshot()["functions"]["get_tracks_by_ids"]["count"] == 1
+
+    lastfm_dataset.init(db_path, trace=False)
+    assert not tracing.enabled()
+
+
+def test_periodic_dump(db_path: str, tmp_path):
+    path = tmp_path / "trace.json"
+    tracing.enable(dump_path=str(path), dump_interval=0.01)
+    with get_connection(db_path) as con:
+        get_tracks_by_ids(con, TRACK_IDS)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if path.exists() and "get_tracks_by_ids" in path.read_text():
+            break
+        time.sleep(0.01)
+    tracing.disable()
+    dumped = json.loads(path.read_text())
+    assert dumped["functions"]["get_tracks_by_ids"]["rows"] == 3
+
+
+def test_enable_from_env(db_path: str):
+    tracing.enable_from_env({})
+    assert not tracing.enabled()
+    tracing.enable_from_env(
+        {"LASTFM_DATASET_TRACE": "1", "LASTFM_DATASET_TRACE_SLOW_MS": "5"}
+    )
+    assert tracing.snapshot()["slow_ms"] == 5